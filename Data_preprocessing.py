@@ -1,90 +1,398 @@
+import argparse
+import bisect
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import fitz
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai.embeddings import OpenAIEmbeddings
 import re
 from tqdm import tqdm
 import faiss
 import numpy as np
-import pickle  # Import pickle for serialization
+from document_store import DocumentStore
+from context_packer import count_tokens, encoding_name
+from embedding_pipeline import embed_stream, embed_texts
+from idiom_catalog import parse_idiom_entries, record_text, write_catalog
+from intent_classifier import labels_path, write_labels
+from lexical_index import LexicalIndex
+from index_backends import REMOVABLE_KINDS, IndexSpec, build_index, prepare_vectors, read_index_meta, write_index
 
-def extract_text_from_pdf(pdf_path, start_page=6, end_page_offset=6):
-    """Extracts text from a PDF, skipping the first and last few pages."""
-    try:
-        doc = fitz.open(pdf_path)
-        text = ""
+# The PDF opened once per extraction worker process
+_worker_doc = None
+
+def _open_worker_doc(pdf_path):
+    global _worker_doc
+    _worker_doc = fitz.open(pdf_path)
+
+def _extract_page_range(first, last):
+    return [(page_num + 1, _worker_doc[page_num].get_text()) for page_num in range(first, last)]
+
+def iter_pages_from_pdf(pdf_path, start_page=6, end_page_offset=6, workers=None, pages_per_task=8):
+    """
+    Yields the raw text of each page in order, skipping the first and last few pages.
+
+    Pages are extracted in ranges on a process pool (each worker opens the
+    PDF once) with only a few ranges in flight, so memory stays bounded
+    however long the book is.
+
+    Yields (page number, text) pairs.
+    """
+    with fitz.open(pdf_path) as doc:
         end_page = len(doc) - end_page_offset
-        
-        for page_num in tqdm(range(start_page, end_page), desc="Extracting text"):
-            page_text = doc[page_num].get_text()
-            page_text = re.sub(r'[^\x00-\x7F]+', '', page_text)
-            text += page_text
-            
-        doc.close()
-        return text
+    ranges = [(first, min(first + pages_per_task, end_page)) for first in range(start_page, end_page, pages_per_task)]
+    workers = min(workers or os.cpu_count() or 1, max(len(ranges), 1))
+
+    with tqdm(total=max(end_page - start_page, 0), desc="Extracting text") as progress:
+        if workers <= 1:
+            with fitz.open(pdf_path) as doc:
+                for page_num in range(start_page, end_page):
+                    yield page_num + 1, doc[page_num].get_text()
+                    progress.update(1)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_doc, initargs=(pdf_path,)) as executor:
+            pending = deque()
+            for first, last in ranges:
+                pending.append(executor.submit(_extract_page_range, first, last))
+                if len(pending) >= 2 * workers:
+                    pages = pending.popleft().result()
+                    progress.update(len(pages))
+                    yield from pages
+            while pending:
+                pages = pending.popleft().result()
+                progress.update(len(pages))
+                yield from pages
+
+def extract_pages_from_pdf(pdf_path, start_page=6, end_page_offset=6, workers=None):
+    """
+    Extracts the raw text of each page, skipping the first and last few pages.
+
+    Returns a list of (page number, text) pairs, or None on failure.
+    """
+    try:
+        return list(iter_pages_from_pdf(pdf_path, start_page, end_page_offset, workers))
     except Exception as e:
         print(f"Error extracting text from PDF: {str(e)}")
         return None
 
-def split_text_into_chunks(text, chunk_size=1000, chunk_overlap=200):
-    """Splits text into chunks using RecursiveCharacterTextSplitter."""
-    text_splitter = RecursiveCharacterTextSplitter(
+def pages_to_text(pages):
+    """
+    Joins extracted pages into one ASCII text.
+
+    Returns the text and a list of (character offset, page number) pairs
+    marking where each page starts.
+    """
+    parts = []
+    page_starts = []
+    offset = 0
+    for page_num, page_text in pages:
+        page_text = re.sub(r'[^\x00-\x7F]+', '', page_text)
+        page_starts.append((offset, page_num))
+        parts.append(page_text)
+        offset += len(page_text)
+    return "".join(parts), page_starts
+
+def extract_text_from_pdf(pdf_path, start_page=6, end_page_offset=6):
+    """
+    Extracts text from a PDF, skipping the first and last few pages.
+
+    Returns the text and a list of (character offset, page number) pairs
+    marking where each page starts, or (None, None) on failure.
+    """
+    pages = extract_pages_from_pdf(pdf_path, start_page, end_page_offset)
+    if pages is None:
+        return None, None
+    return pages_to_text(pages)
+
+def _text_splitter(chunk_size, chunk_overlap):
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=len,
-        separators=["\n\n", "\n", " ", ""]
+        separators=["\n\n", "\n", " ", ""],
+        add_start_index=True
     )
-    return text_splitter.create_documents([text])
 
-def create_embeddings(docs):
-    """Creates embeddings for each document chunk."""
-    embeddings = OpenAIEmbeddings()
-    embedded_docs = []
-    for doc in tqdm(docs, desc="Embedding chunks"):
-        try:
-            embedding = embeddings.embed_query(doc.page_content)
-            embedded_docs.append(embedding)
-        except Exception as e:
-            print(f"Error embedding chunk: {str(e)}")
+def _tag_pages(docs, page_starts):
+    """Sets each chunk's source page from (offset, page number) pairs sorted by offset."""
+    offsets = [start for start, _ in page_starts]
+    for doc in docs:
+        position = bisect.bisect_right(offsets, doc.metadata["start_index"]) - 1
+        doc.metadata["page"] = page_starts[max(position, 0)][1]
+
+def split_text_into_chunks(text, chunk_size=1000, chunk_overlap=200, page_starts=None):
+    """Splits text into chunks using RecursiveCharacterTextSplitter, tagging each with its source page."""
+    docs = _text_splitter(chunk_size, chunk_overlap).create_documents([text])
+    if page_starts:
+        _tag_pages(docs, page_starts)
+    return docs
+
+def iter_chunks(pages, chunk_size=1000, chunk_overlap=200, window_chunks=16):
+    """
+    Splits a stream of pages into chunks as they arrive, tagging each with its source page.
+
+    Only a window of about window_chunks chunks of text is held. When it
+    fills, every chunk but the last two is emitted and splitting resumes
+    from the start of the second-to-last, so chunks run across page
+    boundaries as they would when splitting the whole text at once.
+    start_index stays relative to the full text.
+    """
+    splitter = _text_splitter(chunk_size, chunk_overlap)
+    buffer, base = "", 0
+    page_starts = []
+
+    for page_num, page_text in pages:
+        page_starts.append((base + len(buffer), page_num))
+        buffer += re.sub(r'[^\x00-\x7F]+', '', page_text)
+        if len(buffer) < window_chunks * chunk_size:
+            continue
+
+        docs = splitter.create_documents([buffer])
+        if len(docs) <= 2:
             continue
-    return embedded_docs
-
-def create_faiss_index(embedded_docs):
-    """Creates a FAISS index from the embedded documents."""
-    embedding_matrix = np.array(embedded_docs).astype('float32')
-    dimension = embedding_matrix.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embedding_matrix)
-    faiss.write_index(index, "faiss_index.idx")
-    print("FAISS index created and saved.")
+        for doc in docs:
+            doc.metadata["start_index"] += base
+        _tag_pages(docs, page_starts)
+        yield from docs[:-2]
+
+        resume = docs[-2].metadata["start_index"]
+        buffer, base = buffer[resume - base:], resume
+        # Keep the page the resumed text starts on and every later one
+        while len(page_starts) > 1 and page_starts[1][0] <= base:
+            page_starts.pop(0)
+
+    if buffer:
+        docs = splitter.create_documents([buffer])
+        for doc in docs:
+            doc.metadata["start_index"] += base
+        _tag_pages(docs, page_starts)
+        yield from docs
+
+def create_embeddings(docs, embedder=None, **pipeline_options):
+    """Creates embeddings for the document chunks in batched, concurrent API calls."""
+    return embed_texts([doc.page_content for doc in docs], embedder=embedder, **pipeline_options)
+
+def create_faiss_index(embedded_docs, ids=None, index_path="faiss_index.idx", spec=None):
+    """Creates an ID-mapped FAISS index from the embedded documents, saving its spec alongside."""
+    spec = spec or IndexSpec()
+    # The ID map lets incremental builds remove and add chunks by ID
+    index = build_index(embedded_docs, spec, ids)
+    write_index(index, spec, index_path)
+    print(f"FAISS index ({spec.kind}) created and saved.")
     return index
 
 def display_vectors(index, num_vectors=5):
     """Displays a specified number of vectors from the FAISS index."""
-    vectors = index.reconstruct_n(0, num_vectors)
-    for i, vector in enumerate(vectors):
-        print(f"Vector {i}: {vector}")
+    ids = faiss.vector_to_array(index.id_map)[:num_vectors]
+    for doc_id in ids:
+        try:
+            print(f"Vector {doc_id}: {index.reconstruct(int(doc_id))}")
+        except RuntimeError:
+            # IVF indexes only reconstruct with a direct map
+            print(f"Vector {doc_id}: not reconstructable from this index type")
+            break
 
-def save_vectors(embedded_docs, filename="vectors.pkl"):
-    """Saves the embedded documents to a file using pickle."""
-    with open(filename, 'wb') as f:
-        pickle.dump(embedded_docs, f)
-    print(f"Vectors saved to {filename}")
+def save_document_store(ids, docs, embedded_docs, path="docstore", model="gpt-4o-mini"):
+    """Saves chunk text, source pages, embeddings and prompt token counts as a memory-mappable document store."""
+    texts = [doc.page_content for doc in docs]
+    DocumentStore.write(
+        path,
+        ids,
+        texts,
+        [doc.metadata.get("page", 0) for doc in docs],
+        embedded_docs,
+        # Counted once here so prompt packing never re-tokenizes corpus chunks
+        tokens=[count_tokens(text, model) for text in texts],
+        token_encoding=encoding_name(model)
+    )
+    print(f"Document store saved to {path}")
 
-def main():
-    pdf_path = "idioms.pdf"
-    text = extract_text_from_pdf(pdf_path)
-    if text is None:
-        raise Exception("Failed to extract text from PDF")
-    
-    docs = split_text_into_chunks(text)
-    embedded_docs = create_embeddings(docs)
+def save_lexical_index(ids, docs, path="lexical"):
+    """Saves the BM25/phrase inverted index over the chunk text."""
+    LexicalIndex.write(path, ids, [doc.page_content for doc in docs])
+    print(f"Lexical index saved to {path}")
+
+def save_labels(ids, embedded_docs, index_path="faiss_index.idx", embedder=None):
+    """Saves tone/topic/level centroids and each chunk's confident labels next to the index."""
+    write_labels(index_path, ids, embedded_docs, embedder=embedder)
+    print(f"Labels saved to {labels_path(index_path)}")
+
+def chunk_hash(text):
+    """Returns the content hash used to identify a chunk across builds."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_manifest(manifest_path="index_manifest.json"):
+    """Loads the chunk-hash manifest, or returns None if there is none."""
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(chunk_ids, next_id, params, manifest_path="index_manifest.json"):
+    """Saves the mapping of chunk content hashes to index IDs."""
+    manifest = {
+        "version": 1,
+        "params": params,
+        "next_id": next_id,
+        "chunks": chunk_ids
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    print(f"Manifest saved to {manifest_path}")
+
+def iter_unique_chunks(docs):
+    """Yields (hash, document) pairs in document order, dropping duplicate chunks."""
+    seen = set()
+    for doc in docs:
+        digest = chunk_hash(doc.page_content)
+        if digest not in seen:
+            seen.add(digest)
+            yield digest, doc
+
+def unique_chunks(docs):
+    """Returns (hash, document) pairs in document order, dropping duplicate chunks."""
+    return list(iter_unique_chunks(docs))
+
+def build_full(docs, params, index_path="faiss_index.idx", docstore_path="docstore",
+               manifest_path="index_manifest.json", embedder=None, spec=None, lexical_path="lexical"):
+    """
+    Embeds every chunk and writes a fresh index, document store, lexical index, chunk labels and manifest.
+
+    docs may be a generator (see iter_chunks); chunks are embedded as they
+    arrive, overlapping embedding with extraction and chunking.
+    """
+    chunks = []
+
+    def chunk_texts():
+        for digest, doc in iter_unique_chunks(docs):
+            chunks.append((digest, doc))
+            yield doc.page_content
+
+    with tqdm(desc="Embedding chunks") as progress:
+        embedded_docs = list(embed_stream(chunk_texts(), embedder=embedder, progress=progress))
+    chunk_docs = [doc for _, doc in chunks]
     print(f"Successfully processed {len(embedded_docs)} chunks")
+
+    ids = list(range(len(chunks)))
+    index = create_faiss_index(embedded_docs, ids, index_path, spec)
+    save_document_store(ids, chunk_docs, embedded_docs, docstore_path)
+    save_lexical_index(ids, chunk_docs, lexical_path)
+    save_labels(ids, embedded_docs, index_path, embedder)
+    save_manifest({h: i for (h, _), i in zip(chunks, ids)}, len(ids), params, manifest_path)
+    return index
+
+def build_incremental(docs, params, index_path="faiss_index.idx", docstore_path="docstore",
+                      manifest_path="index_manifest.json", embedder=None, spec=None, lexical_path="lexical"):
+    """
+    Applies only the changed chunks to the existing index.
+
+    Chunks whose content hash is already in the manifest keep their index ID
+    and embedding; new chunks are embedded and added, and chunks that no
+    longer appear are removed. When a different index spec is requested, or
+    the index kind cannot remove vectors (HNSW), the index is rebuilt from
+    the stored embeddings, still embedding only the new chunks. The lexical
+    index and chunk labels are simply rebuilt (the label centroids take one
+    small embeddings call). Falls back to a full build when there is no
+    usable manifest or ID-mapped index.
+    """
+    manifest = load_manifest(manifest_path)
+    if manifest is None or not os.path.exists(index_path) or not os.path.isdir(docstore_path):
+        print("No existing manifest/index found, running a full build")
+        return build_full(docs, params, index_path, docstore_path, manifest_path, embedder, spec, lexical_path)
+
+    index = faiss.read_index(index_path)
+    if not isinstance(index, faiss.IndexIDMap2):
+        print("Existing index is not ID-mapped, running a full build")
+        return build_full(docs, params, index_path, docstore_path, manifest_path, embedder, spec, lexical_path)
+
+    existing_spec = IndexSpec.from_dict(read_index_meta(index_path)["spec"])
+    target_spec = spec or existing_spec
+    rebuild = target_spec != existing_spec or target_spec.kind not in REMOVABLE_KINDS
+
+    old_ids = manifest["chunks"]
+    next_id = manifest["next_id"]
+    chunks = unique_chunks(docs)
+    new_hashes = {h for h, _ in chunks}
+
+    removed = [doc_id for h, doc_id in old_ids.items() if h not in new_hashes]
+    added = [(h, doc) for h, doc in chunks if h not in old_ids]
+    print(f"Incremental build: {len(added)} new, {len(removed)} removed, "
+          f"{len(chunks) - len(added)} unchanged chunks")
+
+    # Unchanged embeddings come from the existing store; quantized indexes cannot reconstruct them exactly
+    store = DocumentStore(docstore_path)
+    embeddings = {old_ids[h]: np.array(store.embedding(old_ids[h])) for h, _ in chunks if h in old_ids}
+    store.close()
+
+    chunk_ids = {h: old_ids[h] for h, _ in chunks if h in old_ids}
+    new_ids = np.arange(next_id, next_id + len(added), dtype='int64')
+    if added:
+        embedded_docs = create_embeddings([doc for _, doc in added], embedder=embedder)
+        for (h, _), doc_id, embedding in zip(added, new_ids, embedded_docs):
+            chunk_ids[h] = int(doc_id)
+            embeddings[int(doc_id)] = embedding
+        next_id += len(added)
+
+    ids = [chunk_ids[h] for h, _ in chunks]
+    if rebuild:
+        print(f"Rebuilding {target_spec.kind} index from stored embeddings")
+        index = create_faiss_index([embeddings[doc_id] for doc_id in ids], ids, index_path, target_spec)
+    else:
+        if removed:
+            index.remove_ids(np.array(removed, dtype='int64'))
+        if added:
+            index.add_with_ids(prepare_vectors(embedded_docs, target_spec), new_ids)
+        write_index(index, target_spec, index_path)
+        print("FAISS index updated and saved.")
+
+    save_document_store(ids, [doc for _, doc in chunks], [embeddings[doc_id] for doc_id in ids], docstore_path)
+    save_lexical_index(ids, [doc for _, doc in chunks], lexical_path)
+    save_labels(ids, [embeddings[doc_id] for doc_id in ids], index_path, embedder)
+    save_manifest(chunk_ids, next_id, params, manifest_path)
+    return index
+
+def build_catalog(pages, catalog_path="catalog", embedder=None):
+    """Parses the vocabulary sections into per-idiom records, embeds them and writes the catalog."""
+    records = parse_idiom_entries(pages)
+    if not records:
+        print("No idiom entries found, skipping the catalog")
+        return records
+    embeddings = embed_texts([record_text(record) for record in records], embedder=embedder)
+    write_catalog(catalog_path, records, embeddings)
+    print(f"Catalog of {len(records)} idioms saved to {catalog_path}")
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the idioms FAISS index from a PDF.")
+    parser.add_argument("--pdf", default="idioms.pdf", help="Source PDF")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed chunks that changed since the last build")
+    parser.add_argument("--index-spec", type=IndexSpec.parse, default=None,
+                        help="Index to build, e.g. flat, flat_ip, ivf_flat:nlist=256, ivf_pq:pq_m=64, hnsw:hnsw_m=32")
+    parser.add_argument("--catalog", default="catalog", help="Directory for the structured idiom catalog")
+    parser.add_argument("--no-catalog", action="store_true", help="Skip building the idiom catalog")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes extracting PDF pages (defaults to the number of cores)")
+    args = parser.parse_args()
+
+    # Pages stream from the extraction pool through chunking into embedding
+    pages = iter_pages_from_pdf(args.pdf, workers=args.workers)
+    docs = iter_chunks(pages, args.chunk_size, args.chunk_overlap)
+    params = {"pdf": args.pdf, "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap}
     
-    index = create_faiss_index(embedded_docs)
+    if args.incremental:
+        index = build_incremental(docs, params, spec=args.index_spec)
+    else:
+        index = build_full(docs, params, spec=args.index_spec)
     display_vectors(index)
-    
-    # Save the vectors using pickle
-    save_vectors(embedded_docs)
+
+    if not args.no_catalog:
+        # A second streaming pass, rather than holding every page's text in memory
+        build_catalog(iter_pages_from_pdf(args.pdf, workers=args.workers), args.catalog)
 
 if __name__ == "__main__":
     main()
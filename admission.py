@@ -0,0 +1,418 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional
+
+import httpx
+import openai
+
+from metrics import ADMISSION_EVENTS, UPSTREAM_INFLIGHT, UPSTREAM_LIMIT
+
+# Upstream endpoints guarded separately: a slow chat model should not starve embeddings
+ENDPOINTS = ("embeddings", "chat")
+
+# Failures that say the upstream is unhealthy (after the SDK's own retries), as opposed to a bad request.
+# A stream cut off midway raises the transport error itself, unwrapped by the SDK.
+UPSTREAM_FAILURES = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError,
+                     httpx.TransportError)
+
+
+class Overloaded(Exception):
+    def __init__(self, message: str, retry_after: float = 1.0):
+        """
+        Raised instead of calling upstream when it cannot take more work.
+
+        Args:
+            message: What was refused and why
+            retry_after: Seconds the client should wait before retrying
+        """
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class CircuitOpen(Overloaded):
+    """Raised while an endpoint's circuit breaker is open."""
+
+
+class _Waiter:
+    """A queued caller: a thread waiting on an Event, or a coroutine awaiting a Future."""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial_limit: int = 16, min_limit: int = 2, max_limit: int = 64,
+                 max_queue: int = 32, queue_timeout: float = 2.0, tolerance: float = 2.0,
+                 backoff: float = 0.9, smoothing: float = 0.05):
+        """
+        Concurrency limit on one upstream endpoint that adapts to its latency (AIMD).
+
+        Each call that completes within tolerance times the baseline latency
+        of its kind (a slow moving average per route, so a 50-token rerank
+        and a full lesson are never compared) raises the limit by about one
+        per limit's worth of calls; a slower call, a timeout or an upstream
+        error multiplies it by backoff. Callers beyond the limit queue; past
+        max_queue waiters, or after queue_timeout in the queue, they get
+        Overloaded instead of piling up behind a slow upstream.
+
+        Args:
+            name: Endpoint label for metrics
+            initial_limit: Concurrent calls allowed before any latency is observed
+            min_limit: Floor for the limit
+            max_limit: Ceiling for the limit
+            max_queue: Callers allowed to wait for a slot
+            queue_timeout: Seconds a caller waits for a slot
+            tolerance: Latency, as a multiple of its kind's baseline, above which the limit shrinks
+            backoff: Factor applied to the limit on slow or failed calls
+            smoothing: Weight of each new sample in the baseline latency
+        """
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.baselines: Dict[str, float] = {}
+        self.inflight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        UPSTREAM_LIMIT.set(self.limit, endpoint=name)
+
+    def _try_acquire(self, waiter: Optional[_Waiter] = None) -> Optional[_Waiter]:
+        """Take a slot, or queue the given waiter; returns the waiter when queued."""
+        with self._lock:
+            if self.inflight < int(self.limit) and not self._waiters:
+                self.inflight += 1
+                UPSTREAM_INFLIGHT.set(self.inflight, endpoint=self.name)
+                return None
+            if len(self._waiters) >= self.max_queue:
+                ADMISSION_EVENTS.inc(endpoint=self.name, event="rejected")
+                raise Overloaded(f"Too many {self.name} calls queued", self._retry_after())
+            waiter = waiter or _Waiter()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Leave the queue after a timeout; False if a slot was handed over meanwhile."""
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                ADMISSION_EVENTS.inc(endpoint=self.name, event="timed_out")
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """Wait for a slot, raising Overloaded when the queue is full or the wait times out."""
+        waiter = self._try_acquire()
+        if waiter is not None and not waiter.event.wait(self.queue_timeout) and self._abandon(waiter):
+            raise Overloaded(f"Timed out waiting for a {self.name} slot", self._retry_after())
+
+    async def aacquire(self) -> None:
+        """Async variant of acquire; waits without blocking the event loop."""
+        waiter = self._try_acquire(_Waiter(asyncio.get_running_loop()))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise Overloaded(f"Timed out waiting for a {self.name} slot", self._retry_after())
+        except asyncio.CancelledError:
+            # The request went away while queued; give back a slot that was already handed over
+            if not self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self, latency: Optional[float] = None, failed: bool = False, kind: Optional[str] = None) -> None:
+        """
+        Free a slot and adapt the limit.
+
+        Args:
+            latency: Seconds the call took (None when it was interrupted, which leaves the limit alone)
+            failed: The upstream timed out or returned an error
+            kind: What kind of call it was (its route); latency is compared with this kind's baseline
+        """
+        with self._lock:
+            self.inflight -= 1
+            kind = kind or self.name
+            if failed:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            elif latency is not None:
+                baseline = self.baselines.get(kind)
+                if baseline is not None and latency > self.tolerance * baseline:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.baselines[kind] = latency if baseline is None else \
+                    baseline + self.smoothing * (latency - baseline)
+            # Hand freed slots straight to queued callers, oldest first
+            while self._waiters and self.inflight < int(self.limit):
+                self.inflight += 1
+                self._waiters.popleft().wake()
+            UPSTREAM_LIMIT.set(self.limit, endpoint=self.name)
+            UPSTREAM_INFLIGHT.set(self.inflight, endpoint=self.name)
+
+    def shrink(self) -> None:
+        """Back the limit off for a failure reported after its call's slot was released."""
+        with self._lock:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            UPSTREAM_LIMIT.set(self.limit, endpoint=self.name)
+
+    def _retry_after(self) -> float:
+        # Roughly when the calls ahead will have finished
+        return max(self.baselines.values(), default=1.0)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "inflight": self.inflight,
+                "queued": len(self._waiters),
+                "baseline_seconds": {kind: round(baseline, 3) for kind, baseline in sorted(self.baselines.items())}
+            }
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Stop calling an endpoint that keeps failing, and try it again later.
+
+        After failure_threshold consecutive failures the breaker opens and
+        calls fail immediately with CircuitOpen. Once reset_timeout has passed
+        it lets a single probe call through (half-open) while other calls are
+        still refused: the probe's success closes it, its failure opens it for
+        another reset_timeout.
+
+        Args:
+            name: Endpoint label for metrics
+            failure_threshold: Consecutive failures that open the breaker
+            reset_timeout: Seconds the breaker stays open
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_timeout else "half_open"
+
+    def check(self) -> bool:
+        """
+        Raise CircuitOpen while the breaker is open, or half-open with its probe in flight.
+
+        Returns:
+            True when the caller is the half-open probe and must report back
+            (record_success, record_failure or end_probe)
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining <= 0 and not self.probing:
+                self.probing = True
+                return True
+        ADMISSION_EVENTS.inc(endpoint=self.name, event="circuit_open")
+        # While the probe runs, callers may retry as soon as it could have closed the breaker
+        raise CircuitOpen(f"Circuit breaker open for {self.name}", max(remaining, 1.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            tripped = self.opened_at is not None
+            if tripped or self.failures >= self.failure_threshold:
+                if not tripped:
+                    ADMISSION_EVENTS.inc(endpoint=self.name, event="circuit_opened")
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def end_probe(self) -> None:
+        """Let another probe through after one that said nothing about upstream health."""
+        with self._lock:
+            self.probing = False
+
+
+class AdmissionController:
+    def __init__(self, limiters: Optional[Dict[str, AdaptiveLimiter]] = None,
+                 breakers: Optional[Dict[str, CircuitBreaker]] = None):
+        """
+        Admission control for upstream calls: an adaptive limiter and a
+        circuit breaker per endpoint ("embeddings", "chat").
+
+        State is per process, like the client pool it guards.
+        """
+        self.limiters = limiters or {endpoint: AdaptiveLimiter(endpoint) for endpoint in ENDPOINTS}
+        self.breakers = breakers or {endpoint: CircuitBreaker(endpoint) for endpoint in ENDPOINTS}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Build a controller from ADMISSION_* and BREAKER_* environment variables."""
+        def number(name, default, cast=float):
+            value = os.environ.get(name)
+            return cast(value) if value else default
+
+        limiter_options = dict(
+            initial_limit=number("ADMISSION_INITIAL_LIMIT", 16, int),
+            min_limit=number("ADMISSION_MIN_LIMIT", 2, int),
+            max_limit=number("ADMISSION_MAX_LIMIT", 64, int),
+            max_queue=number("ADMISSION_MAX_QUEUE", 32, int),
+            queue_timeout=number("ADMISSION_QUEUE_TIMEOUT", 2.0),
+            tolerance=number("ADMISSION_LATENCY_TOLERANCE", 2.0)
+        )
+        breaker_options = dict(
+            failure_threshold=number("BREAKER_FAILURES", 5, int),
+            reset_timeout=number("BREAKER_RESET_TIMEOUT", 30.0)
+        )
+        return cls(
+            {endpoint: AdaptiveLimiter(endpoint, **limiter_options) for endpoint in ENDPOINTS},
+            {endpoint: CircuitBreaker(endpoint, **breaker_options) for endpoint in ENDPOINTS}
+        )
+
+    def is_open(self, endpoint: str) -> bool:
+        """Whether calls to the endpoint are currently refused outright."""
+        return self.breakers[endpoint].state == "open"
+
+    def _release_slot(self, admission: "Admission", error: Optional[BaseException]) -> None:
+        limiter = self.limiters[admission.endpoint]
+        if error is None:
+            limiter.release(time.perf_counter() - admission.start, kind=admission.kind)
+        else:
+            limiter.release(failed=isinstance(error, UPSTREAM_FAILURES), kind=admission.kind)
+
+    def _finish(self, admission: "Admission", error: Optional[BaseException]) -> None:
+        """Report how the whole call went, once its block ends (after any early release)."""
+        failed = isinstance(error, UPSTREAM_FAILURES)
+        if not admission.released:
+            admission.release(error)
+        elif failed:
+            # The slot went back at the first token, but a stream cut off midway still counts against the limit
+            self.limiters[admission.endpoint].shrink()
+        breaker = self.breakers[admission.endpoint]
+        if error is None:
+            breaker.record_success()
+        elif failed:
+            breaker.record_failure()
+        elif admission.probe:
+            # Bad requests, parse errors, a closed client stream: nothing to learn about upstream health
+            breaker.end_probe()
+
+    def _admitted(self, endpoint: str, kind: Optional[str], probe: bool) -> "Admission":
+        return Admission(self, endpoint, kind or endpoint, probe)
+
+    @contextmanager
+    def guard(self, endpoint: str, kind: Optional[str] = None) -> Iterator["Admission"]:
+        """
+        Admit one upstream call to endpoint, until the block ends or the
+        yielded Admission is released early (streams release at their first token).
+
+        Args:
+            endpoint: "embeddings" or "chat"
+            kind: The call's route, whose own latency baseline it is measured against
+
+        Raises:
+            CircuitOpen: The endpoint's breaker is open
+            Overloaded: No slot became free in time
+        """
+        probe = self.breakers[endpoint].check()
+        try:
+            self.limiters[endpoint].acquire()
+        except BaseException:
+            if probe:
+                self.breakers[endpoint].end_probe()
+            raise
+        admission = self._admitted(endpoint, kind, probe)
+        try:
+            yield admission
+        except BaseException as e:
+            self._finish(admission, e)
+            raise
+        self._finish(admission, None)
+
+    @asynccontextmanager
+    async def aguard(self, endpoint: str, kind: Optional[str] = None) -> AsyncIterator["Admission"]:
+        """Async variant of guard."""
+        probe = self.breakers[endpoint].check()
+        try:
+            await self.limiters[endpoint].aacquire()
+        except BaseException:
+            if probe:
+                self.breakers[endpoint].end_probe()
+            raise
+        admission = self._admitted(endpoint, kind, probe)
+        try:
+            yield admission
+        except BaseException as e:
+            self._finish(admission, e)
+            raise
+        self._finish(admission, None)
+
+    def stats(self) -> Dict:
+        return {
+            endpoint: {**self.limiters[endpoint].stats(), "breaker": self.breakers[endpoint].state}
+            for endpoint in self.limiters
+        }
+
+
+class Admission:
+    def __init__(self, controller: AdmissionController, endpoint: str, kind: str, probe: bool):
+        """
+        One admitted upstream call, holding a slot until released.
+
+        The slot and the outcome are separate: the slot can go back early
+        (release), while the breaker hears how the call went only when the
+        guarded block ends, so a stream failing midway still counts.
+
+        Args:
+            controller: Controller whose limiter and breaker the outcome is reported to
+            endpoint: Endpoint the slot belongs to
+            kind: Latency baseline the call is measured against
+            probe: The call is the breaker's half-open probe
+        """
+        self.controller = controller
+        self.endpoint = endpoint
+        self.kind = kind
+        self.probe = probe
+        self.start = time.perf_counter()
+        self.released = False
+
+    def release(self, error: Optional[BaseException] = None) -> None:
+        """
+        Free the slot and adapt the limit; later calls do nothing.
+
+        A stream releases at its first token, so its latency is the time to
+        first token and the slot is not held while the client reads the rest.
+        """
+        if not self.released:
+            self.released = True
+            self.controller._release_slot(self, error)
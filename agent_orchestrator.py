@@ -1,14 +1,24 @@
+import logging
 from typing import Dict, List, Optional
-from openai import OpenAI
 import json
 import faiss
 import numpy as np
+from id_bitset import IdBitset
+from openai_client import OpenAIClientFactory, default_client_factory
 from rag_system import RAGSystem
 
+logger = logging.getLogger(__name__)
+
 class AgentOrchestrator:
-    def __init__(self, rag_system: RAGSystem):
-        """Initialize the orchestrator with the RAG system."""
-        self.client = OpenAI()
+    def __init__(self, rag_system: RAGSystem, clients: Optional[OpenAIClientFactory] = None):
+        """
+        Initialize the orchestrator with the RAG system.
+
+        Args:
+            rag_system: RAGSystem used for retrieval and answers
+            clients: Shared OpenAI client factory (defaults to the process-wide one)
+        """
+        self.client = (clients or default_client_factory()).client()
         self.rag = rag_system
         
         # Define system prompts for different operations
@@ -50,7 +60,7 @@ class AgentOrchestrator:
             query_embedding = self.rag.embed_query(query)
             
             # Search for similar documents
-            similar_docs = self.rag.search_similar_documents(query_embedding, top_k)
+            similar_docs = self.rag.search_records(query_embedding, top_k, query)
             
             # Generate response using the retrieved documents and system prompt
             response = self.rag.generate_response(
@@ -60,20 +70,91 @@ class AgentOrchestrator:
             )
             
             # Parse and return the idioms
-            result = json.loads(response)
-            return {
-                "type": "search_result",
-                "message": "Here are some relevant idioms:",
-                "idioms": result.get("idioms", [])
-            }
+            return self._format_search_result(json.loads(response))
             
         except Exception as e:
-            print(f"Error retrieving idioms: {e}")
-            return {
-                "type": "error",
-                "message": "Failed to retrieve idioms",
-                "error": str(e)
-            }
+            logger.error("Error retrieving idioms: %s", e)
+            return self._format_search_error(e)
+
+    def retrieve_records(self, query: str, top_k: int = 3, exclude: Optional[IdBitset] = None) -> List[Dict]:
+        """
+        Retrieve ranked idiom records from the corpus without generating a response.
+        
+        Args:
+            query: Search query
+            top_k: Number of records to return
+            exclude: Chunk IDs to skip (see RAGSystem.retrieve)
+            
+        Returns:
+            List of records with text, score and source page; empty on failure
+        """
+        try:
+            return self.rag.retrieve(query, top_k, exclude)
+        except Exception as e:
+            logger.error("Error retrieving records: %s", e)
+            return []
+
+    async def aretrieve_records(self, query: str, top_k: int = 3, exclude: Optional[IdBitset] = None) -> List[Dict]:
+        """Async variant of retrieve_records."""
+        try:
+            return await self.rag.aretrieve(query, top_k, exclude)
+        except Exception as e:
+            logger.error("Error retrieving records: %s", e)
+            return []
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 3, max_concurrency: int = 8) -> List[Dict]:
+        """
+        Retrieve idioms for many queries at once.
+        
+        Args:
+            queries: User search queries
+            top_k: Number of idioms to retrieve per query
+            max_concurrency: Maximum chat completions in flight
+            
+        Returns:
+            One search result dictionary per query, in input order
+        """
+        results = self.rag.query_batch(
+            queries,
+            top_k=top_k,
+            max_concurrency=max_concurrency,
+            system_prompt=self.system_prompts["search"]
+        )
+        return [
+            self._format_search_result(result["response"]) if result["status"] == "success"
+            else self._format_search_error(Exception(result["error"]))
+            for result in results
+        ]
+
+    async def aretrieve_idioms(self, query: str, top_k: int = 3) -> Dict:
+        """Async variant of retrieve_idioms using the RAG system's async client."""
+        try:
+            query_embedding = await self.rag.aembed_query(query)
+            similar_docs = self.rag.search_records(query_embedding, top_k, query)
+            response = await self.rag.agenerate_response(
+                context=similar_docs,
+                query=query,
+                system_prompt=self.system_prompts["search"]
+            )
+            return self._format_search_result(json.loads(response))
+            
+        except Exception as e:
+            logger.error("Error retrieving idioms: %s", e)
+            return self._format_search_error(e)
+
+    def _format_search_result(self, result: Dict) -> Dict:
+        return {
+            "type": "search_result",
+            "message": "Here are some relevant idioms:",
+            "idioms": result.get("idioms", [])
+        }
+
+    def _format_search_error(self, error: Exception) -> Dict:
+        return {
+            "type": "error",
+            "message": "Failed to retrieve idioms",
+            "error": str(error)
+        }
             
     def process_query(self, query: str, mode: str = "search") -> Dict:
         """
@@ -96,7 +177,7 @@ class AgentOrchestrator:
                 }
                 
         except Exception as e:
-            print(f"Error processing query: {e}")
+            logger.error("Error processing query: %s", e)
             return {
                 "type": "error",
                 "message": "An error occurred while processing your request",
@@ -1,29 +1,108 @@
-from flask import Flask, jsonify, render_template, request, session
-from rag_system import RAGSystem
-from agent_orchestrator import AgentOrchestrator
-from teacher_agent import TeacherAgent
+from flask import Flask, Response, g, jsonify, render_template, request, session, stream_with_context
+from admission import Overloaded
+from services import Services, load_services
+import metrics
+from metrics import REQUEST_SECONDS
 import json
+import logging
+import os
+import threading
+import time
 import uuid
 import secrets
+from typing import Optional
 
 from dotenv import load_dotenv
 load_dotenv()
 
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+# HTTP client libraries log every request at DEBUG/INFO; keep them quiet unless asked
+for name in ("httpx", "httpcore", "openai"):
+    logging.getLogger(name).setLevel(os.environ.get("UPSTREAM_LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
-# Generate a secure random key
-app.secret_key = secrets.token_hex(32)
-
-# Initialize systems with error handling
-try:
-    rag = RAGSystem(
-        faiss_index_path="faiss_index.idx",
-        vectors_path="vectors.pkl"
-    )
-    orchestrator = AgentOrchestrator(rag)
-    teacher = TeacherAgent(orchestrator)
-except Exception as e:
-    print(f"Error initializing systems: {str(e)}")
-    raise
+# All workers must share the key to read each other's session cookies;
+# the random fallback only suits a single process
+app.secret_key = os.environ.get("SECRET_KEY") or secrets.token_hex(32)
+
+# Quick search answers from the idiom catalog ("catalog") or has the model write each answer ("generate")
+QUICK_SEARCH_MODE = os.environ.get("QUICK_SEARCH_MODE", "catalog")
+
+# Set by create_app; None until the index, stores and agents are loaded
+services: Optional[Services] = None
+rag = orchestrator = teacher = None
+_load_lock = threading.Lock()
+_loader: Optional[threading.Thread] = None
+
+# Endpoints that must answer while the app is still loading
+PROBE_ENDPOINTS = ('healthz', 'readyz', 'metrics_endpoint')
+
+def create_app() -> Flask:
+    """
+    Load the index, stores and agents, then return the app.
+
+    gunicorn.conf.py serves "app:create_app()" with preload_app, so this
+    runs once in the master and forked workers share the loaded (and
+    memory-mapped) data copy-on-write. Without preloading, each worker
+    loads on its first request instead.
+    """
+    global services, rag, orchestrator, teacher
+    with _load_lock:
+        if services is None:
+            try:
+                loaded = load_services()
+            except Exception as e:
+                logger.exception("Error initializing systems: %s", e)
+                raise
+            rag, orchestrator, teacher = loaded.rag, loaded.orchestrator, loaded.teacher
+            services = loaded
+    return app
+
+def _load_in_background():
+    """Start loading without blocking the caller (once per process)."""
+    global _loader
+    if services is None and (_loader is None or not _loader.is_alive()):
+        _loader = threading.Thread(target=create_app, name="load-services", daemon=True)
+        _loader.start()
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+    if services is None and request.endpoint not in PROBE_ENDPOINTS:
+        create_app()
+
+@app.after_request
+def record_request_time(response):
+    """Record request latency once the response is fully sent (streams included)."""
+    start = g.get('start_time')
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        response.call_on_close(
+            lambda: REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        )
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 with index size and load time once loaded, 503 while loading."""
+    if services is None:
+        _load_in_background()
+        return jsonify({'status': 'loading'}), 503
+    return jsonify(services.readiness())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for this worker process."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/', methods=['GET', 'POST'])
 def home():
@@ -32,7 +111,7 @@ def home():
         # Ensure user has a session ID
         if 'user_id' not in session:
             session['user_id'] = str(uuid.uuid4())
-            print(f"Created new session: {session['user_id']}")
+            logger.info("Created new session: %s", session['user_id'])
             # Get initial greeting without requiring a message
             initial_response = teacher.get_initial_greeting(session['user_id'])
             return render_template('index.html', initial_message=initial_response)
@@ -47,7 +126,7 @@ def home():
                     'error': 'Missing message or mode'
                 }), 400
             
-            print(f"Processing request - Session: {session['user_id']}, Mode: {mode}, Message: {message}")
+            logger.debug("Processing request - Session: %s, Mode: %s, Message: %s", session['user_id'], mode, message)
             
             try:
                 if mode == 'quick_search':
@@ -56,7 +135,7 @@ def home():
                             'status': 'error',
                             'error': 'Missing search query'
                         }), 400
-                    result = rag.query(message)
+                    result = rag.query(message, mode=QUICK_SEARCH_MODE)
                     return jsonify({
                         'status': 'success',
                         'response': json.loads(result)
@@ -80,8 +159,10 @@ def home():
                         'status': 'error',
                         'error': 'Invalid mode'
                     }), 400
+            except Overloaded:
+                raise
             except Exception as e:
-                print(f"Error processing message: {str(e)}")
+                logger.exception("Error processing message: %s", e)
                 return jsonify({
                     'status': 'error',
                     'error': 'Error processing your request'
@@ -89,20 +170,124 @@ def home():
             
         return render_template('index.html')
         
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"Unexpected error in route: {str(e)}")
+        logger.exception("Unexpected error in route: %s", e)
         return jsonify({
             'status': 'error',
             'error': 'An unexpected error occurred'
         }), 500
 
+# Upper bounds on queries per /batch request and completions in flight for it
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "500"))
+MAX_BATCH_CONCURRENCY = int(os.environ.get("MAX_BATCH_CONCURRENCY", "16"))
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Answer many quick-search queries in one request; results keep input order."""
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({
+            'status': 'error',
+            'error': 'Expected a non-empty list of query strings'
+        }), 400
+    if len(queries) > MAX_BATCH_SIZE:
+        return jsonify({
+            'status': 'error',
+            'error': f'At most {MAX_BATCH_SIZE} queries per batch'
+        }), 400
+    
+    try:
+        top_k = int(payload.get('top_k', 5))
+        max_concurrency = int(payload.get('max_concurrency', 8))
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'error': 'top_k and max_concurrency must be integers'
+        }), 400
+    if top_k < 1:
+        return jsonify({
+            'status': 'error',
+            'error': 'top_k must be at least 1'
+        }), 400
+    
+    try:
+        results = rag.query_batch(
+            [q.strip() for q in queries],
+            top_k=top_k,
+            max_concurrency=max(1, min(max_concurrency, MAX_BATCH_CONCURRENCY))
+        )
+    except Exception as e:
+        logger.exception("Error processing batch: %s", e)
+        return jsonify({
+            'status': 'error',
+            'error': 'Error processing your request'
+        }), 500
+    
+    return jsonify({
+        'status': 'success',
+        'results': results
+    })
+
+def _sse(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/stream', methods=['POST'])
+def stream():
+    """Stream quick-search idioms or the teacher's reply as server-sent events."""
+    message = request.form.get('message', '').strip()
+    mode = request.form.get('mode', '').strip()
+    
+    if not message:
+        return jsonify({
+            'status': 'error',
+            'error': 'Missing message'
+        }), 400
+    
+    if mode == 'quick_search':
+        events = rag.stream_query(message, mode=QUICK_SEARCH_MODE)
+    elif mode == 'learning':
+        if 'user_id' not in session:
+            return jsonify({
+                'status': 'error',
+                'error': 'No learning session'
+            }), 400
+        events = teacher.stream_message(message, session['user_id'])
+    else:
+        return jsonify({
+            'status': 'error',
+            'error': 'Invalid mode'
+        }), 400
+    
+    return Response(
+        stream_with_context(_sse(event, data) for event, data in events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    """Fail fast while OpenAI is overloaded or its circuit breaker is open, instead of queueing."""
+    logger.warning("Refusing request: %s", e)
+    response = jsonify({
+        'status': 'error',
+        'error': 'The service is busy, please retry shortly'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.errorhandler(Exception)
 def handle_error(e):
-    print(f"Unhandled error: {str(e)}")
+    logger.exception("Unhandled error: %s", e)
     return jsonify({
         'status': 'error',
         'error': 'An unexpected error occurred'
     }), 500 
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    create_app().run(debug=True) 
\ No newline at end of file
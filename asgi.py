@@ -0,0 +1,303 @@
+from quart import Quart, Response, g, jsonify, make_response, render_template, request, session
+from admission import Overloaded
+from services import Services, load_services
+import metrics
+from metrics import REQUEST_SECONDS
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import secrets
+from typing import Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+# HTTP client libraries log every request at DEBUG/INFO; keep them quiet unless asked
+for name in ("httpx", "httpcore", "openai"):
+    logging.getLogger(name).setLevel(os.environ.get("UPSTREAM_LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger(__name__)
+
+# Asyncio-native counterpart of app.py. Run it with:
+#   gunicorn -c gunicorn.conf.py "asgi:create_app()" -k uvicorn.workers.UvicornWorker
+# Each worker awaits OpenAI calls on one event loop, so a single process can
+# hold hundreds of in-flight requests instead of one per sync worker.
+app = Quart(__name__)
+# All workers must share the key to read each other's session cookies;
+# the random fallback only suits a single process
+app.secret_key = os.environ.get("SECRET_KEY") or secrets.token_hex(32)
+
+# Quick search answers from the idiom catalog ("catalog") or has the model write each answer ("generate")
+QUICK_SEARCH_MODE = os.environ.get("QUICK_SEARCH_MODE", "catalog")
+
+# Set by create_app; None until the index, stores and agents are loaded
+services: Optional[Services] = None
+rag = orchestrator = teacher = None
+_load_lock = threading.Lock()
+_loading: Optional[asyncio.Future] = None
+
+# Endpoints that must answer while the app is still loading
+PROBE_ENDPOINTS = ('healthz', 'readyz', 'metrics_endpoint')
+
+def create_app() -> Quart:
+    """
+    Load the index, stores and agents, then return the app.
+
+    Serve "asgi:create_app()" with preload_app (see gunicorn.conf.py) to
+    load once in the master and share the data with forked workers.
+    Without preloading, each worker loads on its first request instead.
+    """
+    global services, rag, orchestrator, teacher
+    with _load_lock:
+        if services is None:
+            try:
+                loaded = load_services()
+            except Exception as e:
+                logger.exception("Error initializing systems: %s", e)
+                raise
+            rag, orchestrator, teacher = loaded.rag, loaded.orchestrator, loaded.teacher
+            services = loaded
+    return app
+
+def _load_in_background() -> asyncio.Future:
+    """Load in a thread so the event loop keeps answering probes (once per process)."""
+    global _loading
+    if _loading is None or (_loading.done() and _loading.exception() is not None):
+        _loading = asyncio.get_running_loop().run_in_executor(None, create_app)
+    return _loading
+
+@app.before_request
+async def start_timer():
+    g.start_time = time.perf_counter()
+    if services is None and request.endpoint not in PROBE_ENDPOINTS:
+        await _load_in_background()
+
+@app.after_request
+async def record_request_time(response):
+    # Streams record their own time once the last event is sent
+    start = g.get('start_time')
+    if start is not None and response.mimetype != 'text/event-stream':
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.endpoint or 'unknown')
+    return response
+
+@app.route('/healthz')
+async def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+async def readyz():
+    """Readiness: 200 with index size and load time once loaded, 503 while loading."""
+    if services is None:
+        _load_in_background()
+        return jsonify({'status': 'loading'}), 503
+    return jsonify(services.readiness())
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    """Prometheus metrics for this worker process."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/', methods=['GET', 'POST'])
+async def home():
+    """Home page with chat interface."""
+    try:
+        # Ensure user has a session ID
+        if 'user_id' not in session:
+            session['user_id'] = str(uuid.uuid4())
+            logger.info("Created new session: %s", session['user_id'])
+            initial_response = await teacher.aget_initial_greeting(session['user_id'])
+            return await render_template('index.html', initial_message=initial_response)
+
+        if request.method == 'POST':
+            form = await request.form
+            message = form.get('message', '').strip()
+            mode = form.get('mode', '').strip()
+
+            if not mode:
+                return jsonify({
+                    'status': 'error',
+                    'error': 'Missing message or mode'
+                }), 400
+
+            try:
+                if mode == 'quick_search':
+                    if not message:
+                        return jsonify({
+                            'status': 'error',
+                            'error': 'Missing search query'
+                        }), 400
+                    result = await rag.aquery(message, mode=QUICK_SEARCH_MODE)
+                    return jsonify({
+                        'status': 'success',
+                        'response': json.loads(result)
+                    })
+                elif mode == 'learning':
+                    if not message:
+                        # Check if this is the first greeting or level question
+                        if 'greeted' not in session:
+                            session['greeted'] = True
+                            response = await teacher.aget_initial_greeting(session['user_id'])
+                        else:
+                            response = await teacher.aget_level_question(session['user_id'])
+                    else:
+                        response = await teacher.aprocess_message(message, session['user_id'])
+                    return jsonify({
+                        'status': 'success',
+                        'response': response
+                    })
+                else:
+                    return jsonify({
+                        'status': 'error',
+                        'error': 'Invalid mode'
+                    }), 400
+            except Overloaded:
+                raise
+            except Exception as e:
+                logger.exception("Error processing message: %s", e)
+                return jsonify({
+                    'status': 'error',
+                    'error': 'Error processing your request'
+                }), 500
+
+        return await render_template('index.html')
+
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error in route: %s", e)
+        return jsonify({
+            'status': 'error',
+            'error': 'An unexpected error occurred'
+        }), 500
+
+# Upper bounds on queries per /batch request and completions in flight for it
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "500"))
+MAX_BATCH_CONCURRENCY = int(os.environ.get("MAX_BATCH_CONCURRENCY", "16"))
+
+@app.route('/batch', methods=['POST'])
+async def batch():
+    """Answer many quick-search queries in one request; results keep input order."""
+    payload = await request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({
+            'status': 'error',
+            'error': 'Expected a non-empty list of query strings'
+        }), 400
+    if len(queries) > MAX_BATCH_SIZE:
+        return jsonify({
+            'status': 'error',
+            'error': f'At most {MAX_BATCH_SIZE} queries per batch'
+        }), 400
+    
+    try:
+        top_k = int(payload.get('top_k', 5))
+        max_concurrency = int(payload.get('max_concurrency', 8))
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'error': 'top_k and max_concurrency must be integers'
+        }), 400
+    if top_k < 1:
+        return jsonify({
+            'status': 'error',
+            'error': 'top_k must be at least 1'
+        }), 400
+    
+    try:
+        # query_batch fans out over its own thread pool; keep the event loop free meanwhile
+        results = await asyncio.to_thread(
+            rag.query_batch,
+            [q.strip() for q in queries],
+            top_k=top_k,
+            max_concurrency=max(1, min(max_concurrency, MAX_BATCH_CONCURRENCY))
+        )
+    except Exception as e:
+        logger.exception("Error processing batch: %s", e)
+        return jsonify({
+            'status': 'error',
+            'error': 'Error processing your request'
+        }), 500
+    
+    return jsonify({
+        'status': 'success',
+        'results': results
+    })
+
+def _sse(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/stream', methods=['POST'])
+async def stream():
+    """Stream quick-search idioms or the teacher's reply as server-sent events."""
+    form = await request.form
+    message = form.get('message', '').strip()
+    mode = form.get('mode', '').strip()
+
+    if not message:
+        return jsonify({
+            'status': 'error',
+            'error': 'Missing message'
+        }), 400
+
+    if mode == 'quick_search':
+        events = rag.astream_query(message, mode=QUICK_SEARCH_MODE)
+    elif mode == 'learning':
+        if 'user_id' not in session:
+            return jsonify({
+                'status': 'error',
+                'error': 'No learning session'
+            }), 400
+        events = teacher.astream_message(message, session['user_id'])
+    else:
+        return jsonify({
+            'status': 'error',
+            'error': 'Invalid mode'
+        }), 400
+
+    start = g.get('start_time', time.perf_counter())
+
+    async def generate():
+        try:
+            async for event, data in events:
+                yield _sse(event, data)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint='stream')
+
+    response = await make_response(generate(), {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.mimetype = 'text/event-stream'
+    response.timeout = None
+    return response
+
+@app.errorhandler(Overloaded)
+async def handle_overloaded(e):
+    """Fail fast while OpenAI is overloaded or its circuit breaker is open, instead of queueing."""
+    logger.warning("Refusing request: %s", e)
+    response = jsonify({
+        'status': 'error',
+        'error': 'The service is busy, please retry shortly'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(Exception)
+async def handle_error(e):
+    logger.exception("Unhandled error: %s", e)
+    return jsonify({
+        'status': 'error',
+        'error': 'An unexpected error occurred'
+    }), 500
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
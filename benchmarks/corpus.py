@@ -0,0 +1,76 @@
+import os
+import time
+from typing import Dict, Optional
+
+import Data_preprocessing as preprocessing
+from embedding_pipeline import FakeEmbedder
+from index_backends import IndexSpec
+
+
+def build_offline_corpus(workdir: str, pdf: str = "idioms.pdf", dimension: int = 1536,
+                         embedding_latency: float = 0.0, spec: Optional[IndexSpec] = None,
+                         chunk_size: int = 1000, chunk_overlap: int = 200) -> Dict[str, float]:
+    """
+    Run the preprocessing pipeline into workdir with FakeEmbedder, so no API calls are made.
+
+    The embeddings match what the mock server returns for the same text and
+    dimension, so the corpus can be served against it.
+
+    Args:
+        workdir: Directory for the index, document store, lexical index and catalog
+        pdf: Source PDF
+        dimension: Embedding size
+        embedding_latency: Simulated seconds per embeddings call
+        spec: Index to build (defaults to exact flat L2)
+        chunk_size: Characters per chunk
+        chunk_overlap: Characters shared by neighbouring chunks
+
+    Returns:
+        Seconds spent in each stage (extract, chunk, build, catalog)
+    """
+    os.makedirs(workdir, exist_ok=True)
+    paths = corpus_paths(workdir)
+    embedder = FakeEmbedder(dimension=dimension, latency=embedding_latency)
+    timings = {}
+
+    start = time.perf_counter()
+    pages = preprocessing.extract_pages_from_pdf(pdf)
+    if pages is None:
+        raise Exception(f"Failed to extract text from {pdf}")
+    text, page_starts = preprocessing.pages_to_text(pages)
+    timings["extract"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    docs = preprocessing.split_text_into_chunks(text, chunk_size, chunk_overlap, page_starts)
+    timings["chunk"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preprocessing.build_full(
+        docs,
+        {"pdf": pdf, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+        index_path=paths["FAISS_INDEX_PATH"],
+        docstore_path=paths["DOCSTORE_PATH"],
+        manifest_path=os.path.join(workdir, "index_manifest.json"),
+        embedder=embedder,
+        spec=spec,
+        lexical_path=paths["LEXICAL_INDEX_PATH"]
+    )
+    timings["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preprocessing.build_catalog(pages, paths["CATALOG_PATH"], embedder=embedder)
+    timings["catalog"] = time.perf_counter() - start
+    return timings
+
+
+def corpus_paths(workdir: str) -> Dict[str, str]:
+    """Environment variables pointing the app's data files and stores at workdir."""
+    return {
+        "FAISS_INDEX_PATH": os.path.join(workdir, "faiss_index.idx"),
+        "DOCSTORE_PATH": os.path.join(workdir, "docstore"),
+        "LEXICAL_INDEX_PATH": os.path.join(workdir, "lexical"),
+        "CATALOG_PATH": os.path.join(workdir, "catalog"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.db"),
+        "SESSION_STORE_URL": "sqlite:///" + os.path.join(workdir, "sessions.db"),
+        "GREETING_POOL_PATH": os.path.join(workdir, "greetings.db")
+    }
@@ -0,0 +1,230 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from benchmarks.corpus import build_offline_corpus, corpus_paths
+from benchmarks.mock_openai import Latency, MockOpenAIServer
+
+FLOWS = ("quick_search", "learning")
+
+QUICK_SEARCH_QUERIES = [
+    "break the ice",
+    "idioms about money",
+    "a sarcastic way to say good job",
+    "feeling under the weather",
+    "idioms for working hard",
+    "spill the beans",
+    "happy idioms about success",
+    "cost an arm and a leg"
+]
+
+# One learner's side of a lesson; the mock's replies walk the teacher's state machine
+LEARNING_MESSAGES = [
+    "Hi!",
+    "I'm intermediate",
+    "business idioms",
+    "I think it means to start a conversation",
+    "Can you teach me another one?",
+    "It means something is very expensive"
+]
+
+_SAMPLE = re.compile(r'^idiom_stage_seconds_(bucket|sum|count)\{stage="([^"]+)"(?:,le="([^"]+)")?\} (\S+)$')
+
+
+def stage_snapshot(metrics_text: str) -> Dict[str, Dict]:
+    """Parse idiom_stage_seconds from a /metrics scrape into {stage: {"sum", "count", "buckets"}}."""
+    stages: Dict[str, Dict] = defaultdict(lambda: {"sum": 0.0, "count": 0.0, "buckets": {}})
+    for line in metrics_text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        kind, stage, bound, value = match.groups()
+        if kind == "bucket":
+            stages[stage]["buckets"][float(bound)] = float(value)
+        else:
+            stages[stage][kind] = float(value)
+    return stages
+
+
+def stage_breakdown(before: Dict[str, Dict], after: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    Per-stage count, mean and p95 over the interval between two snapshots.
+
+    The p95 is the upper bound of the histogram bucket it falls in.
+    """
+    breakdown = {}
+    for stage, end in after.items():
+        start = before.get(stage, {"sum": 0.0, "count": 0.0, "buckets": {}})
+        count = end["count"] - start["count"]
+        if count <= 0:
+            continue
+        p95 = None
+        for bound in sorted(end["buckets"]):
+            if end["buckets"][bound] - start["buckets"].get(bound, 0.0) >= 0.95 * count:
+                p95 = bound
+                break
+        breakdown[stage] = {
+            "count": int(count),
+            "mean_ms": (end["sum"] - start["sum"]) / count * 1000,
+            "p95_ms": p95 * 1000 if p95 is not None and p95 != float("inf") else None
+        }
+    return breakdown
+
+
+def _summary(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    values = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99))
+    }
+
+
+def run_level(url: str, flow: str, concurrency: int, requests: int, timeout: float = 120.0) -> Dict:
+    """
+    Drive one flow of the home route with a fixed number of concurrent users.
+
+    Each user holds its own session cookie. Quick-search users open a
+    session first (untimed); learning users are timed from the greeting on
+    and cycle through LEARNING_MESSAGES.
+
+    Returns:
+        Summary with requests, errors, rps and p50/p95/p99 latency, plus the
+        per-stage breakdown read from /metrics
+    """
+    remaining = itertools.count()
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def timed_request(client: httpx.Client, method: str, data: Optional[Dict] = None) -> None:
+        start = time.perf_counter()
+        try:
+            response = client.request(method, "/", data=data)
+            ok = response.status_code == 200 and (method == "GET" or response.json().get("status") == "success")
+        except (httpx.HTTPError, ValueError):
+            ok = False
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            errors[0] += 0 if ok else 1
+
+    def user(number: int) -> None:
+        with httpx.Client(base_url=url, timeout=timeout) as client:
+            if flow == "quick_search":
+                client.get("/")
+            for turn in itertools.count():
+                if next(remaining) >= requests:
+                    return
+                if flow == "quick_search":
+                    query = QUICK_SEARCH_QUERIES[(number + turn) % len(QUICK_SEARCH_QUERIES)]
+                    timed_request(client, "POST", {"mode": "quick_search", "message": query})
+                elif turn == 0:
+                    timed_request(client, "GET")
+                else:
+                    message = LEARNING_MESSAGES[(turn - 1) % len(LEARNING_MESSAGES)]
+                    timed_request(client, "POST", {"mode": "learning", "message": message})
+
+    before = stage_snapshot(httpx.get(f"{url}/metrics", timeout=timeout).text)
+    threads = [threading.Thread(target=user, args=(number,)) for number in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    after = stage_snapshot(httpx.get(f"{url}/metrics", timeout=timeout).text)
+
+    return {
+        "flow": flow,
+        "concurrency": concurrency,
+        **_summary(latencies, errors[0], elapsed),
+        "stages": stage_breakdown(before, after)
+    }
+
+
+def serve_in_process(workdir: str, mock: MockOpenAIServer, quick_search_mode: str) -> Tuple[str, object]:
+    """Point the app at workdir and the mock, then serve it from a background thread."""
+    os.environ.update(corpus_paths(workdir))
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": mock.base_url,
+        "QUICK_SEARCH_MODE": quick_search_mode,
+        "SECRET_KEY": "benchmark",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING")
+    })
+    from werkzeug.serving import make_server
+
+    import app as flask_app
+    # The development server logs every request at INFO
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, flask_app.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name="app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def print_report(results: List[Dict]) -> None:
+    print(f"{'flow':<13} {'conc':>5} {'reqs':>6} {'errs':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in results:
+        print(f"{row['flow']:<13} {row['concurrency']:>5} {row['requests']:>6} {row['errors']:>5} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+        for stage, stats in sorted(row["stages"].items(), key=lambda item: -item[1]["mean_ms"] * item[1]["count"]):
+            p95 = f"{stats['p95_ms']:.1f}" if stats["p95_ms"] is not None else "-"
+            print(f"{'':<13} {stage:>20} x{stats['count']:<6} mean {stats['mean_ms']:>8.2f} ms  p95 <= {p95} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the home route's quick_search and learning flows against a local OpenAI stand-in."
+    )
+    parser.add_argument("--url", default=None,
+                        help="Running server to test (its workers must point OPENAI_BASE_URL at a mock); "
+                             "by default the app is served in-process")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="Comma-separated flows to run")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per flow and concurrency level")
+    parser.add_argument("--workdir", default=None, help="Corpus directory (built if missing; a temp dir by default)")
+    parser.add_argument("--pdf", default="idioms.pdf")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--embedding-latency", type=Latency.parse, default=Latency("fixed", 0.05))
+    parser.add_argument("--chat-latency", type=Latency.parse, default=Latency("lognormal", 0.6, 0.4))
+    parser.add_argument("--quick-search-mode", default=os.environ.get("QUICK_SEARCH_MODE", "catalog"),
+                        choices=("catalog", "generate"))
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        workdir = args.workdir or tempfile.mkdtemp(prefix="idiom-bench-")
+        if not os.path.exists(corpus_paths(workdir)["FAISS_INDEX_PATH"]):
+            print(f"Building offline corpus in {workdir}")
+            build_offline_corpus(workdir, args.pdf, args.dimension)
+        mock = MockOpenAIServer(dimension=args.dimension, embedding_latency=args.embedding_latency,
+                                chat_latency=args.chat_latency).start()
+        url, _ = serve_in_process(workdir, mock, args.quick_search_mode)
+
+    results = []
+    for flow in args.flows.split(","):
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            results.append(run_level(url, flow, concurrency, args.requests))
+            print_report(results[-1:])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, Dict
+
+import numpy as np
+
+from benchmarks.corpus import build_offline_corpus, corpus_paths
+from benchmarks.load_test import QUICK_SEARCH_QUERIES
+from embedding_pipeline import FakeEmbedder, embed_texts
+from index_backends import IndexSpec
+
+
+def time_calls(function: Callable[[int], object], calls: int, warmup: int = 10) -> Dict[str, float]:
+    """Call function(i) repeatedly and report per-call latency percentiles in milliseconds."""
+    for i in range(warmup):
+        function(i)
+    durations = []
+    for i in range(calls):
+        start = time.perf_counter()
+        function(i)
+        durations.append(time.perf_counter() - start)
+    values = np.asarray(durations) * 1000
+    return {
+        "calls": calls,
+        "p50_ms": float(np.percentile(values, 50)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean())
+    }
+
+
+def bench_search(workdir: str, dimension: int, calls: int, top_k: int = 5) -> Dict[str, Dict]:
+    """
+    Time RAGSystem.search_similar_documents on the offline corpus, dense
+    only and hybrid (with the query text for the lexical ranking).
+    """
+    from rag_system import RAGSystem
+
+    paths = corpus_paths(workdir)
+    rag = RAGSystem(paths["FAISS_INDEX_PATH"], paths["DOCSTORE_PATH"], api_key="benchmark",
+                    lexical_path=paths["LEXICAL_INDEX_PATH"])
+    embedder = FakeEmbedder(dimension=dimension)
+    queries = QUICK_SEARCH_QUERIES
+    # One (1, dimension) row per query, as embed_query returns
+    embeddings = np.asarray(embedder.embed_documents(queries), dtype=np.float32)[:, None, :]
+
+    results = {
+        "search_dense": time_calls(
+            lambda i: rag.search_similar_documents(embeddings[i % len(queries)], top_k), calls),
+        "search_hybrid": time_calls(
+            lambda i: rag.search_similar_documents(embeddings[i % len(queries)], top_k, queries[i % len(queries)]), calls)
+    }
+    if rag.lexical is not None:
+        results["phrase_lookup"] = time_calls(lambda i: rag.lexical.phrase_search(queries[i % len(queries)], top_k), calls)
+    return results
+
+
+def bench_embedding_batches(count: int, latency: float) -> Dict[str, float]:
+    """Time the batched embedding pipeline on synthetic chunks with simulated API latency."""
+    texts = [f"Idiom chunk number {i}. " * 40 for i in range(count)]
+    embedder = FakeEmbedder(latency=latency)
+    start = time.perf_counter()
+    embed_texts(texts, embedder=embedder, show_progress=False)
+    return {"chunks": count, "calls": embedder.calls, "seconds": time.perf_counter() - start}
+
+
+def print_table(title: str, rows: Dict[str, Dict]) -> None:
+    print(title)
+    for name, stats in rows.items():
+        print(f"  {name:<16} " + "  ".join(
+            f"{key} {value:.3f}" if isinstance(value, float) else f"{key} {value}" for key, value in stats.items()
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for retrieval and preprocessing, fully offline.")
+    parser.add_argument("--workdir", default=None, help="Corpus directory (rebuilt each run; a temp dir by default)")
+    parser.add_argument("--pdf", default="idioms.pdf")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--index-spec", type=IndexSpec.parse, default=None, help="Index to build, e.g. flat_ip or hnsw")
+    parser.add_argument("--embedding-latency", type=float, default=0.0,
+                        help="Simulated seconds per embeddings call during preprocessing")
+    parser.add_argument("--calls", type=int, default=1000, help="Timed calls per retrieval benchmark")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="idiom-bench-")
+    timings = build_offline_corpus(workdir, args.pdf, args.dimension, args.embedding_latency, args.index_spec)
+    print_table("Preprocessing (seconds per stage)", {stage: {"seconds": seconds} for stage, seconds in timings.items()})
+    print_table("Embedding pipeline (2000 chunks, 50 ms per call)", {"embed_texts": bench_embedding_batches(2000, 0.05)})
+    print_table(f"Retrieval over {os.path.basename(workdir.rstrip(os.sep))}",
+                bench_search(workdir, args.dimension, args.calls))
+
+
+if __name__ == "__main__":
+    main()
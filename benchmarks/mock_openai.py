@@ -0,0 +1,238 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from embedding_pipeline import FakeEmbedder
+
+DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+# Returned for prompts that do not ask for a JSON format (the greeting)
+CANNED_TEXT = "Hello! I'm Adam, your AI English idioms teacher. Let's learn some idioms together!"
+
+_JSON_FORMAT = re.compile(r"JSON[^{]*?format[^{]*", re.IGNORECASE)
+
+
+@dataclass
+class Latency:
+    """
+    Distribution of simulated upstream latency, in seconds.
+
+    Written as "fixed:0.3", "uniform:0.1,0.6" (low, high) or
+    "lognormal:0.4,0.5" (median, sigma), the last being closest to real
+    completion latencies with their long tail.
+    """
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, text: str) -> "Latency":
+        kind, _, args = text.partition(":")
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{kind}' (expected one of {', '.join(DISTRIBUTIONS)})")
+        values = [float(value) for value in args.split(",") if value]
+        if len(values) != (1 if kind == "fixed" else 2):
+            raise ValueError(f"Wrong number of parameters for {kind} latency: '{text}'")
+        return cls(kind, *values)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(self.a), self.b)
+        return self.a
+
+
+def canned_content(messages: List[Dict]) -> str:
+    """
+    Answer a chat prompt with the JSON skeleton it asks for.
+
+    Every JSON prompt in the app spells out its response format, so echoing
+    that example yields a reply every parser accepts (the teacher's state
+    machine advances, quick search gets its idioms, reranks get an order).
+    """
+    prompt = messages[-1]["content"] if messages else ""
+    match = _JSON_FORMAT.search(prompt)
+    if match:
+        try:
+            value, _ = json.JSONDecoder().raw_decode(prompt, match.end())
+            return json.dumps(value)
+        except json.JSONDecodeError:
+            pass
+    return CANNED_TEXT
+
+
+class MockOpenAIServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dimension: int = 1536,
+                 embedding_latency: Optional[Latency] = None, chat_latency: Optional[Latency] = None,
+                 stream_chunks: int = 8, seed: int = 0):
+        """
+        Local stand-in for the OpenAI embeddings and chat-completions endpoints.
+
+        Embeddings come from FakeEmbedder, so they match an index built
+        offline with the same dimension. Chat completions echo the JSON
+        format requested by the prompt (see canned_content), streamed in
+        chunks when asked, with usage reported either way.
+
+        Args:
+            host: Interface to bind
+            port: Port to bind (0 picks a free one)
+            dimension: Embedding size; must match the index being served
+            embedding_latency: Simulated time per embeddings call
+            chat_latency: Simulated time per completion (to the last token when streaming)
+            stream_chunks: Chunks a streamed completion is split into
+            seed: Seed for latency sampling
+        """
+        self.embedder = FakeEmbedder(dimension=dimension)
+        self.embedding_latency = embedding_latency or Latency("fixed", 0.05)
+        self.chat_latency = chat_latency or Latency("lognormal", 0.6, 0.4)
+        self.stream_chunks = stream_chunks
+        self.requests = {"embeddings": 0, "chat": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _sample(self, latency: Latency) -> float:
+        with self._lock:
+            return latency.sample(self._random)
+
+    def _count(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, payload: Dict, status: int = 200) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/embeddings"):
+                    self._embeddings(request)
+                elif self.path.endswith("/chat/completions"):
+                    self._chat(request)
+                else:
+                    self._json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+            def _embeddings(self, request: Dict) -> None:
+                mock._count("embeddings")
+                texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+                time.sleep(mock._sample(mock.embedding_latency))
+                vectors = mock.embedder.embed_documents(texts)
+                tokens = sum(len(text) // 4 + 1 for text in texts)
+                self._json({
+                    "object": "list",
+                    "model": request.get("model", "text-embedding-ada-002"),
+                    "data": [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(vectors)],
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+                })
+
+            def _chat(self, request: Dict) -> None:
+                mock._count("chat")
+                content = canned_content(request.get("messages", []))
+                choices = max(1, int(request.get("n") or 1))
+                prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages", [])) // 4
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(content) // 4 * choices,
+                    "total_tokens": prompt_tokens + len(content) // 4 * choices
+                }
+                latency = mock._sample(mock.chat_latency)
+                base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": request.get("model", "gpt-4o-mini")}
+                if not request.get("stream"):
+                    time.sleep(latency)
+                    self._json({
+                        **base,
+                        "object": "chat.completion",
+                        "choices": [
+                            {"index": i, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}
+                            for i in range(choices)
+                        ],
+                        "usage": usage
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                size = max(1, -(-len(content) // mock.stream_chunks))
+                pieces = [content[i:i + size] for i in range(0, len(content), size)]
+                # A third of the time goes to the first token, the rest is spread over the chunks
+                time.sleep(latency / 3)
+                for piece in pieces:
+                    self._event({**base, "object": "chat.completion.chunk",
+                                 "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                    time.sleep(latency * 2 / 3 / len(pieces))
+                self._event({**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    self._event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _event(self, payload: Dict) -> None:
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self) -> "MockOpenAIServer":
+        """Serve from a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dimension", type=int, default=1536, help="Embedding size of the served index")
+    parser.add_argument("--embedding-latency", type=Latency.parse, default=Latency("fixed", 0.05),
+                        help="e.g. fixed:0.05, uniform:0.02,0.1, lognormal:0.05,0.3")
+    parser.add_argument("--chat-latency", type=Latency.parse, default=Latency("lognormal", 0.6, 0.4),
+                        help="e.g. fixed:0.5, uniform:0.3,1.2, lognormal:0.6,0.4")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.host, args.port, args.dimension, args.embedding_latency, args.chat_latency)
+    print(f"Mock OpenAI API at {server.base_url} (set OPENAI_BASE_URL to use it)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Encoding used when a model is unknown to tiktoken (gpt-4o family)
+DEFAULT_ENCODING = "o200k_base"
+# Name recorded for counts made without tiktoken's encoding files
+ESTIMATE_ENCODING = "estimate"
+
+# Tokens of packed context (retrieved records, history, profile) allowed per chat model
+CONTEXT_BUDGETS = {
+    "gpt-4o-mini": 2000,
+    "gpt-4o": 2000
+}
+DEFAULT_BUDGET = 1500
+
+Item = Union[str, Dict]
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-4o-mini"):
+    """Return the tiktoken encoding for a chat model, or None if it cannot be loaded."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:  # encoding files unavailable offline
+        return None
+
+
+def encoding_name(model: str = "gpt-4o-mini") -> str:
+    encoding = get_encoding(model)
+    return encoding.name if encoding is not None else ESTIMATE_ENCODING
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Count tokens with the chat model's tokenizer, falling back to a 4 chars/token estimate."""
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+@dataclass
+class Section:
+    """
+    One kind of context competing for the budget.
+
+    Items are strings or records with a "text" key (and optionally
+    precomputed "tokens"), in the order they should be considered. A
+    contiguous section stops at the first item that does not fit, so
+    conversation turns are never skipped over.
+    """
+    name: str
+    items: List[Item] = field(default_factory=list)
+    contiguous: bool = False
+
+
+class ContextPacker:
+    def __init__(self, model: str = "gpt-4o-mini", budget: Optional[int] = None):
+        """
+        Fill a prompt's context with whole items up to a token budget.
+
+        Args:
+            model: Chat model the prompt is for (picks the tokenizer and default budget)
+            budget: Context token budget (defaults to CONTEXT_BUDGETS for the model)
+        """
+        self.model = model
+        self.budget = budget if budget is not None else CONTEXT_BUDGETS.get(model, DEFAULT_BUDGET)
+        self.encoding_name = encoding_name(model)
+
+    def tokens(self, item: Item) -> int:
+        """Token count of an item, reusing counts stored at index time when they match our tokenizer."""
+        if isinstance(item, dict):
+            if item.get("tokens") is not None and item.get("token_encoding") == self.encoding_name:
+                return int(item["tokens"])
+            return count_tokens(item["text"], self.model)
+        return count_tokens(item, self.model)
+
+    def pack(self, sections: List[Section], budget: Optional[int] = None) -> Tuple[Dict[str, List[str]], int]:
+        """
+        Select items by section priority until the budget is spent.
+
+        Items are kept whole; one that does not fit is dropped rather than
+        cut mid-record, and later (smaller) items of a non-contiguous section
+        still get a chance.
+
+        Args:
+            sections: Sections in priority order
+            budget: Override of the packer's budget for this call
+
+        Returns:
+            Tuple of (texts kept per section name, in the order given, and tokens used)
+        """
+        remaining = self.budget if budget is None else budget
+        packed = {}
+        for section in sections:
+            kept = []
+            for item in section.items:
+                cost = self.tokens(item)
+                if cost > remaining:
+                    if section.contiguous:
+                        break
+                    continue
+                kept.append(item["text"] if isinstance(item, dict) else item)
+                remaining -= cost
+            packed[section.name] = kept
+        used = (self.budget if budget is None else budget) - remaining
+        return packed, used
+
+
+def by_score(records: List[Dict]) -> List[Dict]:
+    """Order retrieved records best first."""
+    return sorted(records, key=lambda record: record.get("score", 0.0), reverse=True)
@@ -0,0 +1,136 @@
+import json
+import mmap
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class DocumentStore:
+    def __init__(self, path: str):
+        """
+        Read-only, memory-mapped store of corpus chunks.
+
+        The store is a directory of flat columns: chunk IDs, page numbers,
+        text offsets and (optionally) prompt token counts as .npy arrays,
+        embeddings as a float32 .npy matrix and the chunk text as one UTF-8
+        blob. Everything is opened with mmap, so
+        gunicorn workers share the pages through the OS cache and loading
+        does no deserialization.
+
+        Args:
+            path: Directory written by DocumentStore.write
+        """
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"The document store '{path}' was not found.")
+        self.path = path
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.pages = np.load(os.path.join(path, "pages.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+
+        # Token counts are optional; stores written before they existed are counted at query time
+        self.tokens = None
+        self.token_encoding = None
+        if os.path.exists(os.path.join(path, "tokens.npy")):
+            self.tokens = np.load(os.path.join(path, "tokens.npy"), mmap_mode="r")
+            with open(os.path.join(path, "tokens.json"), "r", encoding="utf-8") as f:
+                self.token_encoding = json.load(f)["encoding"]
+
+        self._text_file = open(os.path.join(path, "text.bin"), "rb")
+        if self.offsets[-1] > 0:
+            self._text = mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap cannot map an empty file
+            self._text = b""
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, doc_id) -> bool:
+        return self.row_for_id(doc_id) is not None
+
+    def row_for_id(self, doc_id) -> Optional[int]:
+        """Return the row holding a chunk ID, or None if it is not stored."""
+        row = int(np.searchsorted(self.ids, doc_id))
+        if row < len(self.ids) and self.ids[row] == doc_id:
+            return row
+        return None
+
+    def text(self, row: int) -> str:
+        """Return the text of a row, decoding only that slice of the blob."""
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self._text[start:end].decode("utf-8")
+
+    def get(self, doc_id) -> Optional[Dict]:
+        """
+        Look up a chunk by ID.
+
+        Returns:
+            Dictionary with the chunk id, text and source page (plus its token count
+            and the tokenizer it was counted with, when stored), or None
+        """
+        row = self.row_for_id(doc_id)
+        if row is None:
+            return None
+        document = {
+            "id": int(self.ids[row]),
+            "text": self.text(row),
+            "page": int(self.pages[row])
+        }
+        if self.tokens is not None:
+            document["tokens"] = int(self.tokens[row])
+            document["token_encoding"] = self.token_encoding
+        return document
+
+    def embedding(self, doc_id) -> Optional[np.ndarray]:
+        """Return the stored embedding for a chunk ID without copying the matrix."""
+        row = self.row_for_id(doc_id)
+        return None if row is None else self.embeddings[row]
+
+    def close(self) -> None:
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._text_file.close()
+
+    @staticmethod
+    def write(path: str, ids: List[int], texts: List[str], pages: List[int], embeddings,
+              tokens: Optional[List[int]] = None, token_encoding: Optional[str] = None) -> None:
+        """
+        Write a document store, replacing any existing one at path.
+
+        Rows are sorted by ID so lookups can binary-search the ID column.
+
+        Args:
+            path: Target directory
+            ids: Chunk IDs (the FAISS index IDs)
+            texts: Chunk text
+            pages: Source page number of each chunk
+            embeddings: Embedding of each chunk
+            tokens: Prompt token count of each chunk (optional)
+            token_encoding: Tokenizer the counts were made with
+        """
+        order = np.argsort(np.asarray(ids, dtype=np.int64), kind="stable")
+        encoded = [texts[i].encode("utf-8") for i in order]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(blob) for blob in encoded])
+
+        tmp_path = path.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "ids.npy"), np.asarray(ids, dtype=np.int64)[order])
+        np.save(os.path.join(tmp_path, "pages.npy"), np.asarray(pages, dtype=np.int32)[order])
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_path, "embeddings.npy"), np.asarray(embeddings, dtype=np.float32)[order])
+        with open(os.path.join(tmp_path, "text.bin"), "wb") as f:
+            for blob in encoded:
+                f.write(blob)
+        if tokens is not None:
+            np.save(os.path.join(tmp_path, "tokens.npy"), np.asarray(tokens, dtype=np.int32)[order])
+            with open(os.path.join(tmp_path, "tokens.json"), "w", encoding="utf-8") as f:
+                json.dump({"encoding": token_encoding}, f)
+
+        # Swap the new store in; readers that already mapped the old files keep them
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
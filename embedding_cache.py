@@ -0,0 +1,209 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share one cache entry."""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: str = "embedding_cache.db", max_size: int = 10000,
+                 ttl: Optional[float] = 7 * 24 * 3600, warm_size: Optional[int] = None,
+                 max_disk_entries: Optional[int] = 200000, purge_interval: float = 300):
+        """
+        Two-level cache for query embeddings.
+
+        Lookups go to an in-process LRU first and then to a SQLite file that
+        every gunicorn worker shares, so a query embedded by one worker is a
+        cache hit for all of them. Hits never write: disk hits are noted in
+        memory and their last_used times flushed with the periodic purge,
+        which also drops expired rows and the least recently used rows
+        beyond max_disk_entries.
+
+        Args:
+            db_path: Path to the shared SQLite file (None keeps the cache in memory only)
+            max_size: Maximum number of embeddings kept in the in-process LRU
+            ttl: Seconds after which an embedding is considered stale (None disables expiry)
+            warm_size: Number of recent entries loaded from disk on startup (defaults to max_size)
+            max_disk_entries: Maximum number of rows kept in the SQLite file (None for no bound)
+            purge_interval: Minimum seconds between purges of the SQLite file
+        """
+        self.db_path = db_path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.warm_size = max_size if warm_size is None else warm_size
+        self.max_disk_entries = max_disk_entries
+        self.purge_interval = purge_interval
+
+        self._memory: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        # Disk hits since the last purge, key -> last use
+        self._touched: Dict[str, float] = {}
+        self._last_purge = 0.0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._init_db()
+            self._warm()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return a SQLite connection owned by the current process."""
+        # Connections must not be shared across a fork, so reopen per pid
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _init_db(self) -> None:
+        """Create the embeddings table and drop expired and excess rows."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._purge(conn)
+            conn.commit()
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        """Flush noted last_used times, then drop expired rows and the oldest rows past the cap."""
+        if self._touched:
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                             [(used, key) for key, used in self._touched.items()])
+            self._touched = {}
+        if self.ttl is not None:
+            conn.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.ttl,))
+        if self.max_disk_entries is not None:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+        self._last_purge = time.time()
+
+    def _warm(self) -> None:
+        """Preload the most recently used embeddings so a cold worker starts warm."""
+        if self.warm_size <= 0:
+            return
+        try:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT key, vector, created_at FROM embeddings ORDER BY last_used DESC LIMIT ?",
+                    (self.warm_size,)
+                ).fetchall()
+                # Insert oldest first so the most recent entries end up at the LRU tail
+                for key, blob, created_at in reversed(rows):
+                    if not self._expired(created_at):
+                        self._memory[key] = (np.frombuffer(blob, dtype=np.float32), created_at)
+        except sqlite3.Error as e:
+            logger.warning("Error warming embedding cache: %s", e)
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    @staticmethod
+    def _key(query: str, model: str) -> str:
+        return f"{model}:{normalize_query(query)}"
+
+    def _remember(self, key: str, vector: np.ndarray, created_at: float) -> None:
+        """Insert into the in-process LRU, evicting the least recently used entry."""
+        self._memory[key] = (vector, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, query: str, model: str) -> Optional[np.ndarray]:
+        """
+        Look up the embedding for a query.
+
+        Args:
+            query: Raw query text (normalized internally)
+            model: Embedding model the vector was produced with
+
+        Returns:
+            1-D float32 embedding, or None on a miss
+        """
+        key = self._key(query, model)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                vector, created_at = entry
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return vector.copy()
+                del self._memory[key]
+
+            if self.db_path:
+                try:
+                    conn = self._connection()
+                    row = conn.execute(
+                        "SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None and not self._expired(row[1]):
+                        self._touched[key] = time.time()
+                        vector = np.frombuffer(row[0], dtype=np.float32)
+                        self._remember(key, vector, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return vector.copy()
+                except sqlite3.Error as e:
+                    logger.warning("Error reading embedding cache: %s", e)
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, model: str, vector: np.ndarray) -> None:
+        """Store an embedding in memory and in the shared SQLite file."""
+        key = self._key(query, model)
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        now = time.time()
+        with self._lock:
+            self._remember(key, vector, now)
+            if self.db_path:
+                try:
+                    conn = self._connection()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, created_at, last_used) VALUES (?, ?, ?, ?)",
+                        (key, vector.tobytes(), now, now)
+                    )
+                    self._touched.pop(key, None)
+                    if now - self._last_purge >= self.purge_interval:
+                        self._purge(conn)
+                    conn.commit()
+                except sqlite3.Error as e:
+                    logger.warning("Error writing embedding cache: %s", e)
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters for this process."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._memory)
+        }
@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List
+
+import numpy as np
+from tqdm import tqdm
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken missing or its encoding files unavailable offline
+    _encoding = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the ada-002 tokenizer, falling back to a 4 chars/token estimate."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+class OpenAIEmbedder:
+    def __init__(self, model: str = DEFAULT_EMBEDDING_MODEL, client=None):
+        """
+        Embedder backed by the OpenAI embeddings endpoint.
+
+        Args:
+            model: Embedding model name
+            client: OpenAI client (optional, defaults to the shared client from openai_client)
+        """
+        if client is None:
+            from openai_client import default_client_factory
+            client = default_client_factory().client()
+        self.client = client
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts in a single API call."""
+        response = self.client.embeddings.create(input=texts, model=self.model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class FakeEmbedder:
+    def __init__(self, dimension: int = 1536, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        """
+        Deterministic offline embedder for benchmarks.
+
+        The same text always maps to the same unit vector, so an index built
+        with it is reproducible without network access.
+
+        Args:
+            dimension: Size of the generated vectors
+            latency: Seconds to sleep per call, simulating an API round trip
+            failure_rate: Probability that a call raises, to exercise retries
+            seed: Seed mixed into every vector and into failure sampling
+        """
+        self.dimension = dimension
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise Exception("Simulated embedding failure")
+        vectors = []
+        for text in texts:
+            digest = hashlib.sha256(f"{self.seed}:{text}".encode("utf-8")).digest()
+            rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+            vector = rng.standard_normal(self.dimension).astype("float32")
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+
+def iter_batches(texts: Iterable[str], max_batch_tokens: int = 50000, max_batch_size: int = 256) -> Iterator[List[str]]:
+    """
+    Group texts into batches bounded by token count and batch size, as they arrive.
+
+    Args:
+        texts: Texts to embed (any iterable, consumed lazily)
+        max_batch_tokens: Maximum total tokens sent in one request
+        max_batch_size: Maximum number of inputs sent in one request
+
+    Yields:
+        Lists of texts, in input order
+    """
+    current, current_tokens = [], 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_size):
+            yield current
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def _embed_with_retry(embedder, texts: List[str], max_retries: int, backoff: float) -> List[List[float]]:
+    """Embed one batch, retrying with exponential backoff and jitter."""
+    for attempt in range(max_retries + 1):
+        try:
+            vectors = embedder.embed_documents(texts)
+            if len(vectors) != len(texts):
+                raise Exception(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+            return vectors
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            logger.warning("Error embedding batch (attempt %d): %s; retrying in %.1fs", attempt + 1, e, delay)
+            time.sleep(delay)
+
+
+def embed_stream(texts: Iterable[str], embedder=None, max_batch_tokens: int = 50000,
+                 max_batch_size: int = 256, max_workers: int = 4, max_retries: int = 5,
+                 backoff: float = 1.0, progress=None) -> Iterator[List[float]]:
+    """
+    Embed a stream of texts, yielding one embedding per text in input order.
+
+    Batches are formed as texts arrive and at most two per worker are in
+    flight, so texts can be produced lazily (chunks straight out of PDF
+    extraction) while earlier batches are being embedded.
+
+    Args:
+        texts: Texts to embed (any iterable, consumed lazily)
+        embedder: Object with an embed_documents(texts) method (defaults to OpenAIEmbedder)
+        max_batch_tokens: Maximum total tokens per request
+        max_batch_size: Maximum number of inputs per request
+        max_workers: Maximum number of requests in flight
+        max_retries: Retries per batch before giving up
+        backoff: Base delay in seconds for exponential backoff
+        progress: tqdm bar to advance as batches complete (optional)
+
+    Yields:
+        Embeddings, in input order
+    """
+    embedder = embedder or OpenAIEmbedder()
+    pending = deque()
+
+    def drain(limit: int) -> Iterator[List[float]]:
+        while len(pending) > limit:
+            batch, future = pending.popleft()
+            try:
+                vectors = future.result()
+            except Exception as e:
+                # Dropping a batch would misalign embeddings and chunks, so fail the build
+                for _, other in pending:
+                    other.cancel()
+                raise Exception(f"Failed to embed batch of {len(batch)} chunks: {str(e)}")
+            if progress is not None:
+                progress.update(len(batch))
+            yield from vectors
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in iter_batches(texts, max_batch_tokens, max_batch_size):
+            pending.append((batch, executor.submit(_embed_with_retry, embedder, batch, max_retries, backoff)))
+            yield from drain(2 * max_workers - 1)
+        yield from drain(0)
+
+
+def embed_texts(texts: List[str], embedder=None, max_batch_tokens: int = 50000,
+                max_batch_size: int = 256, max_workers: int = 4,
+                max_retries: int = 5, backoff: float = 1.0, show_progress: bool = True) -> List[List[float]]:
+    """
+    Embed texts in token-budgeted batches on a bounded worker pool.
+
+    Args:
+        texts: Texts to embed
+        embedder: Object with an embed_documents(texts) method (defaults to OpenAIEmbedder)
+        max_batch_tokens: Maximum total tokens per request
+        max_batch_size: Maximum number of inputs per request
+        max_workers: Maximum number of requests in flight
+        max_retries: Retries per batch before giving up
+        backoff: Base delay in seconds for exponential backoff
+        show_progress: Whether to display a progress bar
+
+    Returns:
+        One embedding per input text, in input order
+    """
+    if not texts:
+        return []
+    with tqdm(total=len(texts), desc="Embedding chunks", disable=not show_progress) as progress:
+        return list(embed_stream(texts, embedder, max_batch_tokens, max_batch_size, max_workers,
+                                 max_retries, backoff, progress))
+
+
+def main():
+    # Offline benchmark: one call per chunk versus the batched pipeline
+    texts = [f"Idiom chunk number {i}. " * 40 for i in range(2000)]
+    latency = 0.05
+
+    embedder = FakeEmbedder(latency=latency)
+    sample = texts[:100]
+    start = time.perf_counter()
+    for text in sample:
+        embedder.embed_documents([text])
+    sequential = (time.perf_counter() - start) * len(texts) / len(sample)
+    print(f"Sequential (extrapolated): {sequential:.2f}s for {len(texts)} chunks")
+
+    embedder = FakeEmbedder(latency=latency)
+    start = time.perf_counter()
+    embed_texts(texts, embedder=embedder, max_batch_size=128, show_progress=False)
+    print(f"Batched: {time.perf_counter() - start:.2f}s for {len(texts)} chunks in {embedder.calls} calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GreetingPool:
+    def __init__(self, db_path: str = "greetings.db", size: int = 20, rotate: int = 5,
+                 refresh_interval: float = 3600, reload_interval: float = 30, retry_interval: float = 60):
+        """
+        Pool of pre-generated greetings shared by all workers through SQLite.
+
+        A background thread keeps the pool topped up and swaps a few
+        greetings for fresh ones every refresh_interval, so new visitors get
+        a varied introduction without waiting for a completion. Only one
+        worker refreshes at a time, coordinated by a lease row in the file.
+
+        Args:
+            db_path: Path to the shared SQLite file
+            size: Number of greetings kept in the pool
+            rotate: Greetings replaced on each refresh once the pool is full
+            refresh_interval: Seconds between refreshes
+            reload_interval: Seconds a worker serves its in-memory copy before rereading the file
+            retry_interval: Seconds before retrying a refresh that failed
+        """
+        self.db_path = db_path
+        self.size = size
+        self.rotate = rotate
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.retry_interval = retry_interval
+
+        self._generate: Optional[Callable[[int], List[str]]] = None
+        self._greetings: List[str] = []
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._refresher_pid: Optional[int] = None
+        self._stop = threading.Event()
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS greetings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS pool_meta (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO pool_meta (key, value) VALUES ('refresh_lease', 0)")
+            conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return a SQLite connection owned by the current process."""
+        # Connections must not be shared across a fork, so reopen per pid
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def start(self, generate: Callable[[int], List[str]]) -> None:
+        """
+        Start keeping the pool filled.
+
+        The refresher thread itself starts on the first get() in each
+        process, so a gunicorn master that preloads the app never calls
+        OpenAI (and never opens connections its forked workers would inherit).
+
+        Args:
+            generate: Callable returning the requested number of new greetings
+        """
+        self._generate = generate
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _ensure_refresher(self) -> None:
+        # Threads do not survive a fork, so each worker starts its own refresher
+        if self._generate is None or self._refresher_pid == os.getpid():
+            return
+        self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_loop, name="greeting-pool", daemon=True).start()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.is_set():
+            if self._claim_lease(self.refresh_interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error("Error refreshing greeting pool: %s", e)
+                    self._claim_lease(self.retry_interval, force=True)
+            self._stop.wait(min(self.retry_interval, self.refresh_interval))
+
+    def _claim_lease(self, duration: float, force: bool = False) -> bool:
+        """Take the refresh lease if it has expired (or unconditionally with force)."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "UPDATE pool_meta SET value = ? WHERE key = 'refresh_lease' AND (value <= ? OR ?)",
+                (now + duration, now, force)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def refresh(self) -> None:
+        """Fill the pool to size, or rotate in fresh greetings if it is already full."""
+        with self._lock:
+            count = self._connection().execute("SELECT COUNT(*) FROM greetings").fetchone()[0]
+        wanted = max(self.size - count, min(self.rotate, self.size))
+        greetings = [greeting for greeting in self._generate(wanted) if greeting]
+        if not greetings:
+            return
+
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT INTO greetings (message, created_at) VALUES (?, ?)",
+                [(greeting, now) for greeting in greetings]
+            )
+            # Drop the oldest greetings beyond the pool size
+            conn.execute(
+                "DELETE FROM greetings WHERE id NOT IN (SELECT id FROM greetings ORDER BY id DESC LIMIT ?)",
+                (self.size,)
+            )
+            conn.commit()
+            self._loaded_at = 0.0
+
+    def get(self) -> Optional[str]:
+        """Return a random pooled greeting, or None if the pool is still empty."""
+        self._ensure_refresher()
+        with self._lock:
+            if time.time() - self._loaded_at > self.reload_interval or not self._greetings:
+                rows = self._connection().execute("SELECT message FROM greetings").fetchall()
+                self._greetings = [row[0] for row in rows]
+                self._loaded_at = time.time()
+            return random.choice(self._greetings) if self._greetings else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM greetings").fetchone()[0]
@@ -0,0 +1,13 @@
+import gc
+
+# Load the index, stores and agents once in the master, then fork workers
+# that share them copy-on-write (the FAISS index and stores are also
+# memory-mapped, so their pages stay shared). Override the entry point on the
+# command line for the async server: "asgi:create_app()".
+wsgi_app = "app:create_app()"
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Keep the collector from touching (and so copying) the preloaded objects in each worker
+    gc.freeze()
@@ -0,0 +1,76 @@
+import base64
+from typing import Iterable, Optional
+
+import faiss
+import numpy as np
+
+
+class IdBitset:
+    def __init__(self, bitmap: Optional[bytes] = None):
+        """
+        Set of non-negative corpus IDs stored one bit per ID.
+
+        A learner's seen chunks fit in a few dozen bytes, so the set lives in
+        the session itself (see to_text) and doubles as the bitmap for a
+        FAISS ID selector. Bit i is bit (i % 8) of byte i // 8, the layout
+        faiss.IDSelectorBitmap reads.
+
+        Args:
+            bitmap: Raw bitmap bytes (empty set when omitted)
+        """
+        self.bitmap = np.frombuffer(bitmap or b"", dtype=np.uint8).copy()
+
+    @classmethod
+    def from_text(cls, text: Optional[str]) -> "IdBitset":
+        """Inverse of to_text; None or "" is the empty set."""
+        return cls(base64.b64decode(text) if text else None)
+
+    def to_text(self) -> str:
+        """Base64 of the bitmap without trailing zero bytes, for JSON sessions."""
+        return base64.b64encode(self.bitmap.tobytes().rstrip(b"\0")).decode("ascii")
+
+    def add(self, ids: Iterable[int]) -> None:
+        ids = np.fromiter((int(i) for i in ids), dtype=np.int64)
+        if not len(ids):
+            return
+        if ids.min() < 0:
+            raise ValueError("IdBitset only holds non-negative IDs")
+        size = int(ids.max()) // 8 + 1
+        if size > len(self.bitmap):
+            self.bitmap = np.concatenate([self.bitmap, np.zeros(size - len(self.bitmap), dtype=np.uint8)])
+        np.bitwise_or.at(self.bitmap, ids >> 3, (1 << (ids & 7)).astype(np.uint8))
+
+    def contains(self, ids) -> np.ndarray:
+        """Boolean mask: which of the given IDs are in the set."""
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids >> 3 < len(self.bitmap))
+        mask = np.zeros(ids.shape, dtype=bool)
+        mask[inside] = (self.bitmap[ids[inside] >> 3] >> (ids[inside] & 7)) & 1 == 1
+        return mask
+
+    def __contains__(self, doc_id) -> bool:
+        return bool(self.contains([doc_id])[0])
+
+    def __len__(self) -> int:
+        return int(np.unpackbits(self.bitmap).sum())
+
+    def __or__(self, other: "IdBitset") -> "IdBitset":
+        size = max(len(self.bitmap), len(other.bitmap))
+        union = IdBitset()
+        union.bitmap = np.zeros(size, dtype=np.uint8)
+        union.bitmap[:len(self.bitmap)] |= self.bitmap
+        union.bitmap[:len(other.bitmap)] |= other.bitmap
+        return union
+
+    def exclusion_selector(self) -> faiss.IDSelector:
+        """
+        FAISS selector admitting every ID not in the set, for search(..., params=...).
+
+        The selector reads this bitmap in place, so the set must not grow
+        while a search using it runs.
+        """
+        bitmap_selector = faiss.IDSelectorBitmap(len(self.bitmap), faiss.swig_ptr(self.bitmap))
+        selector = faiss.IDSelectorNot(bitmap_selector)
+        # SWIG does not keep the wrapped selector or the bitmap alive on its own
+        selector.referenced_objects = [bitmap_selector, self.bitmap]
+        return selector
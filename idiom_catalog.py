@@ -0,0 +1,250 @@
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from document_store import DocumentStore
+from index_backends import IndexSpec, build_index, prepare_vectors, read_index, write_index
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+
+# Typographic punctuation in the PDF, mapped to ASCII before anything else is stripped
+_ASCII_PUNCTUATION = str.maketrans({
+    "‘": "'", "’": "'", "“": '"', "”": '"',
+    "–": "-", "—": " - ", "…": "..."
+})
+
+SET_HEADER = re.compile(r"^Set\s+(\d+)\s*-\s*(.*)$")
+# "phrase: meaning" or "phrase; (adjective) meaning"
+ENTRY = re.compile(r"^([A-Za-z][^:;]{0,60}?)\s*[:;]\s*(.+)$")
+SPEAKER = re.compile(r"^[A-Z][a-z]+[:;]\s*")
+
+# Placeholder words in dictionary headwords that never appear verbatim in examples
+PLACEHOLDER_WORDS = {
+    "one", "ones", "one's", "someone", "someone's", "somebody", "something", "sth", "sb",
+    "a", "an", "the", "to", "of", "or", "and", "in", "on", "at", "be", "is", "as"
+}
+
+INDEX_FILE = "index.faiss"
+LEXICAL_DIR = "lexical"
+
+
+def to_ascii(text: str) -> str:
+    """Map typographic quotes and dashes to ASCII and drop any other non-ASCII characters."""
+    return re.sub(r"[^\x00-\x7F]+", "", text.translate(_ASCII_PUNCTUATION))
+
+
+def _complete(meaning: str) -> bool:
+    # Entries that wrap onto the next line do not end in terminal punctuation
+    return meaning.rstrip().endswith((".", "!", "?", ")"))
+
+
+def _phrase_words(phrase: str) -> List[str]:
+    words = re.findall(r"[a-z']+", phrase.lower())
+    return [word for word in words if word not in PLACEHOLDER_WORDS]
+
+
+def find_example(phrase: str, sentences: List[str]) -> str:
+    """
+    Pick the dialogue sentence that uses a phrase.
+
+    Headwords are in dictionary form ("clench one's jaw") while dialogue
+    inflects them ("clenching my jaw"), so words are matched on a short
+    prefix and at least two thirds of the content words must appear.
+
+    Returns:
+        The best sentence, or an empty string if none uses the phrase
+    """
+    words = _phrase_words(phrase)
+    if not words:
+        return ""
+    stems = [word[:4] if len(word) > 4 else word for word in words]
+    required = max(1, -(-2 * len(stems) // 3))
+
+    best, best_score = "", 0
+    for sentence in sentences:
+        tokens = re.findall(r"[a-z']+", sentence.lower())
+        score = sum(any(token.startswith(stem) for token in tokens) for stem in stems)
+        if score > best_score:
+            best, best_score = sentence, score
+    return best if best_score >= required else ""
+
+
+def _split_sentences(lines: List[str]) -> List[str]:
+    text = " ".join(SPEAKER.sub("", line) for line in lines)
+    sentences = re.split(r"(?<=[.!?])\s+|(?<=[.!?]\")\s+", text)
+    return [" ".join(sentence.split()) for sentence in sentences if sentence.strip()]
+
+
+def parse_idiom_entries(pages: List[Tuple[int, str]]) -> List[Dict]:
+    """
+    Parse the vocabulary sections of the idioms book into per-idiom records.
+
+    Each set in the book is a dialogue, then "Vocabulary;" with one
+    "phrase: meaning" entry per headword (wrapping across lines and pages),
+    then an exercise. Examples are taken from the set's dialogue.
+
+    Args:
+        pages: (page number, page text) pairs in reading order
+
+    Returns:
+        List of records with phrase, meaning, example, page and set title
+    """
+    records = []
+    title = ""
+    dialogue: List[str] = []
+    sentences: List[str] = []
+    state = None
+    current = None
+
+    def flush():
+        nonlocal current
+        if current is not None:
+            current["meaning"] = " ".join(current["meaning"].split())
+            current["example"] = find_example(current["phrase"], sentences)
+            records.append(current)
+            current = None
+
+    for page_num, page_text in pages:
+        for line in to_ascii(page_text).splitlines():
+            line = line.strip()
+            if not line or line.isdigit():
+                continue
+
+            header = SET_HEADER.match(line)
+            if header:
+                flush()
+                title, dialogue, state = header.group(2).strip(), [], "dialogue"
+            elif line.startswith("Vocabulary"):
+                flush()
+                sentences, state = _split_sentences(dialogue), "vocabulary"
+            elif line.startswith("Exercise"):
+                flush()
+                state = "exercise"
+            elif state == "dialogue":
+                dialogue.append(line)
+            elif state == "vocabulary":
+                entry = ENTRY.match(line)
+                if entry and len(entry.group(1).split()) <= 8 and (current is None or _complete(current["meaning"])):
+                    flush()
+                    current = {
+                        "phrase": entry.group(1).strip(),
+                        "meaning": entry.group(2),
+                        "example": "",
+                        "page": page_num,
+                        "set": title
+                    }
+                elif current is not None:
+                    current["meaning"] += " " + line
+    flush()
+    return records
+
+
+def record_text(record: Dict) -> str:
+    """Text embedded for a catalog record."""
+    text = f"{record['phrase']}: {record['meaning']}"
+    if record.get("example"):
+        text += f" Example: {record['example']}"
+    return text
+
+
+def write_catalog(path: str, records: List[Dict], embeddings) -> None:
+    """
+    Write the catalog: records in a document store plus an exact cosine index
+    and a lexical index over each phrase and meaning.
+
+    Args:
+        path: Catalog directory
+        records: Records from parse_idiom_entries
+        embeddings: Embedding of record_text(record) for each record
+    """
+    ids = list(range(len(records)))
+    DocumentStore.write(
+        path,
+        ids,
+        [json.dumps(record, separators=(",", ":")) for record in records],
+        [record["page"] for record in records],
+        embeddings
+    )
+    spec = IndexSpec("flat_ip")
+    write_index(build_index(embeddings, spec, ids), spec, os.path.join(path, INDEX_FILE))
+    LexicalIndex.write(
+        os.path.join(path, LEXICAL_DIR),
+        ids,
+        [f"{record['phrase']} {record['meaning']}" for record in records]
+    )
+
+
+class IdiomCatalog:
+    def __init__(self, path: str = "catalog"):
+        """
+        Structured idiom records with their own exact cosine index and,
+        when present, a lexical index for exact phrase lookups.
+
+        Args:
+            path: Directory written by write_catalog
+        """
+        self.store = DocumentStore(path)
+        self.index = read_index(os.path.join(path, INDEX_FILE))
+        self._spec = IndexSpec("flat_ip")
+        lexical_path = os.path.join(path, LEXICAL_DIR)
+        self.lexical = LexicalIndex(lexical_path) if os.path.isdir(lexical_path) else None
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def get(self, record_id) -> Optional[Dict]:
+        document = self.store.get(record_id)
+        return None if document is None else json.loads(document["text"])
+
+    def _records(self, hits) -> List[Dict]:
+        records = []
+        for record_id, score in hits:
+            record = self.get(record_id) if record_id != -1 else None
+            if record is not None:
+                records.append({**record, "score": float(score)})
+        return records
+
+    def lookup(self, query: str, top_k: int = 3) -> List[Dict]:
+        """
+        Return records whose phrase or meaning contains the query as a phrase,
+        without needing a query embedding.
+
+        Returns:
+            Records with an added "score" (BM25), best first; empty if nothing matches
+        """
+        if self.lexical is None:
+            return []
+        return self._records(self.lexical.phrase_search(query, top_k))
+
+    def keyword_search(self, query: str, top_k: int = 3) -> List[Dict]:
+        """
+        Return the records ranked highest by BM25 for the query, for when no
+        query embedding is available.
+
+        Returns:
+            Records with an added "score" (BM25), best first; empty without a lexical index
+        """
+        if self.lexical is None:
+            return []
+        return self._records(self.lexical.search(query, top_k))
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 3, query: Optional[str] = None) -> List[Dict]:
+        """
+        Return the records closest to a query embedding, fused with BM25 hits
+        when the query text is given and a lexical index is present.
+
+        Returns:
+            Records with an added "score" (cosine similarity, or the fused score), best first
+        """
+        vector = prepare_vectors(np.asarray(query_embedding).reshape(1, -1), self._spec)
+        scores, ids = self.index.search(vector, top_k)
+        dense = [(int(record_id), float(score)) for record_id, score in zip(ids[0], scores[0]) if record_id != -1]
+        if self.lexical is None or query is None:
+            return self._records(dense)
+        lexical = [record_id for record_id, _ in self.lexical.search(query, top_k)]
+        return self._records(reciprocal_rank_fusion([[record_id for record_id, _ in dense], lexical])[:top_k])
+
+    def close(self) -> None:
+        self.store.close()
@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+INDEX_KINDS = ("flat", "flat_ip", "ivf_flat", "ivf_pq", "hnsw")
+
+# Kinds whose underlying FAISS index supports remove_ids, which incremental builds need
+REMOVABLE_KINDS = ("flat", "flat_ip", "ivf_flat", "ivf_pq")
+
+
+@dataclass
+class IndexSpec:
+    """
+    Description of how to build a FAISS index.
+
+    kind is one of:
+        flat      exact L2 search (the original IndexFlatL2)
+        flat_ip   exact inner-product search over L2-normalized vectors (cosine)
+        ivf_flat  inverted lists over nlist centroids, full vectors
+        ivf_pq    inverted lists with product-quantized codes (pq_m bytes per vector at 8 bits)
+        hnsw      hierarchical navigable small-world graph
+    """
+    kind: str = "flat"
+    nlist: int = 1024
+    pq_m: int = 64
+    pq_nbits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 200
+
+    def __post_init__(self):
+        if self.kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind '{self.kind}', expected one of {', '.join(INDEX_KINDS)}")
+
+    @property
+    def normalized(self) -> bool:
+        """Whether vectors (and queries) are L2-normalized before use."""
+        return self.kind == "flat_ip"
+
+    @classmethod
+    def parse(cls, text: str) -> "IndexSpec":
+        """
+        Parse a spec string such as "ivf_pq:nlist=256,pq_m=32" or "hnsw".
+        """
+        kind, _, options = text.partition(":")
+        names = {field.name for field in fields(cls)} - {"kind"}
+        kwargs = {}
+        for option in filter(None, options.split(",")):
+            key, _, value = option.partition("=")
+            if key not in names:
+                raise ValueError(f"Unknown index option '{key}'")
+            kwargs[key] = int(value)
+        return cls(kind=kind, **kwargs)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "IndexSpec":
+        return cls(**{field.name: data[field.name] for field in fields(cls) if field.name in data})
+
+
+def prepare_vectors(embeddings, spec: IndexSpec) -> np.ndarray:
+    """Convert embeddings to a contiguous float32 matrix, normalized if the spec needs it."""
+    matrix = np.ascontiguousarray(np.array(embeddings, dtype=np.float32))
+    if spec.normalized:
+        faiss.normalize_L2(matrix)
+    return matrix
+
+
+def build_index(embeddings, spec: Optional[IndexSpec] = None, ids=None) -> faiss.Index:
+    """
+    Build an ID-mapped FAISS index according to a spec.
+
+    IVF parameters are clamped for small corpora so training always has
+    enough points per centroid.
+
+    Args:
+        embeddings: Matrix of vectors, one row per chunk
+        spec: How to build the index (defaults to exact flat L2)
+        ids: Chunk IDs (defaults to row positions)
+
+    Returns:
+        Trained IndexIDMap2 containing every vector
+    """
+    spec = spec or IndexSpec()
+    matrix = prepare_vectors(embeddings, spec)
+    count, dimension = matrix.shape
+
+    if spec.kind == "flat":
+        base = faiss.IndexFlatL2(dimension)
+    elif spec.kind == "flat_ip":
+        base = faiss.IndexFlatIP(dimension)
+    elif spec.kind == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, spec.hnsw_m)
+        base.hnsw.efConstruction = spec.ef_construction
+    else:
+        # FAISS wants roughly 39 training points per centroid
+        nlist = max(1, min(spec.nlist, count // 39))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if spec.kind == "ivf_flat":
+            base = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            # Shrink codebooks until each of the 2**nbits codes has enough training points
+            nbits = spec.pq_nbits
+            while nbits > 4 and count < 39 * 2 ** nbits:
+                nbits -= 1
+            base = faiss.IndexIVFPQ(quantizer, dimension, nlist, spec.pq_m, nbits)
+        base.train(matrix)
+
+    index = faiss.IndexIDMap2(base)
+    if ids is None:
+        ids = np.arange(count)
+    index.add_with_ids(matrix, np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def meta_path(index_path: str) -> str:
+    return index_path + ".meta.json"
+
+
+def write_index(index: faiss.Index, spec: IndexSpec, index_path: str) -> None:
+    """Write an index and the metadata describing how it was built next to it."""
+    # Write aside and rename, so servers that memory-mapped the old file keep a consistent copy
+    tmp_path = index_path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_path)
+    meta = {
+        "spec": asdict(spec),
+        "normalized": spec.normalized,
+        "ntotal": int(index.ntotal),
+        "dimension": int(index.d),
+        "built_at": time.time()
+    }
+    with open(meta_path(index_path), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_index(index_path: str, mmap: bool = True) -> faiss.Index:
+    """
+    Read an index for serving.
+
+    With mmap the vectors stay in the OS page cache instead of each
+    process's heap, so forked workers share one copy. The mapped index is
+    read-only; incremental builds read it with mmap=False.
+    """
+    if mmap:
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except (AttributeError, RuntimeError):
+            # Older FAISS builds or index types that cannot be mapped
+            pass
+    return faiss.read_index(index_path)
+
+
+def read_index_meta(index_path: str) -> Dict:
+    """Read index metadata; indexes written before metadata existed are exact flat L2."""
+    try:
+        with open(meta_path(index_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"spec": asdict(IndexSpec()), "normalized": False}
+
+
+def apply_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """
+    Apply runtime search knobs to an index.
+
+    Args:
+        index: Index as returned by faiss.read_index (ID-mapped or not)
+        nprobe: Inverted lists visited per query (IVF kinds)
+        ef_search: Candidate list size during search (HNSW)
+    """
+    base = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+
+
+def search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """
+    Per-call search parameters that restrict a search to the IDs a selector admits.
+
+    Parameters passed to search replace the index's own nprobe / efSearch,
+    so the current values are carried over.
+
+    Args:
+        index: Index as returned by faiss.read_index (ID-mapped or not; selectors see external IDs)
+        selector: IDs to consider
+    """
+    base = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def benchmark_index(index: faiss.Index, queries: np.ndarray, ground_truth: np.ndarray, k: int = 10) -> Dict:
+    """
+    Measure recall@k against exact results plus per-query latency and size.
+
+    Args:
+        index: Index to measure, with search params already applied
+        queries: Query matrix (prepared the same way as the index vectors)
+        ground_truth: IDs returned by an exact search for each query
+        k: Number of neighbours
+
+    Returns:
+        Dictionary with recall, p50/p99 latency in milliseconds and serialized size in bytes
+    """
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    hits = sum(len(set(row) & set(truth)) for row, truth in zip(found, ground_truth))
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "bytes": len(faiss.serialize_index(index))
+    }
+
+
+def benchmark_specs(embeddings: np.ndarray, queries: np.ndarray, specs: List[IndexSpec],
+                    k: int = 10, nprobes=(1, 8, 32), ef_searches=(16, 64, 256)) -> List[Dict]:
+    """Build each spec and benchmark it over a sweep of its runtime knobs."""
+    exact = build_index(embeddings, IndexSpec("flat"))
+    _, ground_truth = exact.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+
+    results = []
+    for spec in specs:
+        start = time.perf_counter()
+        index = build_index(embeddings, spec)
+        build_seconds = time.perf_counter() - start
+        prepared = prepare_vectors(queries, spec)
+
+        if spec.kind in ("ivf_flat", "ivf_pq"):
+            sweeps = [{"nprobe": n} for n in nprobes]
+        elif spec.kind == "hnsw":
+            sweeps = [{"ef_search": ef} for ef in ef_searches]
+        else:
+            sweeps = [{}]
+        for knobs in sweeps:
+            apply_search_params(index, **knobs)
+            result = benchmark_index(index, prepared, ground_truth, k)
+            results.append({"spec": spec.kind, "knobs": knobs, "build_s": build_seconds, **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index specs against exact search.")
+    parser.add_argument("--docstore", help="Use embeddings from this document store instead of synthetic data")
+    parser.add_argument("--size", type=int, default=50000, help="Number of synthetic vectors")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--specs", nargs="+", default=["flat_ip", "ivf_flat", "ivf_pq", "hnsw:hnsw_m=32"])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.docstore:
+        embeddings = np.array(np.load(os.path.join(args.docstore, "embeddings.npy"), mmap_mode="r"))
+    else:
+        # Clustered synthetic data behaves more like real embeddings than uniform noise
+        centers = rng.standard_normal((256, args.dimension)).astype("float32")
+        embeddings = centers[rng.integers(0, 256, args.size)] + 0.3 * rng.standard_normal(
+            (args.size, args.dimension)).astype("float32")
+    faiss.normalize_L2(embeddings)
+    queries = embeddings[rng.choice(len(embeddings), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype("float32")
+
+    print(f"{len(embeddings)} vectors x {embeddings.shape[1]} dims, {args.queries} queries, k={args.k}")
+    print(f"{'spec':<10} {'knobs':<18} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'MB':>8} {'build s':>8}")
+    for row in benchmark_specs(embeddings, queries, [IndexSpec.parse(spec) for spec in args.specs], args.k):
+        knobs = ",".join(f"{key}={value}" for key, value in row["knobs"].items()) or "-"
+        print(f"{row['spec']:<10} {knobs:<18} {row['recall']:>7.3f} {row['p50_ms']:>8.3f} "
+              f"{row['p99_ms']:>8.3f} {row['bytes'] / 1e6:>8.1f} {row['build_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
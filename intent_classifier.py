@@ -0,0 +1,305 @@
+import argparse
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from document_store import DocumentStore
+from embedding_pipeline import DEFAULT_EMBEDDING_MODEL, embed_texts
+from id_bitset import IdBitset
+from metrics import CLASSIFICATIONS
+
+logger = logging.getLogger(__name__)
+
+# Example texts per label; each label's centroid is the mean of their embeddings.
+# Topic and level labels match the choices the teacher offers learners.
+LABEL_SEEDS = {
+    "tone": {
+        "sarcastic": ["sarcastic idioms", "ironic expressions for mocking someone",
+                      "idioms to say something sarcastically"],
+        "happy": ["idioms about being happy", "expressions for joy and cheerfulness",
+                  "idioms for feeling glad and delighted"],
+        "sad": ["idioms about sadness", "expressions for feeling down and unhappy",
+                "idioms about grief and sorrow"],
+        "angry": ["idioms about anger", "expressions for being furious or annoyed",
+                  "idioms for losing your temper"],
+        "funny": ["funny idioms", "humorous expressions that make people laugh", "hilarious English sayings"],
+        "formal": ["formal idioms for professional settings", "polite expressions for formal writing",
+                   "idioms suitable for a formal speech"],
+        "romantic": ["romantic idioms about love", "expressions for falling in love",
+                     "idioms about dating and romance"],
+        "neutral": ["common English idioms", "idioms and their meanings", "give me some idioms",
+                    "everyday expressions with examples"]
+    },
+    "topic": {
+        "business": ["business idioms", "idioms for work and the office",
+                     "expressions used in meetings, negotiations and finance"],
+        "casual": ["casual idioms for everyday conversation", "informal expressions to use with friends",
+                   "relaxed everyday sayings and slang"],
+        "academic": ["academic idioms", "expressions for studying, school and university",
+                     "idioms for essays and research"]
+    },
+    "level": {
+        "beginner": ["I'm a beginner", "I just started learning English", "My English is basic",
+                     "I only know a little English"],
+        "intermediate": ["I'm intermediate", "My English is okay, I can hold a conversation",
+                         "I'm somewhere in the middle", "I understand most things but still make mistakes"],
+        "advanced": ["I'm advanced", "My English is fluent", "I speak English very well",
+                     "I'm almost a native speaker"]
+    }
+}
+
+# Null class scored alongside every facet's labels: text about none of them
+# (small talk, other subjects) lands here instead of on the nearest label.
+OTHER_LABEL = "other"
+OTHER_SEEDS = ["what's the weather like today", "how do I fix my car", "tell me about the football results",
+               "I had pasta for dinner", "ok", "can you repeat that", "what time is it", "I don't know"]
+
+# Facets whose chunk labels partition the corpus for retrieval
+PARTITION_FACETS = ("tone", "topic")
+# Labels that say nothing specific; chunks with them stay in every partition
+NEUTRAL_LABELS = {"tone": "neutral"}
+
+# Softmax temperature over cosine similarities. Embeddings of related short
+# texts sit close together, so label similarities differ by a few hundredths.
+TEMPERATURE = 0.01
+# Cosine similarity the winning centroid must reach for a label to count.
+# The softmax only ranks labels against each other, so without a floor an
+# unrelated text still gets a "confident" label. The floor depends on the
+# embedding model: ada-002 puts unrelated texts around 0.7, the text-embedding-3
+# models far lower. It is written with the centroids, so it travels with them.
+MIN_SIMILARITY_BY_MODEL = {"text-embedding-ada-002": 0.75}
+# Floor for label files written before the model and floor were stored
+MIN_SIMILARITY = MIN_SIMILARITY_BY_MODEL[DEFAULT_EMBEDDING_MODEL]
+
+
+def labels_path(index_path: str) -> str:
+    return index_path + ".labels.npz"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def build_centroids(embedder=None) -> Dict[str, Tuple[List[str], np.ndarray]]:
+    """
+    Embed LABEL_SEEDS and OTHER_SEEDS in one pass and average them into unit-length centroids.
+
+    Returns:
+        Labels and a (labels x dimension) centroid matrix per facet, OTHER_LABEL last
+    """
+    texts = [seed for labels in LABEL_SEEDS.values() for seeds in labels.values() for seed in seeds]
+    vectors = iter(_normalize(embed_texts(texts + OTHER_SEEDS, embedder=embedder, show_progress=False)))
+    means = {facet: [np.mean([next(vectors) for _ in seeds], axis=0) for seeds in labels.values()]
+             for facet, labels in LABEL_SEEDS.items()}
+    other = np.mean(list(vectors), axis=0)
+    return {facet: (list(labels) + [OTHER_LABEL], _normalize(means[facet] + [other]))
+            for facet, labels in LABEL_SEEDS.items()}
+
+
+class IntentClassifier:
+    def __init__(self, centroids: Dict[str, Tuple[List[str], np.ndarray]], chunk_ids=None,
+                 chunk_labels: Optional[Dict[str, np.ndarray]] = None, threshold: float = 0.8,
+                 min_similarity: float = MIN_SIMILARITY, embedding_model: Optional[str] = None):
+        """
+        Local tone, topic and level classifier over query embeddings.
+
+        A query is labelled by comparing its embedding with each label's
+        centroid: one small matrix product, no completion call. Confidence
+        is a softmax over the cosine similarities (see TEMPERATURE); a label
+        counts only when it is confident, its centroid is at least
+        min_similarity away in cosine terms, and it is not OTHER_LABEL.
+
+        Args:
+            centroids: Labels and unit-length centroid matrix per facet
+            chunk_ids: Corpus chunk IDs, for partitioned retrieval (optional)
+            chunk_labels: Per facet, the label index of each chunk, or -1 when no label is confident
+            threshold: Minimum confidence for a label to be acted on
+            min_similarity: Minimum cosine similarity to the label's centroid
+            embedding_model: Model the centroids were embedded with (optional, unknown for offline embedders)
+        """
+        self.centroids = centroids
+        self.chunk_ids = np.asarray(chunk_ids if chunk_ids is not None else [], dtype=np.int64)
+        self.chunk_labels = chunk_labels or {}
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.embedding_model = embedding_model
+        self._partitions: Dict[Tuple[str, str], IdBitset] = {}
+
+    @classmethod
+    def load(cls, path: str, threshold: float = 0.8, min_similarity: Optional[float] = None,
+             embedding_model: Optional[str] = None) -> "IntentClassifier":
+        """
+        Read a classifier written by write.
+
+        Args:
+            path: Labels file
+            threshold: Minimum confidence for a label to be acted on
+            min_similarity: Overrides the floor stored with the centroids (optional)
+            embedding_model: Model queries are embedded with; must match the centroids' model when both are known
+
+        Returns:
+            The classifier
+
+        Raises:
+            ValueError: The centroids were embedded with a different model than the queries
+        """
+        with np.load(path) as data:
+            stored_model = str(data["embedding_model"]) if "embedding_model" in data else ""
+            if stored_model and embedding_model and stored_model != embedding_model:
+                # Similarities across embedding spaces mean nothing
+                raise ValueError(f"{path} was built with {stored_model} but queries are embedded with "
+                                 f"{embedding_model}; rebuild it with intent_classifier.py")
+            if min_similarity is None:
+                min_similarity = float(data["min_similarity"]) if "min_similarity" in data else MIN_SIMILARITY
+            facets = [str(facet) for facet in data["facets"]]
+            centroids = {facet: ([str(label) for label in data[f"{facet}_labels"]], data[f"{facet}_centroids"])
+                         for facet in facets}
+            chunk_labels = {facet: data[f"{facet}_chunk_labels"] for facet in facets
+                            if f"{facet}_chunk_labels" in data}
+            return cls(centroids, data["chunk_ids"], chunk_labels, threshold, min_similarity, stored_model or None)
+
+    def write(self, path: str) -> None:
+        arrays = {"facets": np.array(list(self.centroids)), "chunk_ids": self.chunk_ids,
+                  "min_similarity": np.float32(self.min_similarity),
+                  "embedding_model": np.array(self.embedding_model or "")}
+        for facet, (labels, matrix) in self.centroids.items():
+            arrays[f"{facet}_labels"] = np.array(labels)
+            arrays[f"{facet}_centroids"] = np.asarray(matrix, dtype=np.float32)
+        for facet, labels in self.chunk_labels.items():
+            arrays[f"{facet}_chunk_labels"] = labels
+        # Write aside and rename, like the index it sits next to
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def label_chunks(self, ids: Sequence[int], embeddings) -> None:
+        """Label corpus chunks by their embeddings, keeping only confident labels."""
+        self.chunk_ids = np.asarray(ids, dtype=np.int64)
+        self.chunk_labels = {}
+        for facet in PARTITION_FACETS:
+            best, confident = self._best(embeddings, facet)
+            self.chunk_labels[facet] = np.where(confident, best, -1).astype(np.int8)
+        self._partitions = {}
+
+    def _scores(self, embeddings, facet: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Cosine similarity to each label's centroid, and the softmax over them."""
+        labels, matrix = self.centroids[facet]
+        similarities = _normalize(np.atleast_2d(embeddings)) @ np.asarray(matrix).T
+        logits = similarities / TEMPERATURE
+        weights = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return labels, similarities, weights / weights.sum(axis=1, keepdims=True)
+
+    def _best(self, embeddings, facet: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Each row's best label index, and whether that label counts (see __init__)."""
+        labels, similarities, probabilities = self._scores(embeddings, facet)
+        best = probabilities.argmax(axis=1)
+        rows = np.arange(len(best))
+        confident = (probabilities[rows, best] >= self.threshold) & (similarities[rows, best] >= self.min_similarity)
+        if OTHER_LABEL in labels:
+            confident &= best != labels.index(OTHER_LABEL)
+        return best, confident
+
+    def classify(self, embedding, facets: Optional[Sequence[str]] = None) -> Dict[str, Tuple[str, float, float]]:
+        """
+        Label one embedding.
+
+        Returns:
+            (label, confidence, cosine similarity to the label's centroid) per facet
+        """
+        results = {}
+        for facet in facets or self.centroids:
+            labels, similarities, probabilities = self._scores(embedding, facet)
+            best = int(probabilities[0].argmax())
+            results[facet] = (labels[best], float(probabilities[0, best]), float(similarities[0, best]))
+        return results
+
+    def confident(self, embedding, facets: Optional[Sequence[str]] = None) -> Dict[str, str]:
+        """Labels that count (see __init__), per facet; facets without one are left out."""
+        labels = {}
+        for facet in facets or self.centroids:
+            best, confident = self._best(embedding, facet)
+            label = self.centroids[facet][0][int(best[0])]
+            outcome = "confident" if confident[0] else "unsure"
+            CLASSIFICATIONS.inc(facet=facet, outcome=outcome)
+            if outcome == "confident":
+                labels[facet] = label
+        return labels
+
+    def partition_exclusion(self, labels: Dict[str, str]) -> Optional[IdBitset]:
+        """
+        Chunks outside the corpus partitions for a query's labels: those
+        confidently labelled with a different, non-neutral label in a
+        partition facet. Unlabelled and neutral chunks are in every partition.
+
+        Returns:
+            Chunk IDs to exclude, or None when the labels partition nothing
+        """
+        excluded = None
+        for facet in PARTITION_FACETS:
+            label = labels.get(facet)
+            if label is None or label == NEUTRAL_LABELS.get(facet) or facet not in self.chunk_labels:
+                continue
+            key = (facet, label)
+            if key not in self._partitions:
+                names = self.centroids[facet][0]
+                chunk_labels = self.chunk_labels[facet]
+                others = (chunk_labels >= 0) & (chunk_labels != names.index(label))
+                if facet in NEUTRAL_LABELS:
+                    others &= chunk_labels != names.index(NEUTRAL_LABELS[facet])
+                partition = IdBitset()
+                partition.add(self.chunk_ids[others])
+                self._partitions[key] = partition
+            excluded = self._partitions[key] if excluded is None else excluded | self._partitions[key]
+        return excluded
+
+
+def write_labels(index_path: str, ids: Sequence[int], embeddings, embedder=None,
+                 threshold: float = 0.8, min_similarity: Optional[float] = None) -> IntentClassifier:
+    """
+    Build label centroids, label the corpus chunks and write both next to the index.
+
+    The embedding model and similarity floor are written with them. Without an
+    explicit floor, the one tuned for the model is used, or MIN_SIMILARITY with
+    a warning when the model has none.
+    """
+    embedding_model = DEFAULT_EMBEDDING_MODEL if embedder is None else getattr(embedder, "model", None)
+    if min_similarity is None:
+        min_similarity = MIN_SIMILARITY_BY_MODEL.get(embedding_model)
+        if min_similarity is None:
+            min_similarity = MIN_SIMILARITY
+            logger.warning("No similarity floor tuned for %s; using %.2f, set one with --min-similarity",
+                           embedding_model or "this embedder", min_similarity)
+    classifier = IntentClassifier(build_centroids(embedder), threshold=threshold, min_similarity=min_similarity,
+                                  embedding_model=embedding_model)
+    classifier.label_chunks(ids, embeddings)
+    classifier.write(labels_path(index_path))
+    return classifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write tone/topic/level centroids and chunk labels for an index.")
+    parser.add_argument("--index", default="faiss_index.idx", help="Index the labels are stored next to")
+    parser.add_argument("--docstore", default="docstore", help="Document store holding the chunk embeddings")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Minimum confidence for a chunk label")
+    parser.add_argument("--min-similarity", type=float, default=None,
+                        help="Minimum cosine similarity between a chunk and its label's centroid "
+                             "(default: tuned for the embedding model)")
+    args = parser.parse_args()
+
+    store = DocumentStore(args.docstore)
+    classifier = write_labels(args.index, store.ids, store.embeddings, threshold=args.threshold,
+                              min_similarity=args.min_similarity)
+    store.close()
+    for facet, labels in classifier.chunk_labels.items():
+        names = classifier.centroids[facet][0]
+        counts = {names[i]: int((labels == i).sum()) for i in range(len(names))}
+        print(f"{facet}: {counts}, unlabelled: {int((labels < 0).sum())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import json
+from typing import Any, Iterable, List, Tuple
+
+
+class IncrementalJSONParser:
+    def __init__(self, array_keys: Iterable[str] = ("idioms",), string_keys: Iterable[str] = ("message",)):
+        """
+        Incremental parser for the JSON objects our prompts ask the model for.
+
+        Feed it completion tokens as they arrive and it returns every element
+        of a watched top-level array, and every watched top-level string, as
+        soon as that value is complete. Anything before the first '{' (such
+        as a markdown code fence) is ignored.
+
+        Args:
+            array_keys: Top-level keys whose array elements should be emitted
+            string_keys: Top-level keys whose string values should be emitted
+        """
+        self.array_keys = set(array_keys)
+        self.string_keys = set(string_keys)
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = False
+        self._current_key = None
+        self._element_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Consume a chunk of model output.
+
+        Returns:
+            List of (key, value) pairs completed by this chunk
+        """
+        self.buffer += chunk
+        events = []
+        while self._pos < len(self.buffer):
+            i = self._pos
+            char = self.buffer[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        value = json.loads(self.buffer[self._string_start:i + 1])
+                        if self._expect_key:
+                            self._current_key = value
+                        elif self._current_key in self.string_keys:
+                            events.append((self._current_key, value))
+                continue
+
+            if not self._stack and char != "{":
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                if (char == "{" and self._stack == ["{", "["]
+                        and self._current_key in self.array_keys):
+                    self._element_start = i
+                self._stack.append(char)
+                if len(self._stack) == 1:
+                    self._expect_key = True
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                popped = self._stack.pop()
+                if (popped == "{" and self._stack == ["{", "["]
+                        and self._element_start is not None):
+                    try:
+                        events.append((self._current_key, json.loads(self.buffer[self._element_start:i + 1])))
+                    except json.JSONDecodeError:
+                        pass
+                    self._element_start = None
+            elif len(self._stack) == 1:
+                if char == ":":
+                    self._expect_key = False
+                elif char == ",":
+                    self._expect_key = True
+        return events
@@ -0,0 +1,294 @@
+import json
+import math
+import os
+import re
+import shutil
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from id_bitset import IdBitset
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+VOWELS = frozenset("aeiou")
+
+
+def _consonant(word: str, i: int) -> bool:
+    if word[i] in VOWELS:
+        return False
+    # "y" is a vowel after a consonant ("cry"), a consonant otherwise ("yes", "play")
+    return word[i] != "y" or i == 0 or not _consonant(word, i - 1)
+
+
+def _measure(word: str) -> int:
+    """Porter's m: the number of vowel-consonant sequences in the word."""
+    forms = "".join("c" if _consonant(word, i) else "v" for i in range(len(word)))
+    return forms.count("vc")
+
+
+def _has_vowel(word: str) -> bool:
+    return any(not _consonant(word, i) for i in range(len(word)))
+
+
+def _ends_cvc(word: str) -> bool:
+    """Consonant-vowel-consonant ending, last not w/x/y: short stems like "mak" keep their "e"."""
+    return (len(word) >= 3 and _consonant(word, len(word) - 3) and not _consonant(word, len(word) - 2)
+            and _consonant(word, len(word) - 1) and word[-1] not in "wxy")
+
+
+def stem(token: str) -> str:
+    """
+    Strip inflections with steps 1 and 5 of the Porter stemmer, using
+    Porter2's rules for plurals and final "y".
+
+    Every inflection of a word maps to the same stem, so "makes ends meet",
+    "making ends meet" and "make ends meet" match each other ("makes" and
+    "make" both become "make", "rides" and "riding" both "ride").
+    """
+    if token.endswith("'s"):
+        token = token[:-2]
+    if len(token) <= 2:
+        return token
+
+    # Step 1a: plurals and third person -s
+    if token.endswith("sses"):
+        token = token[:-2]
+    elif token.endswith("ies"):
+        token = token[:-1] if len(token) == 4 else token[:-2]
+    elif token.endswith("s") and not token.endswith(("ss", "us")) and _has_vowel(token[:-2]):
+        token = token[:-1]
+
+    # Step 1b: -ed and -ing, restoring what the suffix took ("hoping" -> "hope", "running" -> "run")
+    if token.endswith("ied"):
+        token = token[:-1] if len(token) == 4 else token[:-2]
+    elif token.endswith("eed"):
+        if _measure(token[:-3]) > 0:
+            token = token[:-1]
+    else:
+        for suffix in ("ed", "ing"):
+            if token.endswith(suffix) and _has_vowel(token[:-len(suffix)]):
+                token = token[:-len(suffix)]
+                if token.endswith(("at", "bl", "iz")):
+                    token += "e"
+                elif len(token) >= 2 and token[-1] == token[-2] and _consonant(token, len(token) - 1) \
+                        and token[-1] not in "lsz":
+                    token = token[:-1]
+                elif _measure(token) == 1 and _ends_cvc(token):
+                    token += "e"
+                break
+
+    # Step 1c: "cry", "cries" and "cried" all become "cri"
+    if token.endswith("y") and len(token) > 2 and _consonant(token, len(token) - 2):
+        token = token[:-1] + "i"
+
+    # Step 5: final "e" unless the stem is short ("make" keeps it, "house" drops it), and "ll"
+    if token.endswith("e"):
+        measure = _measure(token[:-1])
+        if measure > 1 or (measure == 1 and not _ends_cvc(token[:-1])):
+            token = token[:-1]
+    if token.endswith("ll") and _measure(token) > 1:
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, split into words and stem; used for both documents and queries."""
+    return [stem(token) for token in TOKEN.findall(text.lower().replace("’", "'"))]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Fuse several rankings of document IDs.
+
+    Each document scores the sum of 1 / (k + rank) over the rankings it
+    appears in, so agreement between retrievers outweighs a high rank in one.
+
+    Returns:
+        (doc_id, fused score) pairs, best first
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[int(doc_id)] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    def __init__(self, path: str):
+        """
+        Read-only BM25 inverted index with term positions, for phrase lookups.
+
+        Postings are stored as flat .npy columns in CSR layout (term ->
+        postings -> positions) and memory-mapped like the document store, so
+        a lookup is a few array slices with no network call.
+
+        Args:
+            path: Directory written by LexicalIndex.write
+        """
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"The lexical index '{path}' was not found.")
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.avg_length = meta["avg_length"]
+        self.terms = {term: position for position, term in enumerate(meta["terms"])}
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.ids = load("ids")
+        self.lengths = load("lengths")
+        self.term_offsets = load("term_offsets")
+        self.posting_rows = load("posting_rows")
+        self.position_offsets = load("position_offsets")
+        self.positions = load("positions")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _postings(self, term: str) -> Tuple[int, int]:
+        """Return the [start, end) range of a term's postings (empty if unknown)."""
+        position = self.terms.get(term)
+        if position is None:
+            return 0, 0
+        return int(self.term_offsets[position]), int(self.term_offsets[position + 1])
+
+    def _scores(self, terms: List[str]) -> np.ndarray:
+        """BM25 score of every row (zero for rows containing none of the terms)."""
+        count = len(self.ids)
+        scores = np.zeros(count, dtype=np.float64)
+        for term in set(terms):
+            start, end = self._postings(term)
+            if start == end:
+                continue
+            rows = np.asarray(self.posting_rows[start:end])
+            frequencies = np.diff(np.asarray(self.position_offsets[start:end + 1]))
+            idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+            norms = self.k1 * (1 - self.b + self.b * self.lengths[rows] / self.avg_length)
+            # A term occurs at most once per row in its postings, so plain fancy-index addition is safe
+            scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norms)
+        return scores
+
+    def _ranked(self, scores: np.ndarray, rows: np.ndarray, top_k: int,
+                exclude: Optional[IdBitset] = None) -> List[Tuple[int, float]]:
+        if exclude:
+            rows = rows[~exclude.contains(self.ids[rows])]
+        best = rows[np.argsort(-scores[rows], kind="stable")[:top_k]]
+        return [(int(self.ids[row]), float(scores[row])) for row in best]
+
+    def search(self, query: str, top_k: int = 5, exclude: Optional[IdBitset] = None) -> List[Tuple[int, float]]:
+        """
+        Rank documents by BM25.
+
+        Args:
+            query: Search text
+            top_k: Number of results
+            exclude: Doc IDs to leave out (top_k are still returned when enough others match)
+
+        Returns:
+            (doc_id, score) pairs, best first
+        """
+        scores = self._scores(tokenize(query))
+        return self._ranked(scores, np.flatnonzero(scores), top_k, exclude)
+
+    def phrase_search(self, query: str, top_k: int = 5,
+                      exclude: Optional[IdBitset] = None) -> List[Tuple[int, float]]:
+        """
+        Find documents containing the query's words as a contiguous phrase.
+
+        Single-word queries never count as phrases; they match too broadly
+        to stand in for semantic search. Doc IDs in exclude are left out.
+
+        Returns:
+            (doc_id, BM25 score) pairs for phrase matches, best first
+        """
+        terms = tokenize(query)
+        if len(terms) < 2:
+            return []
+        ranges = [self._postings(term) for term in terms]
+        if any(start == end for start, end in ranges):
+            return []
+
+        # Rows are stored in ascending order within each term's postings, so
+        # candidates are a sorted intersection, rarest term first
+        rows = [np.asarray(self.posting_rows[start:end]) for start, end in ranges]
+        candidates = rows[min(range(len(rows)), key=lambda i: len(rows[i]))]
+        for term_rows in rows:
+            candidates = np.intersect1d(candidates, term_rows, assume_unique=True)
+
+        def positions(i, row):
+            posting = ranges[i][0] + int(np.searchsorted(rows[i], row))
+            first, last = int(self.position_offsets[posting]), int(self.position_offsets[posting + 1])
+            return self.positions[first:last]
+
+        matches = []
+        for row in candidates.tolist():
+            # Shift every term's positions back to where the phrase would start
+            starts = set(positions(0, row).tolist())
+            for i in range(1, len(terms)):
+                starts &= {position - i for position in positions(i, row).tolist()}
+                if not starts:
+                    break
+            if starts:
+                matches.append(row)
+        if not matches:
+            return []
+        return self._ranked(self._scores(terms), np.asarray(matches, dtype=np.int64), top_k, exclude)
+
+    @staticmethod
+    def write(path: str, ids: List[int], texts: List[str], k1: float = 1.2, b: float = 0.75) -> None:
+        """
+        Build and write a lexical index, replacing any existing one at path.
+
+        Args:
+            path: Target directory
+            ids: Document IDs (the FAISS index IDs)
+            texts: Document text
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+        """
+        postings: Dict[str, List[Tuple[int, List[int]]]] = defaultdict(list)
+        lengths = []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            term_positions: Dict[str, List[int]] = defaultdict(list)
+            for position, token in enumerate(tokens):
+                term_positions[token].append(position)
+            for term, positions in term_positions.items():
+                postings[term].append((row, positions))
+
+        terms = sorted(postings)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        posting_rows, position_counts, positions = [], [], []
+        for i, term in enumerate(terms):
+            for row, term_positions in postings[term]:
+                posting_rows.append(row)
+                position_counts.append(len(term_positions))
+                positions.extend(term_positions)
+            term_offsets[i + 1] = len(posting_rows)
+        position_offsets = np.zeros(len(posting_rows) + 1, dtype=np.int64)
+        position_offsets[1:] = np.cumsum(position_counts)
+
+        tmp_path = path.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "ids.npy"), np.asarray(ids, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "lengths.npy"), np.asarray(lengths, dtype=np.int32))
+        np.save(os.path.join(tmp_path, "term_offsets.npy"), term_offsets)
+        np.save(os.path.join(tmp_path, "posting_rows.npy"), np.asarray(posting_rows, dtype=np.int32))
+        np.save(os.path.join(tmp_path, "position_offsets.npy"), position_offsets)
+        np.save(os.path.join(tmp_path, "positions.npy"), np.asarray(positions, dtype=np.int32))
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": k1,
+                "b": b,
+                "avg_length": float(np.mean(lengths)) if lengths else 0.0,
+                "terms": terms
+            }, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
@@ -0,0 +1,170 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Seconds; spans in-process lookups (sub-millisecond) up to slow completions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """Monotonic counter, exposed as name_total."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name}_total {self.documentation}", f"# TYPE {self.name}_total counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}_total{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """Value that goes up and down, reported as last set."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Cumulative-bucket histogram in the Prometheus text format."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _label_text(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _label_text(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "idiom_stage_seconds",
+    "Time spent in each request stage (embed, search, prompt_build, completion, parse, session_update, ...)",
+    ["stage"]
+)
+REQUEST_SECONDS = Histogram("idiom_request_seconds", "End-to-end request time per endpoint", ["endpoint"])
+TOKENS = Counter("idiom_tokens", "OpenAI tokens used", ["kind"])
+CACHE_EVENTS = Counter("idiom_cache_events", "Cache lookups by cache and result", ["cache", "result"])
+ERRORS = Counter("idiom_errors", "Errors by stage", ["stage"])
+COALESCED = Counter(
+    "idiom_coalesced_calls",
+    "Calls served by an identical call already in flight, in this process or another worker",
+    ["stage", "scope"]
+)
+ADMISSION_EVENTS = Counter(
+    "idiom_admission_events",
+    "Upstream admission decisions (rejected, timed_out, circuit_open, circuit_opened) and degraded answers",
+    ["endpoint", "event"]
+)
+UPSTREAM_LIMIT = Gauge("idiom_upstream_concurrency_limit", "Current adaptive concurrency limit per upstream endpoint", ["endpoint"])
+UPSTREAM_INFLIGHT = Gauge("idiom_upstream_inflight", "Upstream calls in flight per endpoint", ["endpoint"])
+ROUTE_SECONDS = Histogram(
+    "idiom_route_seconds",
+    "Completion time per call type and model (model=\"template\" when answered locally)",
+    ["route", "model"]
+)
+ROUTE_TOKENS = Counter("idiom_route_tokens", "OpenAI tokens used per call type", ["route", "kind"])
+CLASSIFICATIONS = Counter(
+    "idiom_classifications",
+    "Local embedding classifications per facet (tone, topic, level) by outcome (confident, unsure)",
+    ["facet", "outcome"]
+)
+
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, TOKENS, CACHE_EVENTS, ERRORS, COALESCED,
+           ADMISSION_EVENTS, UPSTREAM_LIMIT, UPSTREAM_INFLIGHT, ROUTE_SECONDS, ROUTE_TOKENS, CLASSIFICATIONS]
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the duration of a block in idiom_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_usage(usage) -> None:
+    """Count prompt and completion tokens from an OpenAI usage object (which may be None)."""
+    if usage is None:
+        return
+    TOKENS.inc(usage.prompt_tokens, kind="prompt")
+    TOKENS.inc(usage.completion_tokens, kind="completion")
+
+
+def render() -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    Metrics are per process; with several workers each scrape sees the
+    worker that served it, so scrape workers individually or aggregate.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+from typing import Dict, Iterator, Optional
+
+from metrics import ROUTE_SECONDS, ROUTE_TOKENS, record_usage
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    How one kind of completion is made: model, output budget, sampling and format.
+
+    max_tokens is sized to the reply each call type actually needs; output
+    tokens are generated one at a time, so a tight cap bounds the slowest
+    part of a completion. template routes are answered from a local
+    template when the reply can be worked out without the model.
+    """
+    name: str
+    model: str = "gpt-4o-mini"
+    max_tokens: int = 1000
+    temperature: float = 0.7
+    json_mode: bool = True
+    template: bool = False
+
+    def completion_args(self) -> Dict:
+        """Keyword arguments for chat.completions.create."""
+        args = {"model": self.model, "max_tokens": self.max_tokens, "temperature": self.temperature}
+        if self.json_mode:
+            # Every JSON route's prompt spells out its format, as JSON mode requires
+            args["response_format"] = {"type": "json_object"}
+        return args
+
+    def observe(self, seconds: float, model: Optional[str] = None) -> None:
+        ROUTE_SECONDS.observe(seconds, route=self.name, model=model or self.model)
+
+    def record_usage(self, usage) -> None:
+        """Count a completion's tokens overall and for this route (usage may be None)."""
+        record_usage(usage)
+        if usage is not None:
+            ROUTE_TOKENS.inc(usage.prompt_tokens, route=self.name, kind="prompt")
+            ROUTE_TOKENS.inc(usage.completion_tokens, route=self.name, kind="completion")
+
+    @contextmanager
+    def timed(self) -> Iterator[None]:
+        """Record the duration of a completion in idiom_route_seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+DEFAULT_ROUTES = {
+    route.name: route for route in (
+        # Three idioms with meaning and example
+        Route("search", max_tokens=600),
+        Route("rerank", max_tokens=50, temperature=0.0),
+        # Free-text introductions for new sessions
+        Route("intro", max_tokens=150, json_mode=False),
+        # Learning states; greeting and assess_level replies are two sentences from a fixed script
+        Route("greeting", max_tokens=150, template=True),
+        Route("assess_level", max_tokens=150, template=True),
+        Route("teach", max_tokens=400),
+        Route("practice", max_tokens=150),
+        Route("feedback", max_tokens=150)
+    )
+}
+
+
+class ModelRouter:
+    def __init__(self, routes: Optional[Dict[str, Route]] = None):
+        """
+        Table of completion settings per call type (see DEFAULT_ROUTES).
+
+        Args:
+            routes: Route per call type; call types missing from it use the defaults
+        """
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """
+        Build a router from MODEL_ROUTES, a JSON object of per-route overrides,
+        e.g. {"teach": {"model": "gpt-4o", "max_tokens": 600}, "greeting": {"template": false}}.
+        """
+        overrides = json.loads(os.environ.get("MODEL_ROUTES") or "{}")
+        known = {field.name for field in fields(Route)} - {"name"}
+        routes = {}
+        for name, settings in overrides.items():
+            unknown = set(settings) - known
+            if unknown:
+                raise ValueError(f"Unknown settings for route '{name}': {', '.join(sorted(unknown))}")
+            routes[name] = replace(DEFAULT_ROUTES.get(name, Route(name)), **settings)
+        return cls(routes)
+
+    def route(self, call_type: str) -> Route:
+        """Return the route for a call type, falling back to default settings for unknown ones."""
+        return self.routes.get(call_type) or Route(call_type)
@@ -0,0 +1,116 @@
+import os
+import threading
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from admission import AdmissionController
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class OpenAIClientFactory:
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_connections: int = 64, max_keepalive_connections: int = 32,
+                 keepalive_expiry: float = 60.0, connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0, max_retries: int = 3, http2: Optional[bool] = None,
+                 admission: Optional[AdmissionController] = None):
+        """
+        One sync and one async OpenAI client per process, shared by every component.
+
+        Sharing the clients means one keep-alive connection pool (and one set
+        of TLS sessions) per worker instead of one per component, and a single
+        place to tune upstream concurrency, timeouts and retries. Retries use
+        the SDK's exponential backoff with jitter, honoring Retry-After.
+
+        Args:
+            api_key: OpenAI API key (defaults to OPENAI_API_KEY)
+            base_url: API base URL, e.g. a local stand-in server (defaults to OPENAI_BASE_URL or api.openai.com)
+            max_connections: Upper bound on concurrent upstream connections
+            max_keepalive_connections: Idle connections kept open for reuse
+            keepalive_expiry: Seconds an idle connection is kept
+            connect_timeout: Seconds to establish a connection
+            read_timeout: Seconds to wait for response data (between streamed chunks too)
+            max_retries: Retries for connection errors, 408/409/429 and 5xx responses
+            http2: Negotiate HTTP/2 (defaults to on when the h2 package is installed)
+            admission: Concurrency limits and circuit breakers that callers put upstream calls
+                through (defaults to one with the default settings)
+        """
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.base_url = base_url or os.environ.get("OPENAI_BASE_URL") or None
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2 and HTTP2_AVAILABLE
+        self.admission = admission or AdmissionController()
+
+        self._client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "OpenAIClientFactory":
+        """Build a factory from OPENAI_* environment variables, using the defaults for any that are unset."""
+        def number(name, default, cast=float):
+            value = os.environ.get(name)
+            return cast(value) if value else default
+
+        http2 = os.environ.get("OPENAI_HTTP2")
+        return cls(
+            max_connections=number("OPENAI_MAX_CONNECTIONS", 64, int),
+            max_keepalive_connections=number("OPENAI_MAX_KEEPALIVE", 32, int),
+            keepalive_expiry=number("OPENAI_KEEPALIVE_EXPIRY", 60.0),
+            connect_timeout=number("OPENAI_CONNECT_TIMEOUT", 5.0),
+            read_timeout=number("OPENAI_READ_TIMEOUT", 60.0),
+            max_retries=number("OPENAI_MAX_RETRIES", 3, int),
+            http2=None if http2 is None else http2.lower() in ("1", "true", "yes"),
+            admission=AdmissionController.from_env()
+        )
+
+    def client(self) -> OpenAI:
+        """Return the shared sync client, creating it on first use."""
+        with self._lock:
+            if self._client is None:
+                self._client = OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=self.max_retries,
+                    http_client=DefaultHttpxClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+                )
+            return self._client
+
+    def async_client(self) -> AsyncOpenAI:
+        """Return the shared async client, creating it on first use."""
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=self.max_retries,
+                    http_client=DefaultAsyncHttpxClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+                )
+            return self._async_client
+
+
+_default_factory: Optional[OpenAIClientFactory] = None
+_default_lock = threading.Lock()
+
+
+def default_client_factory() -> OpenAIClientFactory:
+    """Process-wide factory configured from the environment, used when a component is not given one."""
+    global _default_factory
+    with _default_lock:
+        if _default_factory is None:
+            _default_factory = OpenAIClientFactory.from_env()
+        return _default_factory
@@ -1,85 +1,444 @@
-import pickle
+import asyncio
 import numpy as np
 import faiss
-from openai import OpenAI
-import os
-from typing import List, Optional
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from admission import UPSTREAM_FAILURES, Overloaded
+from context_packer import ContextPacker, Section, by_score
+from document_store import DocumentStore
+from embedding_cache import EmbeddingCache, normalize_query
+from id_bitset import IdBitset
+from idiom_catalog import IdiomCatalog
+from index_backends import apply_search_params, read_index, read_index_meta, search_parameters
+from intent_classifier import PARTITION_FACETS, IntentClassifier, labels_path
+from json_stream import IncrementalJSONParser
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from metrics import ADMISSION_EVENTS, CACHE_EVENTS, ERRORS, STAGE_SECONDS, timed
+from model_routing import ModelRouter, Route
+from openai_client import OpenAIClientFactory, default_client_factory
+from response_cache import SemanticResponseCache, detect_tone
+from single_flight import TEXT_CODEC, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Query vectors cross workers through the single-flight store as JSON lists
+EMBEDDING_CODEC = (lambda vector: json.dumps(vector.tolist()),
+                   lambda text: np.array(json.loads(text), dtype='float32'))
 
 class RAGSystem:
-    def __init__(self, faiss_index_path: str, vectors_path: str, api_key: Optional[str] = None):
+    def __init__(self, faiss_index_path: str, docstore_path: str, api_key: Optional[str] = None,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 response_cache: Optional[SemanticResponseCache] = None,
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                 catalog_path: Optional[str] = None, catalog_rerank: bool = True,
+                 lexical_path: Optional[str] = None, clients: Optional[OpenAIClientFactory] = None,
+                 single_flight: Optional[SingleFlight] = None, router: Optional[ModelRouter] = None,
+                 classifier_threshold: float = 0.8, classifier_min_similarity: Optional[float] = None):
         """
         Initialize the RAG system.
         
         Args:
             faiss_index_path: Path to the FAISS index file
-            vectors_path: Path to the pickled vectors file
+            docstore_path: Path to the document store directory written by Data_preprocessing
             api_key: OpenAI API key (optional, will use environment variable if not provided)
+            embedding_cache: Cache consulted before calling the embeddings API (optional)
+            response_cache: Semantic cache of generated responses for near-duplicate queries (optional)
+            nprobe: Inverted lists probed per search for IVF indexes (optional)
+            ef_search: HNSW search breadth (optional)
+            catalog_path: Directory of the structured idiom catalog, enabling mode="catalog" (optional)
+            catalog_rerank: Let the LLM re-rank catalog hits for queries that ask for a tone
+            lexical_path: Directory of the BM25/phrase index over the corpus, enabling hybrid retrieval (optional)
+            clients: Shared OpenAI client factory (defaults to the process-wide one, or a
+                dedicated one when api_key is given)
+            single_flight: Coalesces identical in-flight embeddings and queries (defaults to
+                coalescing within this process)
+            router: Model, output budget and format per call type (defaults to DEFAULT_ROUTES)
+            classifier_threshold: Confidence at which the local tone/topic/level classifier's
+                labels are acted on
+            classifier_min_similarity: Cosine similarity to a label's centroid below which
+                the label is ignored however confident the classifier is (optional, defaults to
+                the floor stored with the centroids)
         """
-        self.api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        if clients is None:
+            clients = OpenAIClientFactory(api_key=api_key) if api_key else default_client_factory()
+        self.api_key = clients.api_key
         if not self.api_key:
             raise ValueError("OpenAI API key not found.")
         
-        # Cache the OpenAI client
-        self.client = OpenAI(api_key=self.api_key)
+        # Shared with the other components; the async client serves the ASGI app
+        self.client = clients.client()
+        self.async_client = clients.async_client()
+        # Limits and breakers every upstream call goes through
+        self.admission = clients.admission
+        
+        # Query embeddings are cached across requests and workers
+        self.embedding_model = "text-embedding-ada-002"
+        self.embedding_cache = embedding_cache
+        self.response_cache = response_cache
+        self.single_flight = single_flight or SingleFlight()
+        self.router = router or ModelRouter()
         
         # Cache the FAISS index and documents
-        self.faiss_index = self._load_faiss_index(faiss_index_path)
-        self.documents = self._load_documents(vectors_path)
+        self.faiss_index = self._load_faiss_index(faiss_index_path, nprobe, ef_search)
+        self.documents = self._load_documents(docstore_path)
+        self.lexical = self._load_lexical(lexical_path) if lexical_path else None
+        self.catalog = self._load_catalog(catalog_path) if catalog_path else None
+        self.catalog_rerank = catalog_rerank
+        self.classifier = self._load_classifier(labels_path(faiss_index_path), classifier_threshold,
+                                                 classifier_min_similarity)
         
         # Set a shorter timeout for API calls
         self.timeout = 30
 
-    def _load_faiss_index(self, index_path: str) -> faiss.Index:
-        """Load the FAISS index from file."""
+    def _load_faiss_index(self, index_path: str, nprobe: Optional[int] = None,
+                          ef_search: Optional[int] = None) -> faiss.Index:
+        """Memory-map the FAISS index (when its type allows) and apply its runtime search knobs."""
         try:
-            index = faiss.read_index(index_path)
-            print(f"FAISS index loaded from {index_path}")
+            index = read_index(index_path)
+            self.index_meta = read_index_meta(index_path)
+            apply_search_params(index, nprobe=nprobe, ef_search=ef_search)
+            logger.info("FAISS index (%s) loaded from %s", self.index_meta['spec']['kind'], index_path)
             return index
         except Exception as e:
             raise Exception(f"Error loading FAISS index: {str(e)}")
 
-    def _load_documents(self, vectors_path: str) -> List:
-        """Load the document vectors from pickle file."""
+    def _load_documents(self, docstore_path: str) -> DocumentStore:
+        """Memory-map the document store so workers share it through the OS page cache."""
         try:
-            with open(vectors_path, 'rb') as f:
-                return pickle.load(f)
-        except FileNotFoundError:
-            raise Exception(f"The file '{vectors_path}' was not found.")
+            return DocumentStore(docstore_path)
+        except FileNotFoundError as e:
+            raise Exception(str(e))
+
+    def _load_lexical(self, lexical_path: str) -> Optional[LexicalIndex]:
+        """Load the lexical index; without one, retrieval is dense only."""
+        try:
+            lexical = LexicalIndex(lexical_path)
+            logger.info("Lexical index (%d documents) loaded from %s", len(lexical), lexical_path)
+            return lexical
+        except Exception as e:
+            logger.warning("Lexical index not available: %s", e)
+            return None
+
+    def _load_catalog(self, catalog_path: str) -> Optional[IdiomCatalog]:
+        """Load the idiom catalog; without one, catalog queries fall back to generation."""
+        try:
+            catalog = IdiomCatalog(catalog_path)
+            logger.info("Idiom catalog (%d idioms) loaded from %s", len(catalog), catalog_path)
+            return catalog
+        except Exception as e:
+            logger.warning("Idiom catalog not available: %s", e)
+            return None
+
+    def _load_classifier(self, path: str, threshold: float,
+                         min_similarity: Optional[float]) -> Optional[IntentClassifier]:
+        """Load the label centroids stored with the index; without them, nothing is classified locally."""
+        try:
+            classifier = IntentClassifier.load(path, threshold, min_similarity, self.embedding_model)
+            logger.info("Label centroids (%s) loaded from %s", ", ".join(classifier.centroids), path)
+            return classifier
+        except Exception as e:
+            logger.warning("Label centroids not available: %s", e)
+            return None
+
+    def _cached_embedding(self, query: str) -> Optional[np.ndarray]:
+        if self.embedding_cache is None:
+            return None
+        cached = self.embedding_cache.get(query, self.embedding_model)
+        CACHE_EVENTS.inc(cache="embedding", result="miss" if cached is None else "hit")
+        return cached
+
+    def _embedding_key(self, query: str) -> str:
+        # Same normalization as the embedding cache, so its equivalent queries coalesce too
+        return f"embed:{self.embedding_model}:{normalize_query(query)}"
+
+    def _store_embedding(self, query: str, response) -> np.ndarray:
+        query_embedding = np.array(response.data[0].embedding).astype('float32')
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(query, self.embedding_model, query_embedding)
+        return query_embedding
 
     def embed_query(self, query: str) -> np.ndarray:
-        """Create embeddings for the query."""
-        response = self.client.embeddings.create(
-            input=query,
-            model="text-embedding-ada-002"
-        )
-        query_embedding = response.data[0].embedding
-        return np.array(query_embedding).astype('float32').reshape(1, -1)
+        """Create embeddings for the query, reusing cached vectors and identical in-flight calls."""
+        cached = self._cached_embedding(query)
+        if cached is not None:
+            return cached.reshape(1, -1)
+        
+        def fetch() -> np.ndarray:
+            with self.admission.guard("embeddings"), timed("embed"):
+                response = self.client.embeddings.create(
+                    input=query,
+                    model=self.embedding_model
+                )
+            return self._store_embedding(query, response)
+        
+        query_embedding = self.single_flight.do(self._embedding_key(query), fetch, "embed", EMBEDDING_CODEC)
+        return query_embedding.reshape(1, -1)
 
-    def search_similar_documents(self, query_embedding: np.ndarray, top_k: int = 5) -> List[str]:
-        """Search for similar documents using the query embedding."""
-        distances, indices = self.faiss_index.search(query_embedding, top_k)
+    async def aembed_query(self, query: str) -> np.ndarray:
+        """Async variant of embed_query; the shared cache file is read and written off the event loop."""
+        cached = await asyncio.to_thread(self._cached_embedding, query)
+        if cached is not None:
+            return cached.reshape(1, -1)
         
-        # Debug prints
-        print("\n=== Debug: FAISS Search Results ===")
-        print(f"Indices found: {indices}")
-        print(f"Distances: {distances}")
+        async def fetch() -> np.ndarray:
+            async with self.admission.aguard("embeddings"):
+                with timed("embed"):
+                    response = await self.async_client.embeddings.create(
+                        input=query,
+                        model=self.embedding_model
+                    )
+            return await asyncio.to_thread(self._store_embedding, query, response)
         
-        return [self.documents[i] for i in indices[0] if i < len(self.documents)]
+        query_embedding = await self.single_flight.ado(self._embedding_key(query), fetch, "embed", EMBEDDING_CODEC)
+        return query_embedding.reshape(1, -1)
 
-    def generate_response(self, context: List[str], query: str, 
-                         model: str = "gpt-4o-mini", max_completion_tokens: int = 2048) -> str:
-        """Generate a response using GPT-4o-mini model with optimized parameters."""
-        try:
-            # Limit each document to 500 characters and take only top 5 documents
-            truncated_docs = [str(doc)[:500] for doc in context[:5]]
-            context_text = "\n".join(truncated_docs)
-            
-            # Further truncate if still too long
-            if len(context_text) > 4000:  # Arbitrary limit to ensure we stay within token bounds
-                context_text = context_text[:4000] + "..."
-            
-            prompt = f"""You are an idioms expert. Based on the query and context, provide exactly 3 idioms.
+    def _search(self, query_embeddings: np.ndarray, top_k: int,
+                exclude: Optional[IdBitset] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run the FAISS search, normalizing queries when the index expects it.
+
+        Chunk IDs in exclude are skipped inside the search through an ID
+        selector, so top_k other chunks still come back. Index kinds without
+        selector support fall back to over-fetching and dropping excluded IDs.
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+        if self.index_meta["normalized"]:
+            query_embeddings = query_embeddings.copy()
+            faiss.normalize_L2(query_embeddings)
+        with timed("search"):
+            if not exclude:
+                return self.faiss_index.search(query_embeddings, top_k)
+            selector = exclude.exclusion_selector()
+            try:
+                return self.faiss_index.search(query_embeddings, top_k,
+                                               params=search_parameters(self.faiss_index, selector))
+            except RuntimeError:
+                distances, indices = self.faiss_index.search(query_embeddings, top_k + len(exclude))
+        keep = (indices != -1) & ~exclude.contains(indices)
+        # Stable sort moves kept hits to the front of each row without reordering them
+        order = np.argsort(~keep, axis=1, kind="stable")[:, :top_k]
+        indices = np.take_along_axis(indices, order, axis=1)
+        indices[~np.take_along_axis(keep, order, axis=1)] = -1
+        return np.take_along_axis(distances, order, axis=1), indices
+
+    def _similarities(self, distances: np.ndarray) -> np.ndarray:
+        """Convert FAISS distances to cosine similarities (higher is better)."""
+        if self.index_meta["normalized"]:
+            return distances
+        # Squared L2 between unit vectors (ada-002 embeddings are unit length) is 2 - 2cos
+        return 1 - distances / 2
+
+    def _ranked_ids(self, query_embedding: np.ndarray, top_k: int, query: Optional[str] = None,
+                    exclude: Optional[IdBitset] = None) -> Tuple[List[int], List[float]]:
+        """
+        Rank chunk IDs for one query embedding, leaving out those in exclude.
+
+        With a lexical index and the query text, dense and BM25 rankings are
+        fused with reciprocal-rank fusion; otherwise this is the FAISS search.
+
+        Returns:
+            IDs best first and their scores (cosine similarity for dense-only search,
+            otherwise the fused score)
+        """
+        distances, indices = self._search(query_embedding, top_k, exclude)
+        dense = [(int(doc_id), float(score)) for doc_id, score in zip(indices[0], self._similarities(distances[0]))
+                 if doc_id != -1]
+        if self.lexical is None or query is None:
+            return [doc_id for doc_id, _ in dense], [score for _, score in dense]
+        with timed("lexical"):
+            lexical = [doc_id for doc_id, _ in self.lexical.search(query, top_k, exclude)]
+        fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in dense], lexical])[:top_k]
+        return [doc_id for doc_id, _ in fused], [score for _, score in fused]
+
+    def _debug_results(self, ids: List[int], scores: List[float]) -> None:
+        logger.debug("Search results: ids=%s scores=%s", ids, scores)
+
+    def search_similar_documents(self, query_embedding: np.ndarray, top_k: int = 5,
+                                 query: Optional[str] = None) -> List[str]:
+        """Search for similar documents using the query embedding (and its text, for hybrid search)."""
+        ids, scores = self._ranked_ids(query_embedding, top_k, query)
+        self._debug_results(ids, scores)
+        return self._texts_for(ids)
+
+    def _records_for(self, ids: List[int], scores: List[float]) -> List[Dict]:
+        records = []
+        for doc_id, score in zip(ids, scores):
+            document = self.documents.get(doc_id)
+            if document is not None:
+                records.append({**document, "score": float(score)})
+        return records
+
+    def search_records(self, query_embedding: np.ndarray, top_k: int = 5,
+                       query: Optional[str] = None, exclude: Optional[IdBitset] = None) -> List[Dict]:
+        """
+        Search for similar chunks and return them as ranked records.
+        
+        When the local classifier places the query in a tone or topic
+        partition, chunks labelled with a different tone or topic are left
+        out first, and the rest of the corpus only tops up a short result.
+        
+        Args:
+            query_embedding: Query vector
+            top_k: Number of records to return
+            query: Query text, for hybrid search
+            exclude: Chunk IDs to leave out, e.g. those a learner has already seen
+        
+        Returns:
+            List of dictionaries with id, text, page and score (plus the stored token
+            count, when the store has one), best first
+        """
+        partition = self._partition_exclusion(query_embedding)
+        if partition is None:
+            ids, scores = self._ranked_ids(query_embedding, top_k, query, exclude)
+        else:
+            ids, scores = self._ranked_ids(query_embedding, top_k, query,
+                                           partition if exclude is None else exclude | partition)
+            if len(ids) < top_k:
+                # The partition ran short; top up from the rest of the corpus
+                for doc_id, score in zip(*self._ranked_ids(query_embedding, top_k, query, exclude)):
+                    if len(ids) < top_k and doc_id not in ids:
+                        ids.append(doc_id)
+                        scores.append(score)
+        self._debug_results(ids, scores)
+        return self._records_for(ids, scores)
+
+    def _partition_exclusion(self, query_embedding: np.ndarray) -> Optional[IdBitset]:
+        """Chunks outside the tone/topic partition a query confidently belongs to (None without one)."""
+        if self.classifier is None:
+            return None
+        return self.classifier.partition_exclusion(self.classifier.confident(query_embedding, PARTITION_FACETS))
+
+    def lexical_records(self, query: str, top_k: int = 5, exclude: Optional[IdBitset] = None) -> List[Dict]:
+        """
+        Answer literal lookups ("break the ice") from the lexical index alone.
+        
+        Returns:
+            Records led by the chunks containing the query as a phrase and topped up
+            with BM25 hits (scores are BM25), or an empty list when nothing contains
+            the phrase and the query needs semantic search
+        """
+        if self.lexical is None:
+            return []
+        with timed("lexical"):
+            hits = self.lexical.phrase_search(query, top_k, exclude)
+            if not hits:
+                return []
+            found = {doc_id for doc_id, _ in hits}
+            hits += [hit for hit in self.lexical.search(query, top_k, exclude) if hit[0] not in found]
+            hits = hits[:top_k]
+        return self._records_for([doc_id for doc_id, _ in hits], [score for _, score in hits])
+
+    def retrieve(self, query: str, top_k: int = 5, exclude: Optional[IdBitset] = None) -> List[Dict]:
+        """
+        Retrieval-only lookup: return ranked corpus records without running any
+        chat completion. Phrase hits are served locally with no embedding call.
+        
+        Args:
+            query: Search text
+            top_k: Number of records to return
+            exclude: Chunk IDs to leave out; the next best chunks take their place
+        
+        Returns:
+            List of records (id, text, page, score), best first
+        """
+        return (self.lexical_records(query, top_k, exclude)
+                or self.search_records(self.embed_query(query), top_k, query, exclude))
+
+    async def aretrieve(self, query: str, top_k: int = 5, exclude: Optional[IdBitset] = None) -> List[Dict]:
+        """Async variant of retrieve."""
+        return (self.lexical_records(query, top_k, exclude)
+                or self.search_records(await self.aembed_query(query), top_k, query, exclude))
+
+    def _texts_for(self, ids) -> List[str]:
+        # FAISS returns index IDs, which the document store resolves to chunk text
+        documents = [self.documents.get(i) for i in ids if i != -1]
+        return [doc["text"] for doc in documents if doc is not None]
+
+    def embed_queries(self, queries: List[str], batch_size: int = 1000) -> np.ndarray:
+        """
+        Embed many queries, sending only cache misses to the API in batched calls.
+        
+        Args:
+            queries: Query strings
+            batch_size: Maximum inputs per embeddings request
+        
+        Returns:
+            float32 matrix with one row per query, in input order
+        """
+        vectors: List[Optional[np.ndarray]] = [None] * len(queries)
+        missing: Dict[str, List[int]] = {}
+        for position, query in enumerate(queries):
+            cached = None
+            if self.embedding_cache is not None:
+                cached = self.embedding_cache.get(query, self.embedding_model)
+                CACHE_EVENTS.inc(cache="embedding", result="miss" if cached is None else "hit")
+            if cached is not None:
+                vectors[position] = cached
+            else:
+                missing.setdefault(query, []).append(position)
+        
+        pending = list(missing)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            with self.admission.guard("embeddings"), timed("embed"):
+                response = self.client.embeddings.create(input=batch, model=self.embedding_model)
+            for item in response.data:
+                query = batch[item.index]
+                vector = np.array(item.embedding).astype('float32')
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put(query, self.embedding_model, vector)
+                for position in missing[query]:
+                    vectors[position] = vector
+        
+        return np.vstack(vectors)
+
+    def search_batch_records(self, query_embeddings: np.ndarray, top_k: int = 5,
+                             queries: Optional[List[str]] = None) -> List[List[Dict]]:
+        """
+        Search for many query embeddings with a single FAISS call, fusing lexical
+        hits when queries are given.
+        
+        Returns:
+            One list of ranked records per query, as in search_records
+        """
+        distances, indices = self._search(query_embeddings, top_k)
+        results = []
+        for position, (row, row_distances) in enumerate(zip(indices, distances)):
+            dense = [(int(doc_id), float(score)) for doc_id, score in zip(row, self._similarities(row_distances))
+                     if doc_id != -1]
+            if self.lexical is None or queries is None:
+                ranking = dense
+            else:
+                lexical = [doc_id for doc_id, _ in self.lexical.search(queries[position], top_k)]
+                ranking = reciprocal_rank_fusion([[doc_id for doc_id, _ in dense], lexical])[:top_k]
+            results.append(self._records_for([doc_id for doc_id, _ in ranking], [score for _, score in ranking]))
+        return results
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 5,
+                     queries: Optional[List[str]] = None) -> List[List[str]]:
+        """Search for many query embeddings with a single FAISS call, returning chunk text."""
+        return [[record["text"] for record in records]
+                for records in self.search_batch_records(query_embeddings, top_k, queries)]
+
+    def _build_messages(self, context: List[Union[str, Dict]], query: str, system_prompt: Optional[str] = None,
+                        model: str = "gpt-4o-mini") -> List[dict]:
+        """
+        Build the chat messages for idiom generation.
+        
+        Context is packed whole-record by score into the model's token budget
+        rather than cut at a character count.
+        """
+        with timed("prompt_build"):
+            if context and isinstance(context[0], dict):
+                context = by_score(context)
+            packed, _ = ContextPacker(model).pack([Section("records", context)])
+        context_text = "\n".join(packed["records"])
+        
+        prompt = f"""You are an idioms expert. Based on the query and context, provide exactly 3 idioms.
             If the query mentions a specific tone (like sarcastic, happy, sad), provide idioms that match that tone.
             
             Return your response in this exact JSON format:
@@ -96,74 +455,598 @@ class RAGSystem:
             Query: {query}
             Context: {context_text}
             """
-            
-            # Create chat completion with adjusted max_tokens
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at explaining idioms clearly and concisely."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7,
-                timeout=self.timeout
-            )
-            
-            # Check if the response is valid JSON
-            content = response.choices[0].message.content
-            print(f"Raw GPT Response: {content}")  # Debug print
-            
-            # Ensure we have a valid JSON response
-            try:
-                json_response = json.loads(content)
-                if not json_response.get("idioms"):
-                    raise ValueError("No idioms in response")
-                return content
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"Error parsing response: {str(e)}")
-                # Create a fallback response
-                fallback_response = {
-                    "idioms": [
-                        {
-                            "phrase": "Tongue in cheek",
-                            "meaning": "To speak in an ironic or insincere way",
-                            "example": "His sarcastic remarks were clearly tongue in cheek."
-                        }
-                    ]
-                }
-                return json.dumps(fallback_response)
+        
+        return [
+            {"role": "system", "content": system_prompt or "You are an expert at explaining idioms clearly and concisely."},
+            {"role": "user", "content": prompt}
+        ]
+
+    FALLBACK_RESPONSE = {
+        "idioms": [
+            {
+                "phrase": "Tongue in cheek",
+                "meaning": "To speak in an ironic or insincere way",
+                "example": "His sarcastic remarks were clearly tongue in cheek."
+            }
+        ]
+    }
+
+    def _parse_response(self, content: str) -> str:
+        """Validate the model output, substituting a fallback idiom if it is unusable."""
+        logger.debug("Raw GPT response: %s", content)
+        
+        # Ensure we have a valid JSON response
+        try:
+            json_response = json.loads(content)
+            if not json_response.get("idioms"):
+                raise ValueError("No idioms in response")
+            return content
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.warning("Error parsing response: %s", e)
+            ERRORS.inc(stage="parse")
+            # Create a fallback response
+            return json.dumps(self.FALLBACK_RESPONSE)
+
+    def _completion_result(self, content: str, usage, route: Route) -> Tuple[str, int]:
+        """
+        Validate a completion and report what it cost.
+
+        Returns:
+            Tuple of (response JSON, total tokens); tokens are 0 when the fallback
+            was used so that fallbacks are never cached
+        """
+        route.record_usage(usage)
+        with timed("parse"):
+            response = self._parse_response(content)
+        # _parse_response hands back the model output itself only when it is valid
+        tokens = usage.total_tokens if usage is not None and response is content else 0
+        return response, tokens
+
+    def _search_route(self, model: Optional[str] = None) -> Route:
+        route = self.router.route("search")
+        return route if model is None else replace(route, model=model)
+
+    def _generate(self, context: List[Union[str, Dict]], query: str, model: Optional[str] = None,
+                  system_prompt: Optional[str] = None) -> Tuple[str, int]:
+        """Run the completion, returning the response JSON and its token cost."""
+        route = self._search_route(model)
+        try:
+            messages = self._build_messages(context, query, system_prompt, route.model)
+            with self.admission.guard("chat", route.name), timed("completion"), route.timed():
+                response = self.client.chat.completions.create(
+                    messages=messages,
+                    timeout=self.timeout,
+                    **route.completion_args()
+                )
+            return self._completion_result(response.choices[0].message.content, response.usage, route)
+                
+        except (Overloaded, *UPSTREAM_FAILURES):
+            # Callers answer these from local data (see _degraded_answer) instead of an error
+            raise
+        except Exception as e:
+            logger.error("Error in generate_response: %s", e)
+            ERRORS.inc(stage="completion")
+            return '{"error": "Failed to generate response"}', 0
+
+    async def _agenerate(self, context: List[Union[str, Dict]], query: str, model: Optional[str] = None,
+                         system_prompt: Optional[str] = None) -> Tuple[str, int]:
+        """Async variant of _generate."""
+        route = self._search_route(model)
+        try:
+            messages = self._build_messages(context, query, system_prompt, route.model)
+            async with self.admission.aguard("chat", route.name):
+                with timed("completion"), route.timed():
+                    response = await self.async_client.chat.completions.create(
+                        messages=messages,
+                        timeout=self.timeout,
+                        **route.completion_args()
+                    )
+            return self._completion_result(response.choices[0].message.content, response.usage, route)
                 
+        except (Overloaded, *UPSTREAM_FAILURES):
+            # Callers answer these from local data (see _degraded_answer) instead of an error
+            raise
         except Exception as e:
-            print(f"Error in generate_response: {str(e)}")
-            return '{"error": "Failed to generate response"}'
+            logger.error("Error in agenerate_response: %s", e)
+            ERRORS.inc(stage="completion")
+            return '{"error": "Failed to generate response"}', 0
+
+    def generate_response(self, context: List[Union[str, Dict]], query: str, 
+                         model: Optional[str] = None, max_completion_tokens: int = 2048,
+                         system_prompt: Optional[str] = None) -> str:
+        """Generate a response with the "search" route's model and settings (model overrides the route's)."""
+        return self._generate(context, query, model, system_prompt)[0]
+
+    async def agenerate_response(self, context: List[Union[str, Dict]], query: str,
+                                 model: Optional[str] = None, max_completion_tokens: int = 2048,
+                                 system_prompt: Optional[str] = None) -> str:
+        """Async variant of generate_response that awaits the completion instead of blocking."""
+        return (await self._agenerate(context, query, model, system_prompt))[0]
+
+    def _cached_response(self, query: str, query_embedding: np.ndarray) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        cached = self.response_cache.lookup(query, query_embedding)
+        CACHE_EVENTS.inc(cache="response", result="miss" if cached is None else "hit")
+        return cached
 
-    def query(self, query: str, top_k: int = 5) -> str:
+    def _cache_response(self, query: str, query_embedding: np.ndarray, response: str, tokens: int) -> None:
+        # Only successful, paid-for completions are worth caching
+        if self.response_cache is not None and tokens:
+            self.response_cache.store(query, query_embedding, response, tokens)
+
+    # Served while OpenAI is refusing work: near-enough cached answers and catalog hits beat a 503
+    DEGRADED_CACHE_THRESHOLD = 0.85
+    DEGRADED_MESSAGE = "Our AI teacher is busy right now, so these are the closest matches from the idiom catalog."
+
+    def _degraded_answer(self, query: str) -> Optional[Dict]:
+        """
+        Answer without any upstream call, for when OpenAI is overloaded or failing.
+
+        Tries a looser response-cache match, then the catalog's phrase index,
+        then catalog search by the query's cached embedding or, without one,
+        by keyword.
+
+        Returns:
+            Response dictionary marked "degraded", or None when nothing local matches
+        """
+        query_embedding = None
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get(query, self.embedding_model)
+            query_embedding = cached.reshape(1, -1) if cached is not None else None
+        
+        answer = None
+        if query_embedding is not None and self.response_cache is not None:
+            cached = self.response_cache.lookup(query, query_embedding, threshold=self.DEGRADED_CACHE_THRESHOLD)
+            answer = json.loads(cached) if cached is not None else None
+        if answer is None and self.catalog is not None:
+            with timed("catalog"):
+                records = self.catalog.lookup(query, self.CATALOG_RESULTS)
+                if not records and query_embedding is not None:
+                    records = self.catalog.search(query_embedding, self.CATALOG_RESULTS, query)
+                elif not records:
+                    records = self.catalog.keyword_search(query, self.CATALOG_RESULTS)
+            answer = self._catalog_response(records) if records else None
+        if answer is None:
+            return None
+        
+        ADMISSION_EVENTS.inc(endpoint="query", event="degraded")
+        answer["degraded"] = True
+        answer["message"] = self.DEGRADED_MESSAGE
+        return answer
+
+    def _no_results(self) -> str:
+        return json.dumps({
+            "idioms": [],
+            "message": "No relevant idioms found for your query."
+        }, indent=2)
+
+    # Idioms returned per catalog answer, matching the "exactly 3" of the generation prompt
+    CATALOG_RESULTS = 3
+    # Candidates offered to the LLM when re-ranking for tone
+    RERANK_CANDIDATES = 12
+
+    def _use_catalog(self, mode: str) -> bool:
+        return mode == "catalog" and self.catalog is not None
+
+    def _catalog_candidates(self, query: str, query_embedding: np.ndarray) -> Tuple[List[Dict], Optional[str]]:
+        """Return catalog hits for a query and the tone to re-rank them for, if any."""
+        tone = detect_tone(query) if self.catalog_rerank else "neutral"
+        if tone == "neutral":
+            return self.catalog.search(query_embedding, self.CATALOG_RESULTS, query), None
+        return self.catalog.search(query_embedding, self.RERANK_CANDIDATES, query), tone
+
+    def _rerank_messages(self, query: str, candidates: List[Dict], tone: str) -> List[dict]:
+        """Build a short prompt asking the model to order catalog hits by tone."""
+        listing = "\n".join(f"{i}. {record['phrase']}: {record['meaning']}" for i, record in enumerate(candidates))
+        prompt = f"""Query: {query}
+            Pick the {self.CATALOG_RESULTS} idioms below that best match the {tone} tone the query asks for.
+            Return only JSON in this exact format, best first: {{"order": [0, 1, 2]}}
+            
+            {listing}
+            """
+        return [
+            {"role": "system", "content": "You rank idioms by how well they fit a requested tone."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _apply_rerank(self, candidates: List[Dict], content: str) -> List[Dict]:
+        """Order candidates by the model's ranking, keeping vector order for anything it skipped."""
+        try:
+            order = [int(i) for i in json.loads(content)["order"]]
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            logger.warning("Error parsing rerank response: %s", e)
+            order = []
+        ranked = [candidates[i] for i in dict.fromkeys(order) if 0 <= i < len(candidates)]
+        ranked += [record for record in candidates if record not in ranked]
+        return ranked[:self.CATALOG_RESULTS]
+
+    def _rerank(self, query: str, candidates: List[Dict], tone: str) -> List[Dict]:
+        try:
+            route = self.router.route("rerank")
+            with self.admission.guard("chat", route.name), timed("rerank"), route.timed():
+                response = self.client.chat.completions.create(
+                    messages=self._rerank_messages(query, candidates, tone),
+                    timeout=self.timeout,
+                    **route.completion_args()
+                )
+            route.record_usage(response.usage)
+            return self._apply_rerank(candidates, response.choices[0].message.content)
+        except Exception as e:
+            logger.error("Error in rerank: %s", e)
+            ERRORS.inc(stage="rerank")
+            return candidates[:self.CATALOG_RESULTS]
+
+    async def _arerank(self, query: str, candidates: List[Dict], tone: str) -> List[Dict]:
+        """Async variant of _rerank."""
+        try:
+            route = self.router.route("rerank")
+            async with self.admission.aguard("chat", route.name):
+                with timed("rerank"), route.timed():
+                    response = await self.async_client.chat.completions.create(
+                        messages=self._rerank_messages(query, candidates, tone),
+                        timeout=self.timeout,
+                        **route.completion_args()
+                    )
+            route.record_usage(response.usage)
+            return self._apply_rerank(candidates, response.choices[0].message.content)
+        except Exception as e:
+            logger.error("Error in arerank: %s", e)
+            ERRORS.inc(stage="rerank")
+            return candidates[:self.CATALOG_RESULTS]
+
+    def _catalog_response(self, records: List[Dict]) -> Dict:
+        if not records:
+            return json.loads(self._no_results())
+        return {
+            "idioms": [
+                {
+                    "phrase": record["phrase"],
+                    "meaning": record["meaning"],
+                    "example": record["example"],
+                    "page": record["page"]
+                }
+                for record in records
+            ]
+        }
+
+    def catalog_answer(self, query: str) -> Dict:
+        """
+        Answer straight from the idiom catalog, with no completion call unless
+        the query asks for a tone and re-ranking is enabled. Idioms typed
+        literally are found in the catalog's phrase index without even an
+        embedding call.
+        
+        Returns:
+            Response dictionary in the same {"idioms": [...]} shape as generation
+        """
+        with timed("catalog"):
+            records = self.catalog.lookup(query, self.CATALOG_RESULTS)
+        CACHE_EVENTS.inc(cache="catalog_phrase", result="hit" if records else "miss")
+        if records:
+            return self._catalog_response(records)
+        candidates, tone = self._catalog_candidates(query, self.embed_query(query))
+        if tone is not None and candidates:
+            candidates = self._rerank(query, candidates, tone)
+        return self._catalog_response(candidates)
+
+    async def acatalog_answer(self, query: str) -> Dict:
+        """Async variant of catalog_answer."""
+        with timed("catalog"):
+            records = self.catalog.lookup(query, self.CATALOG_RESULTS)
+        CACHE_EVENTS.inc(cache="catalog_phrase", result="hit" if records else "miss")
+        if records:
+            return self._catalog_response(records)
+        candidates, tone = self._catalog_candidates(query, await self.aembed_query(query))
+        if tone is not None and candidates:
+            candidates = await self._arerank(query, candidates, tone)
+        return self._catalog_response(candidates)
+
+    def query(self, query: str, top_k: int = 5, mode: str = "generate") -> str:
         """
         Process a query and return a response.
         
         Args:
             query: The user's question
             top_k: Number of similar documents to retrieve
+            mode: "generate" to have the model write the answer from retrieved chunks, or
+                "catalog" to answer from the structured idiom catalog (falls back to
+                generation when no catalog is loaded)
         
         Returns:
             str: Generated response as a formatted JSON string
         """
+        # Identical queries already in flight share one embed, search and completion
+        return self.single_flight.do(self._query_key(query, top_k, mode),
+                                     lambda: self._answer(query, top_k, mode), "query", TEXT_CODEC)
+
+    def _query_key(self, query: str, top_k: int, mode: str) -> str:
+        mode = "catalog" if self._use_catalog(mode) else "generate"
+        return f"query:{mode}:{top_k}:{query.strip()}"
+
+    def _answer(self, query: str, top_k: int, mode: str) -> str:
+        try:
+            return self._answer_upstream(query, top_k, mode)
+        except (Overloaded, *UPSTREAM_FAILURES):
+            answer = self._degraded_answer(query)
+            if answer is None:
+                raise
+            return json.dumps(answer, indent=2)
+
+    def _answer_upstream(self, query: str, top_k: int, mode: str) -> str:
+        if self._use_catalog(mode):
+            return json.dumps(self.catalog_answer(query), indent=2)
+        
         # Create query embedding
         query_embedding = self.embed_query(query)
         
+        # Near-duplicates of earlier queries reuse the stored answer
+        cached = self._cached_response(query, query_embedding)
+        if cached is not None:
+            return json.dumps(json.loads(cached), indent=2)
+        
         # Retrieve similar documents
-        relevant_docs = self.search_similar_documents(query_embedding, top_k)
+        relevant_docs = self.search_records(query_embedding, top_k, query)
         
         if not relevant_docs:
-            return json.dumps({
-                "idioms": [],
-                "message": "No relevant idioms found for your query."
-            }, indent=2)
+            return self._no_results()
         
         # Generate response and parse it as JSON
-        response = self.generate_response(relevant_docs, query)
+        response, tokens = self._generate(relevant_docs, query)
+        self._cache_response(query, query_embedding, response, tokens)
         return json.dumps(json.loads(response), indent=2)
 
+    def query_batch(self, queries: List[str], top_k: int = 5, max_concurrency: int = 8,
+                    system_prompt: Optional[str] = None) -> List[Dict]:
+        """
+        Process many queries with one embeddings call, one FAISS search and
+        bounded-concurrency completions.
+        
+        Args:
+            queries: The user questions
+            top_k: Number of similar documents to retrieve per query
+            max_concurrency: Maximum chat completions in flight
+            system_prompt: Optional system prompt for every completion
+        
+        Returns:
+            One dictionary per query, in input order, with "status" set to
+            "success" (and "response") or "error" (and "error")
+        """
+        if not queries:
+            return []
+        try:
+            query_embeddings = self.embed_queries(queries)
+        except Exception as e:
+            logger.error("Error embedding batch: %s", e)
+            ERRORS.inc(stage="embed")
+            return [{"query": query, "status": "error", "error": "Failed to embed query"} for query in queries]
+        
+        results: List[Optional[Dict]] = [None] * len(queries)
+        pending = []
+        for position, query in enumerate(queries):
+            cached = self._cached_response(query, query_embeddings[position])
+            if cached is not None:
+                results[position] = {"query": query, "status": "success", "response": json.loads(cached)}
+            else:
+                pending.append(position)
+        
+        contexts = self.search_batch_records(query_embeddings[pending], top_k, [queries[p] for p in pending]) if pending else []
+        
+        def generate(position: int, context: List[Dict]) -> Dict:
+            query = queries[position]
+            if not context:
+                return {"query": query, "status": "success", "response": json.loads(self._no_results())}
+            try:
+                response, tokens = self._generate(context, query, system_prompt=system_prompt)
+            except (Overloaded, *UPSTREAM_FAILURES):
+                degraded = self._degraded_answer(query)
+                if degraded is None:
+                    return {"query": query, "status": "error", "error": "Service busy, please retry later"}
+                return {"query": query, "status": "success", "response": degraded}
+            parsed = json.loads(response)
+            if "error" in parsed:
+                return {"query": query, "status": "error", "error": parsed["error"]}
+            self._cache_response(query, query_embeddings[position], response, tokens)
+            return {"query": query, "status": "success", "response": parsed}
+        
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for position, result in zip(pending, executor.map(generate, pending, contexts)):
+                results[position] = result
+        return results
+
+    async def aquery(self, query: str, top_k: int = 5, mode: str = "generate") -> str:
+        """Async variant of query; upstream calls are awaited so the event loop keeps serving."""
+        return await self.single_flight.ado(self._query_key(query, top_k, mode),
+                                            lambda: self._aanswer(query, top_k, mode), "query", TEXT_CODEC)
+
+    async def _aanswer(self, query: str, top_k: int, mode: str) -> str:
+        try:
+            return await self._aanswer_upstream(query, top_k, mode)
+        except (Overloaded, *UPSTREAM_FAILURES):
+            answer = await asyncio.to_thread(self._degraded_answer, query)
+            if answer is None:
+                raise
+            return json.dumps(answer, indent=2)
+
+    async def _aanswer_upstream(self, query: str, top_k: int, mode: str) -> str:
+        if self._use_catalog(mode):
+            return json.dumps(await self.acatalog_answer(query), indent=2)
+        
+        query_embedding = await self.aembed_query(query)
+        
+        cached = self._cached_response(query, query_embedding)
+        if cached is not None:
+            return json.dumps(json.loads(cached), indent=2)
+        
+        relevant_docs = self.search_records(query_embedding, top_k, query)
+        
+        if not relevant_docs:
+            return self._no_results()
+        
+        response, tokens = await self._agenerate(relevant_docs, query)
+        self._cache_response(query, query_embedding, response, tokens)
+        return json.dumps(json.loads(response), indent=2)
+
+    def stream_query(self, query: str, top_k: int = 5, mode: str = "generate") -> Iterator[Tuple[str, Dict]]:
+        """
+        Process a query, yielding each idiom as soon as the model has finished writing it.
+        
+        Args:
+            query: The user's question
+            top_k: Number of similar documents to retrieve
+            mode: "generate" or "catalog", as in query
+        
+        Yields:
+            (event, data) pairs: "idiom" for every completed idiom, then "done" with
+            the validated full response (fallback applied), or "error"
+        """
+        streamed = False
+        try:
+            if self._use_catalog(mode):
+                answer = self.catalog_answer(query)
+                for idiom in answer["idioms"]:
+                    yield "idiom", idiom
+                yield "done", answer
+                return
+            
+            query_embedding = self.embed_query(query)
+            
+            cached = self._cached_response(query, query_embedding)
+            if cached is not None:
+                cached = json.loads(cached)
+                for idiom in cached["idioms"]:
+                    yield "idiom", idiom
+                yield "done", cached
+                return
+            
+            relevant_docs = self.search_records(query_embedding, top_k, query)
+            
+            if not relevant_docs:
+                yield "done", json.loads(self._no_results())
+                return
+            
+            route = self._search_route()
+            messages = self._build_messages(relevant_docs, query, model=route.model)
+            with self.admission.guard("chat", f"{route.name}:stream") as admitted:
+                start = time.perf_counter()
+                stream = self.client.chat.completions.create(
+                    messages=messages,
+                    timeout=self.timeout,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **route.completion_args()
+                )
+                parser = IncrementalJSONParser()
+                usage = None
+                first_token = True
+                for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token:
+                            STAGE_SECONDS.observe(time.perf_counter() - start, stage="first_token")
+                            admitted.release()
+                            first_token = False
+                        for _, idiom in parser.feed(chunk.choices[0].delta.content):
+                            streamed = True
+                            yield "idiom", idiom
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="completion")
+                route.observe(time.perf_counter() - start)
+            
+            response, tokens = self._completion_result(parser.buffer, usage, route)
+            self._cache_response(query, query_embedding, response, tokens)
+            yield "done", json.loads(response)
+            
+        except (Overloaded, *UPSTREAM_FAILURES) as e:
+            # Idioms already streamed cannot be taken back, so only an unstarted stream degrades
+            answer = None if streamed else self._degraded_answer(query)
+            if answer is None:
+                yield "error", {"error": "Service busy, please retry later", "retry_after": getattr(e, "retry_after", 1)}
+                return
+            for idiom in answer["idioms"]:
+                yield "idiom", idiom
+            yield "done", answer
+            
+        except Exception as e:
+            logger.error("Error in stream_query: %s", e)
+            ERRORS.inc(stage="completion")
+            yield "error", {"error": "Failed to generate response"}
+
+    async def astream_query(self, query: str, top_k: int = 5,
+                            mode: str = "generate") -> AsyncIterator[Tuple[str, Dict]]:
+        """Async variant of stream_query."""
+        streamed = False
+        try:
+            if self._use_catalog(mode):
+                answer = await self.acatalog_answer(query)
+                for idiom in answer["idioms"]:
+                    yield "idiom", idiom
+                yield "done", answer
+                return
+            
+            query_embedding = await self.aembed_query(query)
+            
+            cached = self._cached_response(query, query_embedding)
+            if cached is not None:
+                cached = json.loads(cached)
+                for idiom in cached["idioms"]:
+                    yield "idiom", idiom
+                yield "done", cached
+                return
+            
+            relevant_docs = self.search_records(query_embedding, top_k, query)
+            
+            if not relevant_docs:
+                yield "done", json.loads(self._no_results())
+                return
+            
+            route = self._search_route()
+            messages = self._build_messages(relevant_docs, query, model=route.model)
+            async with self.admission.aguard("chat", f"{route.name}:stream") as admitted:
+                start = time.perf_counter()
+                stream = await self.async_client.chat.completions.create(
+                    messages=messages,
+                    timeout=self.timeout,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **route.completion_args()
+                )
+                parser = IncrementalJSONParser()
+                usage = None
+                first_token = True
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token:
+                            STAGE_SECONDS.observe(time.perf_counter() - start, stage="first_token")
+                            admitted.release()
+                            first_token = False
+                        for _, idiom in parser.feed(chunk.choices[0].delta.content):
+                            streamed = True
+                            yield "idiom", idiom
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="completion")
+                route.observe(time.perf_counter() - start)
+            
+            response, tokens = self._completion_result(parser.buffer, usage, route)
+            self._cache_response(query, query_embedding, response, tokens)
+            yield "done", json.loads(response)
+            
+        except (Overloaded, *UPSTREAM_FAILURES) as e:
+            # Idioms already streamed cannot be taken back, so only an unstarted stream degrades
+            answer = None if streamed else await asyncio.to_thread(self._degraded_answer, query)
+            if answer is None:
+                yield "error", {"error": "Service busy, please retry later", "retry_after": getattr(e, "retry_after", 1)}
+                return
+            for idiom in answer["idioms"]:
+                yield "idiom", idiom
+            yield "done", answer
+            
+        except Exception as e:
+            logger.error("Error in astream_query: %s", e)
+            ERRORS.inc(stage="completion")
+            yield "error", {"error": "Failed to generate response"}
+
 def save_response_to_json(response_data: str, filename: str = "idioms_response.json") -> None:
     """Save the response to a JSON file."""
     with open(filename, 'w', encoding='utf-8') as f:
@@ -175,7 +1058,7 @@ def main():
         # Initialize the RAG system
         rag = RAGSystem(
             faiss_index_path="faiss_index.idx",
-            vectors_path="vectors.pkl"
+            docstore_path="docstore"
         )
         
         # Example query
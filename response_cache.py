@@ -0,0 +1,129 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Keywords that put a query in a tone bucket; queries in different buckets never share answers
+TONE_KEYWORDS = {
+    "sarcastic": ("sarcastic", "sarcasm", "ironic", "irony", "mocking"),
+    "happy": ("happy", "happiness", "joy", "joyful", "cheerful", "glad"),
+    "sad": ("sad", "sadness", "unhappy", "depressed", "grief", "sorrow"),
+    "angry": ("angry", "anger", "mad", "furious", "annoyed"),
+    "funny": ("funny", "humor", "humour", "humorous", "hilarious"),
+    "formal": ("formal", "professional", "polite"),
+    "romantic": ("romantic", "love", "romance")
+}
+
+
+def detect_tone(query: str) -> str:
+    """Return the tone bucket a query asks for, or "neutral"."""
+    words = set(re.findall(r"[a-z]+", query.lower()))
+    for tone, keywords in TONE_KEYWORDS.items():
+        if words.intersection(keywords):
+            return tone
+    return "neutral"
+
+
+class SemanticResponseCache:
+    def __init__(self, threshold: float = 0.95, max_entries: int = 5000, ttl: Optional[float] = 24 * 3600):
+        """
+        Cache of generated idiom responses keyed on the query embedding.
+
+        Past query vectors are kept in a small inner-product FAISS index per
+        tone, so a paraphrase of an earlier query ("sad idioms", "idioms for
+        sadness") reuses its stored JSON instead of paying for a completion.
+
+        Args:
+            threshold: Minimum cosine similarity for a near-duplicate hit
+            max_entries: Maximum cached responses before evicting the least recently used
+            ttl: Seconds after which a cached response expires (None disables expiry)
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._indexes: Dict[str, faiss.IndexIDMap2] = {}
+        # entry id -> (tone, response, tokens, created_at), in LRU order
+        self._entries: "OrderedDict[int, Tuple[str, str, int, float]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, entry_id: int) -> None:
+        tone = self._entries.pop(entry_id)[0]
+        self._indexes[tone].remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def lookup(self, query: str, embedding: np.ndarray, threshold: Optional[float] = None) -> Optional[str]:
+        """
+        Return the cached response for a near-duplicate query, or None.
+
+        Args:
+            query: Raw query text, used to pick the tone bucket
+            embedding: Query embedding from RAGSystem.embed_query
+            threshold: Similarity required for a hit (defaults to the cache's threshold)
+        """
+        threshold = self.threshold if threshold is None else threshold
+        tone = detect_tone(query)
+        with self._lock:
+            index = self._indexes.get(tone)
+            if index is not None and index.ntotal:
+                scores, ids = index.search(self._normalize(embedding), 1)
+                entry_id = int(ids[0][0])
+                if entry_id != -1 and scores[0][0] >= threshold:
+                    _, response, tokens, created_at = self._entries[entry_id]
+                    if self.ttl is None or time.time() - created_at <= self.ttl:
+                        self._entries.move_to_end(entry_id)
+                        self.hits += 1
+                        self.saved_tokens += tokens
+                        return response
+                    self._remove(entry_id)
+            self.misses += 1
+            return None
+
+    def store(self, query: str, embedding: np.ndarray, response: str, tokens: int = 0) -> None:
+        """
+        Cache a generated response.
+
+        Args:
+            query: Raw query text
+            embedding: Query embedding
+            response: Validated JSON response
+            tokens: Tokens the completion cost, credited to saved_tokens on every hit
+        """
+        tone = detect_tone(query)
+        vector = self._normalize(embedding)
+        with self._lock:
+            index = self._indexes.get(tone)
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+                self._indexes[tone] = index
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (tone, response, tokens, time.time())
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> Dict:
+        """Return hit rate and token savings for this process."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "size": len(self._entries)
+        }
@@ -0,0 +1,100 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+from agent_orchestrator import AgentOrchestrator
+from embedding_cache import EmbeddingCache
+from greeting_pool import GreetingPool
+from model_routing import ModelRouter
+from openai_client import OpenAIClientFactory
+from rag_system import RAGSystem
+from response_cache import SemanticResponseCache
+from session_store import create_session_store
+from single_flight import SQLiteFlightStore, SingleFlight
+from teacher_agent import TeacherAgent
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Services:
+    """The loaded index, stores and agents behind both servers."""
+    rag: RAGSystem
+    orchestrator: AgentOrchestrator
+    teacher: TeacherAgent
+    loaded_at: float
+    load_seconds: float
+
+    def readiness(self) -> Dict:
+        """Summary reported by /readyz."""
+        rag = self.rag
+        return {
+            "status": "ready",
+            "pid": os.getpid(),
+            "index_kind": rag.index_meta["spec"]["kind"],
+            "index_size": int(rag.faiss_index.ntotal),
+            "documents": len(rag.documents),
+            "lexical_documents": len(rag.lexical) if rag.lexical is not None else None,
+            "catalog_idioms": len(rag.catalog) if rag.catalog is not None else None,
+            "loaded_at": self.loaded_at,
+            "load_seconds": round(self.load_seconds, 3),
+            "upstream": rag.admission.stats()
+        }
+
+
+def load_services() -> Services:
+    """
+    Build every component from environment configuration.
+
+    Nothing here calls OpenAI or opens upstream connections, so it is safe
+    to run once in a gunicorn master before workers fork (preload_app); the
+    memory-mapped index and stores are then shared between workers.
+    """
+    start = time.perf_counter()
+    # One pooled OpenAI client per worker, shared by every component
+    clients = OpenAIClientFactory.from_env()
+    # Set SINGLE_FLIGHT_PATH to also coalesce identical calls across workers
+    flight_path = os.environ.get("SINGLE_FLIGHT_PATH")
+    single_flight = SingleFlight(
+        store=SQLiteFlightStore(flight_path) if flight_path else None,
+        timeout=float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "30"))
+    )
+    # One routing table (model, output budget, templates per call type) for every component
+    router = ModelRouter.from_env()
+    rag = RAGSystem(
+        faiss_index_path=os.environ.get("FAISS_INDEX_PATH", "faiss_index.idx"),
+        docstore_path=os.environ.get("DOCSTORE_PATH", "docstore"),
+        embedding_cache=EmbeddingCache(
+            os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.db"),
+            max_disk_entries=int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+        ),
+        response_cache=SemanticResponseCache(
+            threshold=float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.95"))
+        ),
+        nprobe=int(os.environ["FAISS_NPROBE"]) if os.environ.get("FAISS_NPROBE") else None,
+        ef_search=int(os.environ["FAISS_EF_SEARCH"]) if os.environ.get("FAISS_EF_SEARCH") else None,
+        catalog_path=os.environ.get("CATALOG_PATH", "catalog"),
+        lexical_path=os.environ.get("LEXICAL_INDEX_PATH", "lexical"),
+        clients=clients,
+        single_flight=single_flight,
+        router=router,
+        classifier_threshold=float(os.environ.get("CLASSIFIER_CONFIDENCE", "0.8")),
+        classifier_min_similarity=(float(os.environ["CLASSIFIER_MIN_SIMILARITY"])
+                                   if os.environ.get("CLASSIFIER_MIN_SIMILARITY") else None)
+    )
+    orchestrator = AgentOrchestrator(rag, clients=clients)
+    teacher = TeacherAgent(
+        orchestrator,
+        session_store=create_session_store(os.environ.get("SESSION_STORE_URL", "sqlite:///sessions.db")),
+        greeting_pool=GreetingPool(
+            os.environ.get("GREETING_POOL_PATH", "greetings.db"),
+            size=int(os.environ.get("GREETING_POOL_SIZE", "20"))
+        ),
+        clients=clients,
+        router=router
+    )
+    load_seconds = time.perf_counter() - start
+    logger.info("Services loaded in %.2fs (pid %d)", load_seconds, os.getpid())
+    return Services(rag, orchestrator, teacher, time.time(), load_seconds)
@@ -0,0 +1,175 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from id_bitset import IdBitset
+
+
+def serialize_session(session: Dict) -> str:
+    """Serialize a teacher session to compact JSON (sets become sorted lists, bitsets base64)."""
+    profile = dict(session["student_profile"])
+    profile["learned_idioms"] = sorted(profile.get("learned_idioms", ()))
+    profile["seen_chunks"] = profile.get("seen_chunks", IdBitset()).to_text()
+    return json.dumps({**session, "student_profile": profile}, separators=(",", ":"))
+
+
+def deserialize_session(data: str) -> Dict:
+    """Inverse of serialize_session."""
+    session = json.loads(data)
+    profile = session["student_profile"]
+    profile["learned_idioms"] = set(profile.get("learned_idioms", ()))
+    profile["seen_chunks"] = IdBitset.from_text(profile.get("seen_chunks"))
+    return session
+
+
+class SessionStore(ABC):
+    """Interface for TeacherAgent session storage."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Return the stored session, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, session_id: str, session: Dict) -> None:
+        """Store a session, replacing any previous version."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """Remove a session; deleting a missing one is not an error."""
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_sessions: int = 10000, ttl: Optional[float] = 24 * 3600):
+        """
+        Per-process session store with LRU and TTL bounds.
+
+        Args:
+            max_sessions: Maximum number of sessions kept before evicting the least recently used
+            ttl: Seconds of inactivity after which a session expires (None disables expiry)
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            data, updated_at = entry
+            if self.ttl is not None and time.time() - updated_at > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return deserialize_session(data)
+
+    def set(self, session_id: str, session: Dict) -> None:
+        with self._lock:
+            self._sessions[session_id] = (serialize_session(session), time.time())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, db_path: str = "sessions.db", ttl: Optional[float] = 24 * 3600,
+                 purge_interval: float = 300):
+        """
+        Session store in a SQLite file shared by all workers on the host.
+
+        Any worker can serve any learner, and expired sessions are purged
+        periodically so the file stays bounded.
+
+        Args:
+            db_path: Path to the SQLite file
+            ttl: Seconds of inactivity after which a session expires (None disables expiry)
+            purge_interval: Minimum seconds between purges of expired sessions
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._last_purge = 0.0
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return a SQLite connection owned by the current process."""
+        # Connections must not be shared across a fork, so reopen per pid
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _purge_expired(self, conn: sqlite3.Connection) -> None:
+        now = time.time()
+        if self.ttl is None or now - self._last_purge < self.purge_interval:
+            return
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+        self._last_purge = now
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            return None
+        return deserialize_session(row[0])
+
+    def set(self, session_id: str, session: Dict) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, serialize_session(session), time.time())
+            )
+            self._purge_expired(conn)
+            conn.commit()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.commit()
+
+
+def create_session_store(url: str = "memory://") -> SessionStore:
+    """
+    Create a session store from a URL.
+
+    Args:
+        url: "memory://" for the per-process store or "sqlite:///path/to/file.db"
+
+    Returns:
+        The configured SessionStore
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url.startswith("memory://"):
+        return MemorySessionStore()
+    raise ValueError(f"Unsupported session store URL: {url}")
@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from admission import UPSTREAM_FAILURES, CircuitOpen, Overloaded
+from metrics import COALESCED
+
+T = TypeVar("T")
+
+# (encode, decode) between a result and the text kept in the shared store
+Codec = Tuple[Callable[[T], str], Callable[[str], T]]
+TEXT_CODEC: Codec = (str, str)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SQLiteFlightStore:
+    def __init__(self, db_path: str = "single_flight.db", result_ttl: float = 10.0):
+        """
+        Shared record of in-flight upstream calls, so workers coalesce with each other.
+
+        The first worker to claim a key runs the call; other workers note
+        which flight they found and poll for that flight's outcome instead
+        of calling upstream. Finishing a flight releases its key at once, so
+        later callers run a call of their own; the outcome is kept for
+        result_ttl seconds only for followers of that flight that poll late.
+
+        Args:
+            db_path: Path to the SQLite file shared by all workers
+            result_ttl: Seconds a finished flight's outcome stays readable by its followers
+        """
+        self.db_path = db_path
+        self.result_ttl = result_ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS claims (
+                    key TEXT PRIMARY KEY,
+                    flight TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS outcomes (
+                    flight TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    payload TEXT,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return a SQLite connection owned by the current process."""
+        # Connections must not be shared across a fork, so reopen per pid
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _key(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def claim(self, key: str, ttl: float) -> Tuple[bool, Optional[str]]:
+        """
+        Take the key if nobody is running it (or the running claim expired).
+
+        Returns:
+            (True, the new flight's ID) when claimed, otherwise (False, the running
+            flight's ID, or None if it finished in the meantime)
+        """
+        now = time.time()
+        flight = uuid.uuid4().hex
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                """INSERT INTO claims (key, flight, expires_at) VALUES (?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET flight = excluded.flight, expires_at = excluded.expires_at
+                   WHERE claims.expires_at <= ?""",
+                (self._key(key), flight, now + ttl, now)
+            )
+            conn.commit()
+            if cursor.rowcount == 1:
+                return True, flight
+            row = conn.execute("SELECT flight FROM claims WHERE key = ?", (self._key(key),)).fetchone()
+        return False, row[0] if row is not None else None
+
+    def finish(self, key: str, flight: str, status: str, payload: str) -> None:
+        """Publish a flight's result ("done") or encoded error ("error") and release its key."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO outcomes (flight, status, payload, expires_at) VALUES (?, ?, ?, ?)",
+                (flight, status, payload, now + self.result_ttl)
+            )
+            conn.execute("DELETE FROM claims WHERE key = ? AND flight = ?", (self._key(key), flight))
+            # Drop stale rows while we are here
+            conn.execute("DELETE FROM outcomes WHERE expires_at < ?", (now,))
+            conn.commit()
+
+    def poll(self, flight: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Return (status, payload) for a finished flight, or None while it runs (or once it expired)."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT status, payload, expires_at FROM outcomes WHERE flight = ?", (flight,)
+            ).fetchone()
+        if row is None or row[2] <= time.time():
+            return None
+        return row[0], row[1]
+
+
+def encode_error(error: BaseException) -> str:
+    """Describe a failed call for the followers in other workers."""
+    if isinstance(error, CircuitOpen):
+        kind = "circuit_open"
+    elif isinstance(error, Overloaded):
+        kind = "overloaded"
+    elif isinstance(error, UPSTREAM_FAILURES):
+        kind = "upstream"
+    elif isinstance(error, (TimeoutError, asyncio.TimeoutError, asyncio.CancelledError)):
+        kind = "timeout"
+    else:
+        kind = "error"
+    return json.dumps({"kind": kind, "message": str(error) or type(error).__name__,
+                       "retry_after": getattr(error, "retry_after", None)})
+
+
+def decode_error(payload: str, stage: str) -> Exception:
+    """
+    Rebuild a failure from another worker as the type callers handle.
+
+    Overloaded and CircuitOpen keep their type and Retry-After, so they
+    still become 503s and degraded answers. Upstream connection, rate-limit
+    and server errors come back as Overloaded, as the SDK's exceptions
+    cannot be rebuilt without their HTTP request and response. Timeouts
+    and cancelled calls come back as TimeoutError.
+    """
+    error = json.loads(payload)
+    message = f"In-flight {stage} call failed in another worker: {error['message']}"
+    if error["kind"] == "circuit_open":
+        return CircuitOpen(message, error["retry_after"] or 1.0)
+    if error["kind"] in ("overloaded", "upstream"):
+        return Overloaded(message, error["retry_after"] or 1.0)
+    if error["kind"] == "timeout":
+        return TimeoutError(message)
+    return Exception(message)
+
+
+class SingleFlight:
+    def __init__(self, store: Optional[SQLiteFlightStore] = None, timeout: float = 30.0,
+                 poll_interval: float = 0.05):
+        """
+        Coalesce concurrent identical calls into one.
+
+        While a call for a key is running, later callers with the same key
+        wait for it and receive its result, or its exception. With a shared
+        store, callers in other worker processes wait on it as well.
+
+        Args:
+            store: Shared store for coalescing across workers (optional)
+            timeout: Seconds a caller waits on someone else's call before giving up
+            poll_interval: Seconds between shared-store polls
+        """
+        self.store = store
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T], stage: str = "call", codec: Optional[Codec] = None) -> T:
+        """
+        Run fn once for all concurrent callers with the same key.
+
+        Args:
+            key: Identity of the call (callers with equal keys share one call)
+            fn: The upstream call
+            stage: Label for the coalescing metrics
+            codec: (encode, decode) for sharing the result through the store; without
+                one the call is coalesced within this process only
+
+        Returns:
+            fn's result, whether this caller ran it or waited for it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            COALESCED.inc(stage=stage, scope="process")
+            if not call.done.wait(self.timeout):
+                raise TimeoutError(f"Timed out after {self.timeout}s waiting for the in-flight '{stage}' call")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn, stage, codec)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_shared(self, key: str, fn: Callable[[], T], stage: str, codec: Optional[Codec]) -> T:
+        if self.store is None or codec is None:
+            return fn()
+        encode, decode = codec
+        deadline = time.monotonic() + self.timeout
+        flight = None
+        while True:
+            if flight is None:
+                claimed, flight = self.store.claim(key, self.timeout)
+                if claimed:
+                    return self._lead_shared(key, flight, fn, encode)
+            if flight is not None:
+                # Follow the flight found running, even once its key is released
+                outcome = self.store.poll(flight)
+                if outcome is not None:
+                    return self._shared_outcome(outcome, stage, decode)
+            if time.monotonic() >= deadline:
+                # The other worker is stuck or gone; fall back to our own call
+                return fn()
+            time.sleep(self.poll_interval)
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]], stage: str = "call",
+                  codec: Optional[Codec] = None) -> T:
+        """
+        Async variant of do; fn returns the awaitable to run once per key and event loop.
+
+        The call runs in a task of its own, so cancelling the request that
+        started it (a client disconnecting) does not cancel the callers
+        waiting on it.
+        """
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        task = self._async_calls.get(loop_key)
+        if task is None:
+            task = self._async_calls[loop_key] = asyncio.ensure_future(self._arun_shared(key, fn, stage, codec))
+            task.add_done_callback(lambda done: self._async_done(loop_key, done))
+            return await asyncio.shield(task)
+
+        COALESCED.inc(stage=stage, scope="process")
+        # wait() leaves the task running when this caller times out or is cancelled
+        done, _ = await asyncio.wait({task}, timeout=self.timeout)
+        if not done:
+            raise TimeoutError(f"Timed out after {self.timeout}s waiting for the in-flight '{stage}' call")
+        return task.result()
+
+    def _async_done(self, loop_key: Tuple[int, str], task: asyncio.Future) -> None:
+        if self._async_calls.get(loop_key) is task:
+            del self._async_calls[loop_key]
+        if not task.cancelled():
+            # Mark the exception retrieved when nobody else was waiting for it
+            task.exception()
+
+    async def _arun_shared(self, key: str, fn: Callable[[], Awaitable[T]], stage: str,
+                           codec: Optional[Codec]) -> T:
+        if self.store is None or codec is None:
+            return await fn()
+        encode, decode = codec
+        deadline = time.monotonic() + self.timeout
+        flight = None
+        while True:
+            # Store calls may wait on SQLite's write lock, so they run off the event loop
+            if flight is None:
+                claimed, flight = await asyncio.to_thread(self.store.claim, key, self.timeout)
+                if claimed:
+                    return await self._alead_shared(key, flight, fn, encode)
+            if flight is not None:
+                outcome = await asyncio.to_thread(self.store.poll, flight)
+                if outcome is not None:
+                    return self._shared_outcome(outcome, stage, decode)
+            if time.monotonic() >= deadline:
+                return await fn()
+            await asyncio.sleep(self.poll_interval)
+
+    def _lead_shared(self, key: str, flight: str, fn: Callable[[], T], encode: Callable[[T], str]) -> T:
+        try:
+            result = fn()
+        except BaseException as e:
+            self.store.finish(key, flight, "error", encode_error(e))
+            raise
+        self.store.finish(key, flight, "done", encode(result))
+        return result
+
+    async def _alead_shared(self, key: str, flight: str, fn: Callable[[], Awaitable[T]],
+                            encode: Callable[[T], str]) -> T:
+        try:
+            result = await fn()
+        except BaseException as e:
+            # Shielded so a second cancellation cannot leave followers waiting on an unfinished flight
+            await asyncio.shield(asyncio.to_thread(self.store.finish, key, flight, "error", encode_error(e)))
+            raise
+        await asyncio.shield(asyncio.to_thread(self.store.finish, key, flight, "done", encode(result)))
+        return result
+
+    @staticmethod
+    def _shared_outcome(outcome: Tuple[str, Optional[str]], stage: str, decode: Callable[[str], T]) -> T:
+        COALESCED.inc(stage=stage, scope="shared")
+        status, payload = outcome
+        if status == "error":
+            raise decode_error(payload, stage)
+        return decode(payload)
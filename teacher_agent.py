@@ -1,45 +1,141 @@
-from typing import Dict, List, Optional
-from openai import OpenAI
+import asyncio
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 import json
 import logging
+import re
+import time
+from admission import Overloaded
+from context_packer import ContextPacker, Section, by_score
+from greeting_pool import GreetingPool
+from id_bitset import IdBitset
+from json_stream import IncrementalJSONParser
+from metrics import ERRORS, STAGE_SECONDS, timed
+from model_routing import ModelRouter, Route
+from openai_client import OpenAIClientFactory, default_client_factory
+from session_store import MemorySessionStore, SessionStore
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class TeacherAgent:
-    def __init__(self, orchestrator):
-        """Initialize the teacher agent with the orchestrator."""
+    # Only the last few turns are used for prompts, so older history is dropped
+    MAX_HISTORY = 20
+    # Most recent turns offered to the context packer each turn
+    CONTEXT_TURNS = 6
+
+    def __init__(self, orchestrator, session_store: Optional[SessionStore] = None,
+                 greeting_pool: Optional[GreetingPool] = None,
+                 clients: Optional[OpenAIClientFactory] = None, router: Optional[ModelRouter] = None):
+        """
+        Initialize the teacher agent with the orchestrator.
+
+        Args:
+            orchestrator: AgentOrchestrator used for idiom retrieval
+            session_store: Where learner sessions live (defaults to a per-process LRU store);
+                use a shared store so any worker can serve any learner
+            greeting_pool: Pre-generated greetings served to new sessions (optional); greetings
+                are only generated live while the pool is empty
+            clients: Shared OpenAI client factory (defaults to the process-wide one)
+            router: Model, output budget and format per call type (defaults to DEFAULT_ROUTES)
+        """
+        clients = clients or default_client_factory()
         self.orchestrator = orchestrator
-        self.client = OpenAI()
-        # Store user sessions in a dictionary
-        self.user_sessions = {}
+        self.client = clients.client()
+        self.async_client = clients.async_client()
+        self.admission = clients.admission
+        self.router = router or ModelRouter()
+        # Tone/topic/level centroids stored with the index, when it has them
+        self.classifier = orchestrator.rag.classifier
+        self.sessions = session_store or MemorySessionStore()
+        self.greeting_pool = greeting_pool
+        self.packer = ContextPacker("gpt-4o-mini")
+        if self.greeting_pool is not None:
+            self.greeting_pool.start(self.generate_greetings)
         
+    GREETING_MESSAGES = [
+        {"role": "system", "content": "You are Adam, a friendly AI English idioms teacher. Keep your response warm but professional."},
+        {"role": "user", "content": """Generate a brief, welcoming introduction that:
+                        1. Introduces you as Adam
+                        2. Explains you're an AI idioms teacher
+                        3. Mentions the interactive learning approach
+                        Keep it under 3 sentences."""}
+    ]
+    FALLBACK_GREETING = "Hello! I'm Adam, your AI English idioms teacher. I'm here to help you learn and practice idioms in a fun, interactive way!"
+
+    def generate_greetings(self, count: int) -> List[str]:
+        """Generate several distinct greetings in one completion call."""
+        route = self.router.route("intro")
+        with self.admission.guard("chat", route.name), route.timed():
+            response = self.client.chat.completions.create(
+                messages=self.GREETING_MESSAGES,
+                n=count,
+                # Sampled hotter than live greetings so the pool varies
+                **{**route.completion_args(), "temperature": 1.0}
+            )
+        route.record_usage(response.usage)
+        return [choice.message.content.strip() for choice in response.choices if choice.message.content]
+
+    def _pooled_greeting(self) -> Optional[str]:
+        if self.greeting_pool is None:
+            return None
+        try:
+            return self.greeting_pool.get()
+        except Exception as e:
+            logger.error("Error reading greeting pool: %s", e)
+            return None
+
     def get_initial_greeting(self, session_id: str) -> Dict:
         """Get the initial greeting for a new session."""
         session = self._get_or_create_session(session_id)
         
+        # A pooled greeting needs no completion, so the landing page renders immediately
+        greeting_message = self._pooled_greeting()
+        if greeting_message is not None:
+            return self._record_greeting(session_id, session, greeting_message)
+        
         try:
             # Get personalized greeting from LLM
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are Adam, a friendly AI English idioms teacher. Keep your response warm but professional."},
-                    {"role": "user", "content": """Generate a brief, welcoming introduction that:
-                        1. Introduces you as Adam
-                        2. Explains you're an AI idioms teacher
-                        3. Mentions the interactive learning approach
-                        Keep it under 3 sentences."""}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
+            route = self.router.route("intro")
+            with self.admission.guard("chat", route.name), timed("completion"), route.timed():
+                response = self.client.chat.completions.create(
+                    messages=self.GREETING_MESSAGES,
+                    **route.completion_args()
+                )
+            route.record_usage(response.usage)
             
             greeting_message = response.choices[0].message.content.strip()
         except Exception as e:
-            print(f"Error generating initial greeting: {str(e)}")
+            logger.error("Error generating initial greeting: %s", e)
             # Fallback greeting if LLM fails
-            greeting_message = "Hello! I'm Adam, your AI English idioms teacher. I'm here to help you learn and practice idioms in a fun, interactive way!"
+            greeting_message = self.FALLBACK_GREETING
+
+        return self._record_greeting(session_id, session, greeting_message)
+
+    async def aget_initial_greeting(self, session_id: str) -> Dict:
+        """Async variant of get_initial_greeting; session and pool reads run off the event loop."""
+        session = await asyncio.to_thread(self._get_or_create_session, session_id)
+        
+        greeting_message = await asyncio.to_thread(self._pooled_greeting)
+        if greeting_message is not None:
+            return await asyncio.to_thread(self._record_greeting, session_id, session, greeting_message)
+        
+        try:
+            route = self.router.route("intro")
+            async with self.admission.aguard("chat", route.name):
+                with timed("completion"), route.timed():
+                    response = await self.async_client.chat.completions.create(
+                        messages=self.GREETING_MESSAGES,
+                        **route.completion_args()
+                    )
+            route.record_usage(response.usage)
+            greeting_message = response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error("Error generating initial greeting: %s", e)
+            greeting_message = self.FALLBACK_GREETING
 
+        return await asyncio.to_thread(self._record_greeting, session_id, session, greeting_message)
+
+    def _record_greeting(self, session_id: str, session: Dict, greeting_message: str) -> Dict:
+        """Build the greeting response and add it to the conversation history."""
         initial_greeting = {
             "type": "chat",
             "message": greeting_message,
@@ -53,6 +149,7 @@ class TeacherAgent:
             "role": "assistant",
             "content": initial_greeting["message"]
         })
+        self._save_session(session_id, session)
         return initial_greeting
 
     def get_level_question(self, session_id: str) -> Dict:
@@ -72,81 +169,478 @@ class TeacherAgent:
             "role": "assistant",
             "content": level_question["message"]
         })
+        self._save_session(session_id, session)
         return level_question
 
+    async def aget_level_question(self, session_id: str) -> Dict:
+        """Async variant of get_level_question; the session store is read and written off the event loop."""
+        return await asyncio.to_thread(self.get_level_question, session_id)
+
     def _get_or_create_session(self, session_id):
         """Get or create a new user session."""
-        if session_id not in self.user_sessions:
-            self.user_sessions[session_id] = {
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = {
                 "current_state": "greeting",
                 "student_profile": {
                     "level": None,
                     "interests": [],
                     "learned_idioms": set(),
+                    "seen_chunks": IdBitset(),
                     "current_lesson": None
                 },
                 "conversation_history": []
             }
-        return self.user_sessions[session_id]
+        return session
+
+    def _save_session(self, session_id: str, session: Dict) -> None:
+        """Trim the history and write the session back to the store."""
+        session["conversation_history"] = session["conversation_history"][-self.MAX_HISTORY:]
+        self.sessions.set(session_id, session)
 
     def process_message(self, message: str, session_id: str) -> Dict:
         """Process student message and return chatbot-style response."""
         try:
-            if not message or not session_id:
-                print(f"Invalid input - message: {message}, session_id: {session_id}")
-                return self._create_error_response("Missing required input")
-
-            # Get or create user session
-            session = self._get_or_create_session(session_id)
-            
-            print(f"Processing message for session {session_id}, current state: {session['current_state']}")
-            
-            # Add user message to conversation history
-            session["conversation_history"].append({
-                "role": "user",
-                "content": message
-            })
+            session, turns, error = self._begin_turn(message, session_id)
+            if error:
+                return error
             
-            # Generate context from recent conversation
-            context = "\n".join([
-                f"{msg['role']}: {msg['content']}" 
-                for msg in session["conversation_history"][-3:]
-            ])
+            # The simplest states are answered from a template when the reply is predictable
+            result = self._local_result(session, message, self._turn_labels(session, message))
+            if result is not None:
+                return self._finish_turn(session_id, session, result)
+            route = self._state_route(session)
             
             # Create prompt based on current state
             try:
-                if session["current_state"] == "greeting":
-                    prompt = self._create_greeting_prompt(message, context)
-                elif session["current_state"] == "assess_level":
-                    prompt = self._create_assessment_prompt(message, context)
-                elif session["current_state"] == "teach":
-                    prompt = self._create_teaching_prompt(message, context, session["student_profile"])
-                elif session["current_state"] == "practice":
-                    prompt = self._create_practice_prompt(message, context)
-                else:
-                    prompt = self._create_feedback_prompt(message, context, session["student_profile"])
+                prompt = self._create_prompt(message, turns, session)
             except Exception as e:
-                print(f"Error creating prompt: {str(e)}")
+                logger.error("Error creating prompt: %s", e)
+                ERRORS.inc(stage="prompt_build")
                 return self._create_error_response("Error creating response")
             
             # Get response from GPT
             try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": self.orchestrator.system_prompts["learn"]},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
+                with self.admission.guard("chat", route.name), timed("completion"), route.timed():
+                    response = self.client.chat.completions.create(
+                        messages=self._build_messages(prompt),
+                        **route.completion_args()
+                    )
+                route.record_usage(response.usage)
                 
                 # Parse response
-                result = json.loads(response.choices[0].message.content)
+                with timed("parse"):
+                    result = json.loads(response.choices[0].message.content)
+            except Overloaded:
+                raise
             except Exception as e:
-                print(f"Error with OpenAI API or parsing response: {str(e)}")
+                logger.error("Error with OpenAI API or parsing response: %s", e)
+                ERRORS.inc(stage="completion")
                 return self._create_error_response("Error generating response")
             
+            return self._finish_turn(session_id, session, result)
+            
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.exception("Unexpected error in process_message: %s", e)
+            return self._create_error_response("An unexpected error occurred")
+
+    async def aprocess_message(self, message: str, session_id: str) -> Dict:
+        """Async variant of process_message; upstream calls are awaited, not blocking."""
+        try:
+            session, turns, error = await asyncio.to_thread(self._begin_turn, message, session_id)
+            if error:
+                return error
+            
+            result = self._local_result(session, message, await self._aturn_labels(session, message))
+            if result is not None:
+                return await asyncio.to_thread(self._finish_turn, session_id, session, result)
+            route = self._state_route(session)
+            
+            try:
+                if session["current_state"] == "teach":
+                    profile = session["student_profile"]
+                    records = await self.orchestrator.aretrieve_records(
+                        query=self._teaching_query(profile), exclude=self._seen_chunks(profile)
+                    )
+                    prompt = self._create_teaching_prompt(message, turns, profile, records)
+                else:
+                    prompt = self._create_prompt(message, turns, session)
+            except Exception as e:
+                logger.error("Error creating prompt: %s", e)
+                ERRORS.inc(stage="prompt_build")
+                return self._create_error_response("Error creating response")
+            
+            try:
+                async with self.admission.aguard("chat", route.name):
+                    with timed("completion"), route.timed():
+                        response = await self.async_client.chat.completions.create(
+                            messages=self._build_messages(prompt),
+                            **route.completion_args()
+                        )
+                route.record_usage(response.usage)
+                with timed("parse"):
+                    result = json.loads(response.choices[0].message.content)
+            except Overloaded:
+                raise
+            except Exception as e:
+                logger.error("Error with OpenAI API or parsing response: %s", e)
+                ERRORS.inc(stage="completion")
+                return self._create_error_response("Error generating response")
+            
+            return await asyncio.to_thread(self._finish_turn, session_id, session, result)
+            
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.exception("Unexpected error in aprocess_message: %s", e)
+            return self._create_error_response("An unexpected error occurred")
+
+    def stream_message(self, message: str, session_id: str) -> Iterator[Tuple[str, Dict]]:
+        """
+        Process a student message, streaming the reply as it is generated.
+
+        Yields:
+            (event, data) pairs: "message" once the reply text is complete, "idiom"
+            for every taught idiom, then "done" with the full chat response, or
+            "error" with a standard error response
+        """
+        try:
+            session, turns, error = self._begin_turn(message, session_id)
+            if error:
+                yield "error", error
+                return
+            
+            result = self._local_result(session, message, self._turn_labels(session, message))
+            if result is not None:
+                yield "message", {"message": result["message"]}
+                yield "done", self._finish_turn(session_id, session, result)
+                return
+            route = self._state_route(session)
+            
+            try:
+                prompt = self._create_prompt(message, turns, session)
+            except Exception as e:
+                logger.error("Error creating prompt: %s", e)
+                ERRORS.inc(stage="prompt_build")
+                yield "error", self._create_error_response("Error creating response")
+                return
+            
+            try:
+                with self.admission.guard("chat", f"{route.name}:stream") as admitted:
+                    start = time.perf_counter()
+                    stream = self.client.chat.completions.create(
+                        messages=self._build_messages(prompt),
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        **route.completion_args()
+                    )
+                    parser = IncrementalJSONParser(array_keys=("taught_idioms",))
+                    first_token = True
+                    for chunk in stream:
+                        if chunk.usage is not None:
+                            route.record_usage(chunk.usage)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if first_token:
+                                STAGE_SECONDS.observe(time.perf_counter() - start, stage="first_token")
+                                admitted.release()
+                                first_token = False
+                            for key, value in parser.feed(chunk.choices[0].delta.content):
+                                yield ("message", {"message": value}) if key == "message" else ("idiom", value)
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage="completion")
+                    route.observe(time.perf_counter() - start)
+                with timed("parse"):
+                    result = json.loads(parser.buffer)
+            except Overloaded as e:
+                yield "error", {**self._create_error_response("I'm a bit busy right now, please try again in a moment"),
+                                "retry_after": e.retry_after}
+                return
+            except Exception as e:
+                logger.error("Error with OpenAI API or parsing response: %s", e)
+                ERRORS.inc(stage="completion")
+                yield "error", self._create_error_response("Error generating response")
+                return
+            
+            yield "done", self._finish_turn(session_id, session, result)
+            
+        except Exception as e:
+            logger.exception("Unexpected error in stream_message: %s", e)
+            yield "error", self._create_error_response("An unexpected error occurred")
+
+    async def astream_message(self, message: str, session_id: str) -> AsyncIterator[Tuple[str, Dict]]:
+        """Async variant of stream_message."""
+        try:
+            session, turns, error = await asyncio.to_thread(self._begin_turn, message, session_id)
+            if error:
+                yield "error", error
+                return
+            
+            result = self._local_result(session, message, await self._aturn_labels(session, message))
+            if result is not None:
+                yield "message", {"message": result["message"]}
+                yield "done", await asyncio.to_thread(self._finish_turn, session_id, session, result)
+                return
+            route = self._state_route(session)
+            
+            try:
+                if session["current_state"] == "teach":
+                    profile = session["student_profile"]
+                    records = await self.orchestrator.aretrieve_records(
+                        query=self._teaching_query(profile), exclude=self._seen_chunks(profile)
+                    )
+                    prompt = self._create_teaching_prompt(message, turns, profile, records)
+                else:
+                    prompt = self._create_prompt(message, turns, session)
+            except Exception as e:
+                logger.error("Error creating prompt: %s", e)
+                ERRORS.inc(stage="prompt_build")
+                yield "error", self._create_error_response("Error creating response")
+                return
+            
+            try:
+                async with self.admission.aguard("chat", f"{route.name}:stream") as admitted:
+                    start = time.perf_counter()
+                    stream = await self.async_client.chat.completions.create(
+                        messages=self._build_messages(prompt),
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        **route.completion_args()
+                    )
+                    parser = IncrementalJSONParser(array_keys=("taught_idioms",))
+                    first_token = True
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            route.record_usage(chunk.usage)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if first_token:
+                                STAGE_SECONDS.observe(time.perf_counter() - start, stage="first_token")
+                                admitted.release()
+                                first_token = False
+                            for key, value in parser.feed(chunk.choices[0].delta.content):
+                                yield ("message", {"message": value}) if key == "message" else ("idiom", value)
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage="completion")
+                    route.observe(time.perf_counter() - start)
+                with timed("parse"):
+                    result = json.loads(parser.buffer)
+            except Overloaded as e:
+                yield "error", {**self._create_error_response("I'm a bit busy right now, please try again in a moment"),
+                                "retry_after": e.retry_after}
+                return
+            except Exception as e:
+                logger.error("Error with OpenAI API or parsing response: %s", e)
+                ERRORS.inc(stage="completion")
+                yield "error", self._create_error_response("Error generating response")
+                return
+            
+            yield "done", await asyncio.to_thread(self._finish_turn, session_id, session, result)
+            
+        except Exception as e:
+            logger.exception("Unexpected error in astream_message: %s", e)
+            yield "error", self._create_error_response("An unexpected error occurred")
+
+    def _begin_turn(self, message: str, session_id: str):
+        """
+        Validate input and record the student message.
+
+        Returns:
+            Tuple of (session, recent conversation turns, error response or None)
+        """
+        if not message or not session_id:
+            logger.warning("Invalid input - message: %r, session_id: %r", message, session_id)
+            return None, None, self._create_error_response("Missing required input")
+
+        # Get or create user session
+        session = self._get_or_create_session(session_id)
+        
+        logger.debug("Processing message for session %s, current state: %s", session_id, session["current_state"])
+        
+        # Add user message to conversation history
+        session["conversation_history"].append({
+            "role": "user",
+            "content": message
+        })
+        
+        # Recent conversation, oldest first; the packer decides how much of it fits
+        turns = [
+            f"{msg['role']}: {msg['content']}" 
+            for msg in session["conversation_history"][-self.CONTEXT_TURNS:]
+        ]
+        return session, turns, None
+
+    def _pack_context(self, turns: List[str], records: Optional[List[Dict]] = None,
+                      profile: Optional[str] = None) -> Dict[str, List[str]]:
+        """
+        Fit prompt context into the token budget by priority: retrieved records
+        by score, then the most recent turns, then the profile.
+
+        Returns:
+            Texts kept per section ("records", "turns", "profile"), turns oldest first
+        """
+        sections = [
+            Section("records", by_score(records or [])),
+            Section("turns", list(reversed(turns)), contiguous=True),
+            Section("profile", [profile] if profile is not None else [])
+        ]
+        with timed("prompt_build"):
+            packed, _ = self.packer.pack(sections)
+        packed["turns"].reverse()
+        return packed
+
+    def _context(self, turns: List[str]) -> str:
+        return "\n".join(self._pack_context(turns)["turns"])
+
+    # States with their own prompt; any other state gets the feedback prompt
+    PROMPT_STATES = ("greeting", "assess_level", "teach", "practice")
+    LEVELS = ("beginner", "intermediate", "advanced")
+    LEVEL_QUESTION = "What's your English level: beginner, intermediate, or advanced?"
+    INTEREST_SUGGESTIONS = ["business idioms", "casual idioms", "academic idioms"]
+    TOPICS = ("business", "casual", "academic")
+    # Words dropped when normalizing an interest the model reports ("cooking idioms" -> "cooking")
+    INTEREST_FILLER = {"idiom", "idioms", "expression", "expressions", "phrase", "phrases"}
+
+    def _state_route(self, session: Dict) -> Route:
+        state = session["current_state"]
+        return self.router.route(state if state in self.PROMPT_STATES else "feedback")
+
+    def _named_choice(self, message: str, choices: Tuple[str, ...]) -> Optional[str]:
+        words = set(re.findall(r"[a-z]+", message.lower()))
+        named = [choice for choice in choices if choice in words]
+        return named[0] if len(named) == 1 else None
+
+    def _detect_level(self, message: str) -> Optional[str]:
+        """Return the one level the message names, or None if it names none or several."""
+        return self._named_choice(message, self.LEVELS)
+
+    def _detect_interest(self, message: str) -> Optional[str]:
+        """Return the one topic the message names, or None if it names none or several."""
+        return self._named_choice(message, self.TOPICS)
+
+    def _interest_topic(self, interest: str) -> Optional[str]:
+        """One form per interest: the topic it names ("business idioms" -> "business"), else the phrase without "idioms"."""
+        topic = self._detect_interest(interest)
+        if topic is not None:
+            return topic
+        words = [word for word in re.findall(r"[a-z']+", interest.lower()) if word not in self.INTEREST_FILLER]
+        return " ".join(words) or None
+
+    def _add_interests(self, student_profile: Dict, interests: List[str]) -> None:
+        """Record interests in normalized form, once each (earlier entries are normalized too)."""
+        topics = (self._interest_topic(interest) for interest in student_profile["interests"] + list(interests))
+        student_profile["interests"] = list(dict.fromkeys(topic for topic in topics if topic))
+
+    def _classifier_facets(self, session: Dict, message: str) -> List[str]:
+        """Facets of a message left to the local classifier: those its keywords do not settle."""
+        if self.classifier is None:
+            return []
+        state = session["current_state"]
+        # Only answers to the level question are read as levels; a greeting names none
+        if state == "assess_level" and self._state_route(session).template and self._detect_level(message) is None:
+            return ["level"]
+        if state == "teach" and not session["student_profile"]["interests"] and self._detect_interest(message) is None:
+            return ["topic"]
+        return []
+
+    def _turn_labels(self, session: Dict, message: str) -> Dict[str, str]:
+        """
+        Classify a message against the level or topic centroids when the turn
+        needs it, costing one embeddings call instead of a completion.
+
+        Returns:
+            Confident labels per facet; empty when nothing was classified
+        """
+        facets = self._classifier_facets(session, message)
+        if not facets:
+            return {}
+        try:
+            return self.classifier.confident(self.orchestrator.rag.embed_query(message), facets)
+        except Exception as e:
+            # Unlabelled turns go to the model as before
+            logger.warning("Could not classify message: %s", e)
+            return {}
+
+    async def _aturn_labels(self, session: Dict, message: str) -> Dict[str, str]:
+        """Async variant of _turn_labels."""
+        facets = self._classifier_facets(session, message)
+        if not facets:
+            return {}
+        try:
+            return self.classifier.confident(await self.orchestrator.rag.aembed_query(message), facets)
+        except Exception as e:
+            logger.warning("Could not classify message: %s", e)
+            return {}
+
+    def _local_result(self, session: Dict, message: str, labels: Dict[str, str]) -> Optional[Dict]:
+        """
+        Settle what a turn can without a completion call.
+
+        An interest the learner names after the level question, by keyword or
+        confident topic label, is recorded for lesson retrieval. Greeting and
+        assess_level turns are answered from a fixed script when their route
+        allows it: the level question is scripted, and once the learner names
+        a level (or the classifier places the answer confidently) the reply
+        acknowledges it and asks about interests. Other answers go to the
+        model, which can interpret them.
+
+        Args:
+            session: Current session
+            message: Learner's message
+            labels: Confident classifier labels from _turn_labels
+
+        Returns:
+            A result in the same shape the model returns for the state, or None
+        """
+        state = session["current_state"]
+        interest = self._detect_interest(message) or labels.get("topic")
+        if state in ("assess_level", "teach") and interest:
+            self._add_interests(session["student_profile"], [interest])
+
+        route = self._state_route(session)
+        if not route.template or state not in ("greeting", "assess_level"):
+            return None
+        
+        start = time.perf_counter()
+        level = self._detect_level(message) or labels.get("level")
+        if level is not None:
+            result = {
+                "message": f"Great, {level} it is! Which idioms would you like to start with: business, casual, or academic?",
+                "next_state": "teach",
+                "assessment": {"level": level},
+                "suggestions": self.INTEREST_SUGGESTIONS
+            }
+        elif state == "greeting":
+            result = {
+                "message": f"Nice to meet you! {self.LEVEL_QUESTION}",
+                "next_state": "assess_level",
+                "suggestions": list(self.LEVELS)
+            }
+        else:
+            return None
+        route.observe(time.perf_counter() - start, model="template")
+        return result
+
+    def _create_prompt(self, message: str, turns: List[str], session: Dict) -> str:
+        """Create the prompt for the session's current state."""
+        if session["current_state"] == "greeting":
+            return self._create_greeting_prompt(message, turns)
+        elif session["current_state"] == "assess_level":
+            return self._create_assessment_prompt(message, turns)
+        elif session["current_state"] == "teach":
+            return self._create_teaching_prompt(message, turns, session["student_profile"])
+        elif session["current_state"] == "practice":
+            return self._create_practice_prompt(message, turns)
+        else:
+            return self._create_feedback_prompt(message, turns, session["student_profile"])
+
+    def _build_messages(self, prompt: str) -> List[Dict]:
+        return [
+            {"role": "system", "content": self.orchestrator.system_prompts["learn"]},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _finish_turn(self, session_id: str, session: Dict, result: Dict) -> Dict:
+        """Apply the model result to the session and format the chat response."""
+        with timed("session_update"):
             # Update session state and profile
             self._update_session(session, result)
             
@@ -158,12 +652,9 @@ class TeacherAgent:
                 "role": "assistant",
                 "content": chat_response["message"]
             })
-            
-            return chat_response
-            
-        except Exception as e:
-            print(f"Unexpected error in process_message: {str(e)}")
-            return self._create_error_response("An unexpected error occurred")
+            self._save_session(session_id, session)
+        
+        return chat_response
 
     def _update_session(self, session: Dict, result: Dict) -> None:
         """Update session state and student profile based on response."""
@@ -174,7 +665,7 @@ class TeacherAgent:
         if result.get("detected_level"):
             session["student_profile"]["level"] = result["detected_level"]
         if result.get("detected_interests"):
-            session["student_profile"]["interests"].extend(result["detected_interests"])
+            self._add_interests(session["student_profile"], result["detected_interests"])
         if result.get("taught_idioms"):
             session["student_profile"]["learned_idioms"].update(
                 [idiom["phrase"] for idiom in result["taught_idioms"]]
@@ -182,8 +673,8 @@ class TeacherAgent:
         if result.get("assessment"):
             session["student_profile"].update(result["assessment"])
 
-    def _create_greeting_prompt(self, message: str, context: str) -> str:
-        return f"""Context: {context}
+    def _create_greeting_prompt(self, message: str, turns: List[str]) -> str:
+        return f"""Context: {self._context(turns)}
         Student message: "{message}"
         Current state: greeting
         
@@ -198,8 +689,8 @@ class TeacherAgent:
         }}
         """
     
-    def _create_assessment_prompt(self, message: str, context: str) -> str:
-        return f"""Context: {context}
+    def _create_assessment_prompt(self, message: str, turns: List[str]) -> str:
+        return f"""Context: {self._context(turns)}
         Student message: "{message}"
         Current state: assess_level
         
@@ -217,16 +708,39 @@ class TeacherAgent:
         }}
         """
     
-    def _create_teaching_prompt(self, message: str, context: str, student_profile: Dict) -> str:
-        idioms = self.orchestrator.retrieve_idioms(
-            query=f"idioms about {' '.join(student_profile['interests'])} for {student_profile['level']} level"
+    def _teaching_query(self, student_profile: Dict) -> str:
+        return f"idioms about {' '.join(student_profile['interests'])} for {student_profile['level']} level"
+
+    def _seen_chunks(self, student_profile: Dict) -> IdBitset:
+        # Sessions saved before seen chunks were tracked start with none
+        return student_profile.setdefault("seen_chunks", IdBitset())
+
+    def _create_teaching_prompt(self, message: str, turns: List[str], student_profile: Dict,
+                                records: Optional[List[Dict]] = None) -> str:
+        # Retrieval only: the lesson itself is the single completion for this turn
+        seen = self._seen_chunks(student_profile)
+        if records is None:
+            records = self.orchestrator.retrieve_records(query=self._teaching_query(student_profile), exclude=seen)
+        # Chunks shown once are skipped by later lessons, so each lesson draws on new material
+        seen.add(record["id"] for record in records)
+        packed = self._pack_context(
+            turns,
+            records=records,
+            profile=", ".join(sorted(student_profile["learned_idioms"])) or "none"
         )
+        reference = "\n---\n".join(packed["records"]) or "(none available)"
+        already_taught = packed["profile"][0] if packed["profile"] else "(omitted)"
+        context = "\n".join(packed["turns"])
         
         return f"""Context: {context}
         Student message: "{message}"
         Student level: {student_profile['level']}
+        Already taught: {already_taught}
+        
+        Reference material from the idioms dictionary:
+        {reference}
         
-        Teach ONE idiom clearly and concisely.
+        Teach ONE idiom from the reference material that has not been taught yet, clearly and concisely.
         Include: meaning and one short example.
         Keep total response under 3 sentences.
         
@@ -244,8 +758,8 @@ class TeacherAgent:
         }}
         """
     
-    def _create_practice_prompt(self, message: str, context: str) -> str:
-        return f"""Context: {context}
+    def _create_practice_prompt(self, message: str, turns: List[str]) -> str:
+        return f"""Context: {self._context(turns)}
         Student message: "{message}"
         
         Give brief feedback and ONE new practice opportunity.
@@ -259,9 +773,15 @@ class TeacherAgent:
         }}
         """
     
-    def _create_feedback_prompt(self, message: str, context: str, student_profile: Dict) -> str:
+    def _create_feedback_prompt(self, message: str, turns: List[str], student_profile: Dict) -> str:
+        profile = {key: value for key, value in student_profile.items() if key != "seen_chunks"}
+        profile = json.dumps({**profile, "learned_idioms": sorted(student_profile["learned_idioms"])})
+        packed = self._pack_context(turns, profile=profile)
+        context = "\n".join(packed["turns"])
+        profile = packed["profile"][0] if packed["profile"] else "(omitted)"
+        
         return f"""Context: {context}
-        Student profile: {json.dumps(student_profile)}
+        Student profile: {profile}
         
         Give brief encouragement and suggest next topic.
         Keep response under 2 sentences.
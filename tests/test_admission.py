@@ -0,0 +1,180 @@
+import asyncio
+import threading
+
+import httpx
+import openai
+import pytest
+
+from admission import AdaptiveLimiter, AdmissionController, CircuitBreaker, CircuitOpen, Overloaded
+
+
+def upstream_error() -> openai.APIConnectionError:
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://upstream/v1/chat/completions"))
+
+
+def controller(limiter: AdaptiveLimiter = None, breaker: CircuitBreaker = None) -> AdmissionController:
+    return AdmissionController({"chat": limiter or AdaptiveLimiter("chat")},
+                               {"chat": breaker or CircuitBreaker("chat")})
+
+
+def test_mixed_latency_keeps_limit():
+    # Fast reranks and slow lessons interleaved: each is only compared with its own kind
+    limiter = AdaptiveLimiter("chat", initial_limit=16)
+    for _ in range(200):
+        for kind, latency in (("rerank", 0.05), ("teach", 1.0), ("rerank", 0.06), ("teach", 1.2)):
+            limiter.acquire()
+            limiter.release(latency, kind=kind)
+    assert limiter.limit >= 16
+    assert set(limiter.stats()["baseline_seconds"]) == {"rerank", "teach"}
+
+
+def test_slow_calls_of_one_kind_shrink_limit():
+    limiter = AdaptiveLimiter("chat", initial_limit=16)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.05, kind="rerank")
+    limit = limiter.limit
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(1.0, kind="rerank")
+    assert limiter.limit < limit
+
+
+def test_stream_releases_at_first_token():
+    limiter = AdaptiveLimiter("chat", initial_limit=2, min_limit=1)
+    admission = controller(limiter)
+    with admission.guard("chat", "search:stream") as admitted:
+        assert limiter.inflight == 1
+        admitted.release()
+        assert limiter.inflight == 0
+        # A client-side failure after the release says nothing about upstream
+        with pytest.raises(ValueError):
+            with admission.guard("chat", "search") as inner:
+                inner.release()
+                raise ValueError("client went away")
+    assert limiter.inflight == 0
+    assert set(limiter.baselines) == {"search:stream", "search"}
+
+
+def test_queue_timeout_raises_overloaded():
+    limiter = AdaptiveLimiter("chat", initial_limit=1, min_limit=1, queue_timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(Overloaded):
+        limiter.acquire()
+    limiter.release()
+    assert limiter.inflight == 0 and limiter.stats()["queued"] == 0
+
+
+def test_queued_caller_gets_freed_slot():
+    limiter = AdaptiveLimiter("chat", initial_limit=1, min_limit=1, queue_timeout=2.0)
+    limiter.acquire()
+    admitted = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), admitted.set()))
+    waiter.start()
+    assert not admitted.wait(0.05)
+    limiter.release(0.01)
+    waiter.join(1)
+    assert admitted.is_set() and limiter.inflight == 1
+
+
+def test_half_open_admits_single_probe():
+    breaker = CircuitBreaker("chat", failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.check() is True
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.check() is False
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("chat", failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.reset_timeout = 0.0
+    admission = controller(breaker=breaker)
+    with pytest.raises(openai.APIConnectionError):
+        with admission.guard("chat"):
+            raise upstream_error()
+    breaker.reset_timeout = 60.0
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+
+def test_probe_without_verdict_lets_next_probe_through():
+    breaker = CircuitBreaker("chat", failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    admission = controller(breaker=breaker)
+    with pytest.raises(ValueError):
+        with admission.guard("chat"):
+            raise ValueError("bad response format")
+    assert breaker.check() is True
+
+
+def test_async_guard_probe_then_close():
+    breaker = CircuitBreaker("chat", failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    admission = controller(breaker=breaker)
+
+    async def probe():
+        async with admission.aguard("chat", "search"):
+            with pytest.raises(CircuitOpen):
+                async with admission.aguard("chat", "search"):
+                    pass
+
+    asyncio.run(probe())
+    assert breaker.state == "closed"
+
+
+def chunks(fail_after: int):
+    """An upstream stream whose connection drops after some chunks."""
+    for i in range(fail_after):
+        yield f"chunk {i}"
+    raise httpx.ReadError("connection reset by peer")
+
+
+def consume(admission: AdmissionController, stream) -> list:
+    received = []
+    with admission.guard("chat", "search:stream") as admitted:
+        for chunk in stream:
+            if not received:
+                admitted.release()
+            received.append(chunk)
+    return received
+
+
+def test_stream_failing_after_first_chunk_reaches_breaker_and_limiter():
+    limiter = AdaptiveLimiter("chat", initial_limit=16)
+    breaker = CircuitBreaker("chat", failure_threshold=2)
+    admission = controller(limiter, breaker)
+    for _ in range(2):
+        with pytest.raises(httpx.ReadError):
+            consume(admission, chunks(fail_after=3))
+    assert limiter.inflight == 0
+    assert limiter.limit < 16
+    assert breaker.state == "open"
+
+
+def test_completed_stream_closes_half_open_breaker():
+    breaker = CircuitBreaker("chat", failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    admission = controller(breaker=breaker)
+    assert consume(admission, iter(["a", "b"])) == ["a", "b"]
+    assert breaker.state == "closed"
+
+
+def test_async_stream_failing_midway_is_reported():
+    breaker = CircuitBreaker("chat", failure_threshold=1)
+    admission = controller(breaker=breaker)
+
+    async def stream():
+        async with admission.aguard("chat", "search:stream") as admitted:
+            admitted.release()
+            await asyncio.sleep(0)
+            raise httpx.RemoteProtocolError("peer closed connection without sending complete message body")
+
+    with pytest.raises(httpx.RemoteProtocolError):
+        asyncio.run(stream())
+    assert breaker.state == "open"
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import app as flask_app
+import asgi as quart_app
+
+
+class StubRAG:
+    def __init__(self):
+        self.calls = []
+
+    def query_batch(self, queries, top_k=5, max_concurrency=8):
+        self.calls.append((queries, top_k, max_concurrency))
+        return [{"query": query, "status": "success", "response": {"idioms": []}} for query in queries]
+
+
+@pytest.fixture(params=["flask", "quart"])
+def post_batch(request, monkeypatch):
+    """POST a JSON body to /batch on either server, returning (status code, JSON body, stub)."""
+    module = flask_app if request.param == "flask" else quart_app
+    rag = StubRAG()
+    # Skip loading the index: the route only needs rag
+    monkeypatch.setattr(module, "services", object())
+    monkeypatch.setattr(module, "rag", rag)
+
+    if module is flask_app:
+        def post(body):
+            response = flask_app.app.test_client().post("/batch", json=body)
+            return response.status_code, response.get_json(), rag
+    else:
+        def post(body):
+            async def call():
+                response = await quart_app.app.test_client().post("/batch", json=body)
+                return response.status_code, await response.get_json()
+            return (*asyncio.run(call()), rag)
+    return post
+
+
+def test_batch_keeps_order(post_batch):
+    status, body, rag = post_batch({"queries": [" break the ice ", "spill the beans"], "top_k": "3"})
+    assert status == 200
+    assert [result["query"] for result in body["results"]] == ["break the ice", "spill the beans"]
+    assert rag.calls[0][1] == 3
+
+
+def test_concurrency_is_capped(post_batch):
+    _, _, rag = post_batch({"queries": ["a"], "max_concurrency": 10 ** 6})
+    assert rag.calls[0][2] == flask_app.MAX_BATCH_CONCURRENCY
+
+
+@pytest.mark.parametrize("body", [
+    {"queries": []},
+    {"queries": ["ok", ""]},
+    {"queries": "break the ice"},
+    {"queries": ["a"], "top_k": "five"},
+    {"queries": ["a"], "top_k": None},
+    {"queries": ["a"], "top_k": 0},
+    {"queries": ["a"], "max_concurrency": [2]}
+])
+def test_invalid_requests_get_400(post_batch, body):
+    status, response, rag = post_batch(body)
+    assert status == 400 and response["status"] == "error"
+    assert rag.calls == []
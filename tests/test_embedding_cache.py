@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def rows(path: str) -> dict:
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT key, last_used FROM embeddings").fetchall())
+
+
+def test_disk_hit_is_shared_and_writes_nothing(tmp_path):
+    path = str(tmp_path / "cache.db")
+    EmbeddingCache(path).put("Break  the ice", "m", np.ones(4))
+    before = rows(path)
+
+    cache = EmbeddingCache(path, warm_size=0)
+    assert cache.get("break the ice", "m").tolist() == [1.0] * 4
+    assert cache.disk_hits == 1
+    assert rows(path) == before
+
+
+def test_purge_flushes_hits_and_caps_rows(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path, warm_size=0, max_disk_entries=2, purge_interval=3600)
+    for query in ("a", "b", "c"):
+        cache.put(query, "m", np.ones(2))
+    assert len(rows(path)) == 3
+
+    reader = EmbeddingCache(path, warm_size=0, max_disk_entries=None)
+    assert reader.get("a", "m") is not None
+    reader.purge_interval = 0
+    reader.put("d", "m", np.ones(2))
+    # "a" was hit after "b" and "c" were written, so it outlives them
+    cache.max_disk_entries, cache.purge_interval = 3, 0
+    cache.put("e", "m", np.ones(2))
+    assert set(rows(path)) == {"m:a", "m:d", "m:e"}
+
+
+def test_expired_rows_are_purged(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path, ttl=0.05, purge_interval=0)
+    cache.put("a", "m", np.ones(2))
+    time.sleep(0.1)
+    cache.put("b", "m", np.ones(2))
+    assert set(rows(path)) == {"m:b"}
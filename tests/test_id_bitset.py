@@ -0,0 +1,50 @@
+import faiss
+import numpy as np
+import pytest
+
+from id_bitset import IdBitset
+from index_backends import search_parameters
+
+
+def test_text_round_trip():
+    seen = IdBitset()
+    seen.add([0, 7, 8, 1000])
+    restored = IdBitset.from_text(seen.to_text())
+    assert len(restored) == 4
+    assert restored.contains([0, 1, 7, 8, 9, 1000, 1001]).tolist() == [True, False, True, True, False, True, False]
+    assert IdBitset.from_text(None).to_text() == IdBitset.from_text("").to_text() == ""
+
+
+def test_contains_out_of_range_and_negative():
+    seen = IdBitset()
+    seen.add([3])
+    assert 3 in seen and 4 not in seen and 10 ** 6 not in seen and -1 not in seen
+
+
+def test_union():
+    small, large = IdBitset(), IdBitset()
+    small.add([1])
+    large.add([2, 500])
+    union = small | large
+    assert len(union) == 3 and 500 in union and 1 in union
+    assert len(small) == 1
+
+
+def test_rejects_negative_ids():
+    with pytest.raises(ValueError):
+        IdBitset().add([-5])
+
+
+def test_exclusion_selector_skips_seen_ids():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 8)).astype("float32")
+    ids = np.arange(100, 150, dtype=np.int64)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(8))
+    index.add_with_ids(vectors, ids)
+
+    _, nearest = index.search(vectors[:1], 5)
+    seen = IdBitset()
+    seen.add(nearest[0][:3])
+    _, filtered = index.search(vectors[:1], 5, params=search_parameters(index, seen.exclusion_selector()))
+    assert not set(filtered[0]) & set(nearest[0][:3])
+    assert filtered[0][:2].tolist() == nearest[0][3:].tolist()
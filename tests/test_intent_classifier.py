@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from intent_classifier import OTHER_LABEL, IntentClassifier
+
+DIMENSION = 8
+
+
+def unit(*weights: float) -> np.ndarray:
+    vector = np.zeros(DIMENSION, dtype=np.float32)
+    vector[:len(weights)] = weights
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def classifier() -> IntentClassifier:
+    # Axes 0-2 are the topics, 3 is the null class; axes 4+ are about nothing the classifier knows
+    topics = (["business", "casual", "academic", OTHER_LABEL],
+              np.stack([unit(1), unit(0, 1), unit(0, 0, 1), unit(0, 0, 0, 1)]))
+    tones = (["neutral", OTHER_LABEL], np.stack([unit(0, 0, 0, 0, 0, 0, 1), unit(0, 0, 0, 1)]))
+    return IntentClassifier({"topic": topics, "tone": tones}, threshold=0.8, min_similarity=0.75)
+
+
+def test_close_to_one_label_is_confident(classifier):
+    assert classifier.confident(unit(0.95, 0.1, 0.05), ["topic"]) == {"topic": "business"}
+
+
+def test_between_labels_is_unsure(classifier):
+    assert classifier.confident(unit(1, 1), ["topic"]) == {}
+
+
+def test_off_topic_is_unsure_despite_softmax(classifier):
+    # Nearest centroid by far, so the softmax alone is certain, but the similarity is low
+    off_topic = unit(0.3, 0, 0, 0, 1, 1)
+    label, confidence, similarity = classifier.classify(off_topic, ["topic"])["topic"]
+    assert label == "business" and confidence > 0.99 and similarity < 0.75
+    assert classifier.confident(off_topic, ["topic"]) == {}
+    classifier.min_similarity = 0.0
+    assert classifier.confident(off_topic, ["topic"]) == {"topic": "business"}
+
+
+def test_other_label_is_never_returned(classifier):
+    assert classifier.classify(unit(0, 0, 0, 1))["topic"][0] == OTHER_LABEL
+    assert classifier.confident(unit(0, 0, 0, 1)) == {}
+
+
+def test_chunk_labels_use_the_same_rule(classifier):
+    embeddings = np.stack([unit(1), unit(0.3, 0, 0, 0, 1, 1), unit(0, 0, 0, 1), unit(0, 0, 1)])
+    classifier.label_chunks([10, 11, 12, 13], embeddings)
+    assert classifier.chunk_labels["topic"].tolist() == [0, -1, -1, 2]
+    excluded = classifier.partition_exclusion({"topic": "business"})
+    assert [doc_id in excluded for doc_id in (10, 11, 12, 13)] == [False, False, False, True]
+
+
+def test_write_and_load_round_trip(classifier, tmp_path):
+    classifier.label_chunks([1, 2], np.stack([unit(1), unit(0, 1)]))
+    path = str(tmp_path / "index.labels.npz")
+    classifier.write(path)
+    loaded = IntentClassifier.load(path, threshold=0.8, min_similarity=0.75)
+    assert loaded.centroids["topic"][0] == classifier.centroids["topic"][0]
+    assert loaded.chunk_ids.tolist() == [1, 2]
+    assert loaded.confident(unit(0, 1), ["topic"]) == {"topic": "casual"}
+
+
+def test_floor_and_model_travel_with_centroids(classifier, tmp_path):
+    path = str(tmp_path / "index.labels.npz")
+    classifier.min_similarity, classifier.embedding_model = 0.3, "text-embedding-3-small"
+    classifier.write(path)
+    loaded = IntentClassifier.load(path, embedding_model="text-embedding-3-small")
+    assert loaded.min_similarity == pytest.approx(0.3)
+    assert loaded.embedding_model == "text-embedding-3-small"
+    assert IntentClassifier.load(path, min_similarity=0.5).min_similarity == 0.5
+
+
+def test_centroids_from_another_model_are_refused(classifier, tmp_path):
+    path = str(tmp_path / "index.labels.npz")
+    classifier.embedding_model = "text-embedding-ada-002"
+    classifier.write(path)
+    with pytest.raises(ValueError, match="text-embedding-3-large"):
+        IntentClassifier.load(path, embedding_model="text-embedding-3-large")
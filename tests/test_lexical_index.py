@@ -0,0 +1,67 @@
+import pytest
+
+from id_bitset import IdBitset
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, stem, tokenize
+
+DOCS = {
+    10: "Make ends meet: to earn just enough money to live on.",
+    11: "She works two jobs and still barely makes ends meet.",
+    12: "Break the ice: to start a conversation in an awkward situation.",
+    13: "He told a joke to break the ice at the meeting.",
+    14: "Spill the beans: to reveal a secret."
+}
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory) -> LexicalIndex:
+    path = str(tmp_path_factory.mktemp("lexical") / "index")
+    LexicalIndex.write(path, list(DOCS), list(DOCS.values()))
+    return LexicalIndex(path)
+
+
+@pytest.mark.parametrize("words", [
+    ("make", "makes", "making"),
+    ("ride", "rides", "riding"),
+    ("break", "breaks", "breaking"),
+    ("spill", "spills", "spilled", "spilling"),
+    ("hope", "hopes", "hoped", "hoping"),
+    ("run", "runs", "running"),
+    ("cry", "cries", "cried"),
+    ("tie", "ties", "tied"),
+    ("box", "boxes"),
+    ("house", "houses")
+])
+def test_inflections_share_a_stem(words):
+    assert len({stem(word) for word in words}) == 1
+
+
+def test_short_words_are_kept():
+    assert [stem(word) for word in ("is", "was", "this", "bus", "gas")] == ["is", "was", "this", "bus", "gas"]
+
+
+def test_tokenize_idiom_variants():
+    assert tokenize("make ends meet") == tokenize("makes ends meet") == tokenize("Making ends meet")
+    assert tokenize("the dog's bone") == ["the", "dog", "bone"]
+
+
+@pytest.mark.parametrize("query", ["make ends meet", "makes ends meet", "making ends meet"])
+def test_phrase_search_matches_every_inflection(index, query):
+    assert {doc_id for doc_id, _ in index.phrase_search(query)} == {10, 11}
+
+
+def test_phrase_search_needs_contiguous_words(index):
+    assert index.phrase_search("ice break") == []
+    assert index.phrase_search("ice") == []
+
+
+def test_exclude(index):
+    assert [doc_id for doc_id, _ in index.search("break the ice", top_k=5)][:2] in ([12, 13], [13, 12])
+    seen = IdBitset()
+    seen.add([12])
+    assert 12 not in {doc_id for doc_id, _ in index.search("break the ice", exclude=seen)}
+    assert [doc_id for doc_id, _ in index.phrase_search("breaking the ice", exclude=seen)] == [13]
+
+
+def test_reciprocal_rank_fusion_prefers_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [2, 3, 1], [2]])
+    assert fused[0][0] == 2
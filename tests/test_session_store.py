@@ -0,0 +1,69 @@
+import pytest
+
+from id_bitset import IdBitset
+from session_store import MemorySessionStore, SessionStore, SQLiteSessionStore, create_session_store
+
+
+def session() -> dict:
+    seen = IdBitset()
+    seen.add([3, 41])
+    return {
+        "current_state": "teach",
+        "student_profile": {"level": "beginner", "interests": ["business"],
+                            "learned_idioms": {"break the ice"}, "seen_chunks": seen}
+    }
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path) -> SessionStore:
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+
+def test_incomplete_backend_cannot_be_created():
+    class WriteOnly(SessionStore):
+        def set(self, session_id, session):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnly()
+
+
+def test_round_trip(store):
+    store.set("s1", session())
+    loaded = store.get("s1")
+    profile = loaded["student_profile"]
+    assert loaded["current_state"] == "teach"
+    assert profile["learned_idioms"] == {"break the ice"}
+    assert 41 in profile["seen_chunks"] and len(profile["seen_chunks"]) == 2
+
+
+def test_missing_and_deleted(store):
+    assert store.get("absent") is None
+    store.set("s1", session())
+    store.delete("s1")
+    store.delete("s1")
+    assert store.get("s1") is None
+
+
+def test_expired_sessions_are_not_returned(tmp_path):
+    for expiring in (MemorySessionStore(ttl=-1), SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=-1)):
+        expiring.set("s1", session())
+        assert expiring.get("s1") is None
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2)
+    for session_id in ("a", "b"):
+        store.set(session_id, session())
+    store.get("a")
+    store.set("c", session())
+    assert store.get("b") is None and store.get("a") is not None
+
+
+def test_create_from_url(tmp_path):
+    assert isinstance(create_session_store("memory://"), MemorySessionStore)
+    assert isinstance(create_session_store(f"sqlite:///{tmp_path}/sessions.db"), SQLiteSessionStore)
+    with pytest.raises(ValueError):
+        create_session_store("redis://localhost")
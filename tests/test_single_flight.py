@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import Overloaded
+from single_flight import TEXT_CODEC, SQLiteFlightStore, SingleFlight
+
+
+def run_in_thread(fn, results, name):
+    def target():
+        try:
+            results[name] = ("ok", fn())
+        except Exception as e:
+            results[name] = ("error", e)
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def slow_call(calls, started, release, value="value"):
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return value
+    return fn
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls, started, release, results = [], threading.Event(), threading.Event(), {}
+    leader = run_in_thread(lambda: flight.do("k", slow_call(calls, started, release)), results, "leader")
+    started.wait(5)
+    followers = [run_in_thread(lambda: flight.do("k", slow_call(calls, started, release)), results, i)
+                 for i in range(4)]
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert len(calls) == 1
+    assert all(outcome == ("ok", "value") for outcome in results.values())
+
+
+def test_followers_receive_the_leaders_error():
+    flight = SingleFlight()
+    started, release, results = threading.Event(), threading.Event(), {}
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    leader = run_in_thread(lambda: flight.do("k", failing), results, "leader")
+    started.wait(5)
+    follower = run_in_thread(lambda: flight.do("k", lambda: "unused"), results, "follower")
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(results["leader"][1], ValueError)
+    assert results["follower"][1] is results["leader"][1]
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_finished_calls_are_not_replayed(tmp_path, shared):
+    store = SQLiteFlightStore(str(tmp_path / "flights.db")) if shared else None
+    flight = SingleFlight(store=store)
+
+    def failing():
+        raise Exception("transient 500")
+
+    with pytest.raises(Exception, match="transient 500"):
+        flight.do("k", failing, codec=TEXT_CODEC)
+    # A later call, even moments after, runs again instead of getting the stored outcome
+    assert flight.do("k", lambda: "fresh", codec=TEXT_CODEC) == "fresh"
+    assert flight.do("k", lambda: "again", codec=TEXT_CODEC) == "again"
+
+
+def test_workers_follow_a_running_flight(tmp_path):
+    path = str(tmp_path / "flights.db")
+    worker_a = SingleFlight(store=SQLiteFlightStore(path), poll_interval=0.01)
+    worker_b = SingleFlight(store=SQLiteFlightStore(path), poll_interval=0.01)
+    calls, started, release, results = [], threading.Event(), threading.Event(), {}
+    leader = run_in_thread(lambda: worker_a.do("k", slow_call(calls, started, release), codec=TEXT_CODEC),
+                           results, "a")
+    started.wait(5)
+    follower = run_in_thread(lambda: worker_b.do("k", slow_call(calls, started, release), codec=TEXT_CODEC),
+                             results, "b")
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(calls) == 1
+    assert results == {"a": ("ok", "value"), "b": ("ok", "value")}
+
+
+def test_shared_errors_keep_overloaded_type(tmp_path):
+    path = str(tmp_path / "flights.db")
+    worker_a = SingleFlight(store=SQLiteFlightStore(path), poll_interval=0.01)
+    worker_b = SingleFlight(store=SQLiteFlightStore(path), poll_interval=0.01)
+    started, release, results = threading.Event(), threading.Event(), {}
+
+    def overloaded():
+        started.set()
+        release.wait(5)
+        raise Overloaded("Too many chat calls queued", retry_after=3)
+
+    leader = run_in_thread(lambda: worker_a.do("k", overloaded, codec=TEXT_CODEC), results, "a")
+    started.wait(5)
+    follower = run_in_thread(lambda: worker_b.do("k", lambda: "unused", codec=TEXT_CODEC), results, "b")
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    error = results["b"][1]
+    assert isinstance(error, Overloaded)
+    assert error.retry_after == 3
+
+
+def test_follower_times_out():
+    flight = SingleFlight(timeout=0.1)
+    started, release, results = threading.Event(), threading.Event(), {}
+    leader = run_in_thread(lambda: flight.do("k", slow_call([], started, release)), results, "leader")
+    started.wait(5)
+    with pytest.raises(TimeoutError):
+        flight.do("k", lambda: "unused")
+    release.set()
+    leader.join(5)
+
+
+def test_async_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("k", fetch) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.1)
+        return "value"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.ado("k", fetch))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.ado("k", fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "value"
+
+
+def test_async_store_calls_run_off_the_event_loop(tmp_path):
+    threads = set()
+
+    class RecordingStore(SQLiteFlightStore):
+        def claim(self, key, ttl):
+            threads.add(threading.get_ident())
+            return super().claim(key, ttl)
+
+        def finish(self, key, flight, status, payload):
+            threads.add(threading.get_ident())
+            super().finish(key, flight, status, payload)
+
+    flight = SingleFlight(RecordingStore(str(tmp_path / "flights.db")))
+
+    async def call():
+        return await flight.ado("k", lambda: asyncio.sleep(0, result="value"), codec=TEXT_CODEC)
+
+    assert asyncio.run(call()) == "value"
+    assert threads and threading.get_ident() not in threads
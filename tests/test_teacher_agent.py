@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+from session_store import MemorySessionStore
+from teacher_agent import TeacherAgent
+
+
+def agent() -> TeacherAgent:
+    # Interest bookkeeping needs no clients or stores
+    return TeacherAgent.__new__(TeacherAgent)
+
+
+def test_interests_are_normalized_and_deduplicated():
+    teacher, profile = agent(), {"interests": [], "level": "beginner"}
+    teacher._add_interests(profile, ["business"])
+    teacher._update_session({"current_state": "teach", "student_profile": profile},
+                            {"detected_interests": ["business idioms", "Cooking expressions"]})
+    assert profile["interests"] == ["business", "cooking"]
+    assert teacher._teaching_query(profile) == "idioms about business cooking for beginner level"
+
+
+def test_old_sessions_are_cleaned_up():
+    teacher, profile = agent(), {"interests": ["business", "business idioms"]}
+    teacher._add_interests(profile, ["idioms"])
+    assert profile["interests"] == ["business"]
+
+
+def test_async_session_access_runs_off_the_event_loop():
+    threads = set()
+
+    class RecordingStore(MemorySessionStore):
+        def get(self, session_id):
+            threads.add(threading.get_ident())
+            return super().get(session_id)
+
+        def set(self, session_id, session):
+            threads.add(threading.get_ident())
+            super().set(session_id, session)
+
+    teacher = agent()
+    teacher.sessions = RecordingStore()
+    response = asyncio.run(teacher.aget_level_question("s1"))
+    # asyncio.run drives the loop on this thread, so the store was used from another one
+    assert threads and threading.get_ident() not in threads
+    assert teacher.sessions.get("s1")["conversation_history"][-1]["content"] == response["message"]